@@ -0,0 +1,53 @@
+"""audio files indexes
+
+Revision ID: 6d78b609b642
+Revises: fef7e2ee5a9c
+Create Date: 2026-10-16 23:18:17.120919
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d78b609b642'
+down_revision: Union[str, None] = 'fef7e2ee5a9c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FOREIGN_KEY_TABLES = ('audio_files', 'upload_sessions')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Уникальные ограничения на id дублируют первичный ключ и строят второй индекс.
+    # Внешние ключи на users.id могли быть привязаны к такому индексу, поэтому
+    # они пересоздаются поверх users_pkey (NOT VALID + VALIDATE, чтобы не блокировать запись).
+    for table in FOREIGN_KEY_TABLES:
+        op.drop_constraint(f'{table}_user_id_fkey', table, type_='foreignkey')
+    for table in ('audio_files', 'users'):
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_id_key')
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_id_key1')
+    for table in FOREIGN_KEY_TABLES:
+        op.create_foreign_key(
+            f'{table}_user_id_fkey', table, 'users', ['user_id'], ['id'], postgresql_not_valid=True
+        )
+        op.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_user_id_fkey')
+
+    # Индекс под выборку файлов пользователя с keyset-пагинацией по id.
+    # Строится конкурентно, чтобы не блокировать загрузки на большой таблице.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_audio_files_user_id_id', 'audio_files', ['user_id', 'id'], unique=False,
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_audio_files_user_id_id', table_name='audio_files', postgresql_concurrently=True)
+    op.create_unique_constraint('users_id_key', 'users', ['id'])
+    op.create_unique_constraint('audio_files_id_key', 'audio_files', ['id'])
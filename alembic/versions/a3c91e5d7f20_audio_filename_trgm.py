@@ -0,0 +1,39 @@
+"""audio filename trigram index
+
+Revision ID: a3c91e5d7f20
+Revises: 479f7becb2de
+Create Date: 2026-10-17 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c91e5d7f20'
+down_revision: Union[str, None] = '479f7becb2de'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Расширение создаётся от пользователя с правом CREATE в базе (в PostgreSQL 13+ pg_trgm доверенное)
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # Поиск по файлам пользователя объединяет этот индекс с ix_audio_files_user_id_id (BitmapAnd),
+    # поэтому составной GIN-индекс с user_id (требует btree_gin) не нужен. Индекс строится конкурентно.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_audio_files_filename_trgm', 'audio_files', ['filename'], unique=False,
+            postgresql_using='gin', postgresql_ops={'filename': 'gin_trgm_ops'},
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_audio_files_filename_trgm', table_name='audio_files', postgresql_concurrently=True)
+    # Расширение не удаляется: его могут использовать другие объекты базы
@@ -0,0 +1,245 @@
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from backend.auth import decode_token
+from backend.metrics import (UPLOAD_QUEUE_DEPTH, UPLOAD_QUEUE_WAIT, UPLOAD_REJECTIONS, UPLOAD_THROTTLED_SECONDS,
+                             UPLOADS_ADMITTED)
+
+# Запросы, которые принимают тело загрузки: одиночная и пакетная загрузка и части возобновляемой
+UPLOAD_ROUTES = (
+    ("POST", re.compile(r"/api/file/upload(/batch)?")),
+    ("PATCH", re.compile(r"/api/file/resumable/[^/]+")),
+)
+
+
+class AdmissionRejected(Exception):
+    """
+    Загрузка не допущена: превышен лимит пользователя, очередь заполнена или ожидание истекло.
+    """
+
+    def __init__(self, status_code: int, detail: str, reason: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости "ведро токенов": rate байт в секунду с запасом до capacity байт.
+
+    Токены списываются сразу, даже если их не хватает, а запрос ждёт, пока долг восполнится.
+    Поэтому несколько одновременных загрузок пользователя вместе не превышают rate.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def consume(self, amount: int) -> float:
+        """
+        Списывает amount токенов и ждёт, если их не хватило.
+
+        :return: Время ожидания в секундах
+        """
+        self._refill()
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+
+class UploadAdmission:
+    """
+    Допуск загрузок к приёму тела: общий лимит и лимит пользователя на одновременные загрузки,
+    ограниченная очередь ожидания и ограничение скорости приёма для каждого пользователя.
+
+    Загрузка, для которой нет свободного места, ждёт в очереди (FIFO) не дольше queue_timeout секунд.
+    Если очередь заполнена или ожидание истекло, загрузка сразу отклоняется с 503, чтобы клиент
+    повторил её позже, а не держал соединение. Пользователь, у которого уже max_per_user загрузок
+    принимается или ждёт, получает 429: один клиент не может занять всю очередь.
+
+    Состояние хранится в памяти процесса, поэтому при нескольких процессах (backend.server)
+    лимиты действуют в каждом процессе отдельно.
+    """
+
+    def __init__(
+            self,
+            max_active: int,
+            max_per_user: int,
+            max_queue: int,
+            queue_timeout: float,
+            user_rate: Optional[float] = None,
+            user_burst: Optional[float] = None,
+            retry_after: int = 5
+    ):
+        self.max_active = max_active
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst or user_rate
+        self.retry_after = retry_after
+        self.active = 0
+        self._users: dict[str, int] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def _reject(self, status_code: int, detail: str, reason: str) -> AdmissionRejected:
+        UPLOAD_REJECTIONS.labels(reason).inc()
+        return AdmissionRejected(status_code, detail, reason)
+
+    def _update_metrics(self):
+        UPLOADS_ADMITTED.set(self.active)
+        UPLOAD_QUEUE_DEPTH.set(len(self._waiters))
+
+    async def acquire(self, user: str):
+        """
+        Допускает загрузку пользователя, при необходимости дожидаясь места в очереди.
+
+        :raises AdmissionRejected: Если загрузку нужно отклонить
+        """
+        if self._users.get(user, 0) >= self.max_per_user:
+            raise self._reject(429, "Too many concurrent uploads", "user_limit")
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            self._users[user] = self._users.get(user, 0) + 1
+            self._update_metrics()
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(503, "Too many uploads in progress, try again later", "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._users[user] = self._users.get(user, 0) + 1
+        self._update_metrics()
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter
+        except BaseException as e:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Место передали одновременно с отменой ожидания: отдаём его следующему
+                self._release_slot()
+            self._release_user(user)
+            self._update_metrics()
+            if isinstance(e, TimeoutError):
+                raise self._reject(503, "Too many uploads in progress, try again later", "timeout")
+            raise
+        finally:
+            UPLOAD_QUEUE_WAIT.observe(time.perf_counter() - started)
+
+    def _release_slot(self):
+        # Место переходит первому ожидающему без уменьшения active
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _release_user(self, user: str):
+        self._users[user] -= 1
+        if not self._users[user]:
+            del self._users[user]
+            # Ведро с долгом сохраняется, чтобы следующая загрузка не обходила ограничение скорости
+            bucket = self._buckets.get(user)
+            if bucket is not None and bucket.full():
+                del self._buckets[user]
+
+    def release(self, user: str):
+        """
+        Освобождает место завершившейся загрузки.
+        """
+        self._release_slot()
+        self._release_user(user)
+        self._update_metrics()
+
+    async def throttle(self, user: str, size: int):
+        """
+        Ждёт, пока приём следующих size байт загрузки уложится в скорость пользователя.
+        """
+        if not self.user_rate or not size:
+            return
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = TokenBucket(self.user_rate, self.user_burst)
+        delay = await bucket.consume(size)
+        if delay:
+            UPLOAD_THROTTLED_SECONDS.inc(delay)
+
+
+def is_upload(method: str, path: str) -> bool:
+    return any(method == route_method and pattern.fullmatch(path) for route_method, pattern in UPLOAD_ROUTES)
+
+
+class UploadAdmissionMiddleware:
+    """
+    ASGI middleware, которое пропускает запросы загрузки через UploadAdmission (app.state.upload_admission).
+
+    Работает до маршрутизации, потому что FastAPI читает multipart-тело целиком раньше,
+    чем вызывает зависимости обработчика. Пользователь определяется по JWT без обращения
+    к базе; запрос без действительного токена отклоняется с 401, не читая тело.
+    Тело читается через ограничитель скорости: пока запрос ждёт токенов, данные не читаются
+    из сокета, и клиент притормаживается механизмом TCP. Остальные запросы (чтение списков,
+    метаданных) проходят без ограничений, а загрузки не держат соединения с базой во время приёма.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not is_upload(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        admission: UploadAdmission = scope["app"].state.upload_admission
+        scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+        try:
+            if scheme.lower() != "bearer" or not token:
+                raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+            user = str(decode_token(token))
+            await admission.acquire(user)
+        except HTTPException as e:
+            await JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)(scope, receive, send)
+            return
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(admission.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        async def throttled_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                await admission.throttle(user, len(message.get("body", b"")))
+            return message
+
+        try:
+            await self.app(scope, throttled_receive, send)
+        finally:
+            admission.release(user)
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import os
 import uuid
@@ -8,9 +9,11 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, Field
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import RedirectResponse
 
-from database import Database
+from backend.db import get_db_session
 from database.models import User
 
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
@@ -28,13 +31,13 @@ async def auth_yandex(request: Request):
     Перенаправляет пользователя для авторизации через Яндекс OAuth.
     """
     return RedirectResponse(url=(
-        f"https://oauth.yandex.ru/authorize?response_type=code"
+        f"{request.app.state.yandex_authorize_url}?response_type=code"
         f"&client_id={request.app.state.yandex_client_id}&redirect_uri={request.app.state.yandex_redirect_uri}"
     ))
 
 
 @auth_router.get("/yandex/callback", response_model=TokenResponse)
-async def auth_yandex_callback(request: Request, code: str):
+async def auth_yandex_callback(request: Request, code: str, session: AsyncSession = Depends(get_db_session)):
     """
     Обрабатывает callback от Яндекс OAuth.
 
@@ -43,8 +46,6 @@ async def auth_yandex_callback(request: Request, code: str):
     Если пользователь с таким Yandex ID отсутствует в базе, он создается.
     В конце генерируется и возвращается внутренний JWT токен для дальнейшей аутентификации.
     """
-    token_url = "https://oauth.yandex.com/token"
-
     headers = {
         "Content-type": "application/x-www-form-urlencoded",
         "Accept": "application/json"
@@ -58,41 +59,43 @@ async def auth_yandex_callback(request: Request, code: str):
         "redirect_uri": request.app.state.yandex_redirect_uri,
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(token_url, headers=headers, data=data) as response:
+    http_client = request.app.state.http_client
+    try:
+        async with http_client.post(request.app.state.yandex_token_url, headers=headers, data=data) as response:
             if response.status == 200:
                 token_data = await response.json()
                 access_token = token_data.get("access_token")
             else:
                 raise HTTPException(status_code=401, detail="Yandex token exchange failed")
 
-        user_info_url = "https://login.yandex.ru/info"
         headers = {"Authorization": f"OAuth {access_token}"}
-        async with session.get(user_info_url, headers=headers) as response:
+        async with http_client.get(request.app.state.yandex_user_info_url, headers=headers) as response:
             if response.status == 200:
                 user_info = await response.json()
             else:
                 raise HTTPException(status_code=401, detail="Yandex user info retrieval failed")
-
-    async with await Database().get_session() as session:
-        async with session.begin():
-            user: User = (
-                await session.execute(
-                    select(User).where(User.yandex_id == user_info.get("id"))
-                )
-            ).unique().scalar_one_or_none()
-
-            if not user:
-                user = User(
-                    yandex_id=user_info.get("id"),
-                    email=user_info.get("default_email"),
-                    name=user_info.get("display_name"),
-                )
-                session.add(user)
-                await session.commit()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        raise HTTPException(status_code=502, detail="Yandex OAuth is unavailable")
+
+    # Поиск и создание пользователя одним запросом. При конфликте по yandex_id строка
+    # не меняется (имя и email могли быть изменены через API), но возвращается её id.
+    statement = insert(User).values(
+        id=uuid.uuid4(),
+        yandex_id=user_info.get("id"),
+        email=user_info.get("default_email"),
+        name=user_info.get("display_name"),
+        is_superuser=False,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.yandex_id],
+        set_={"yandex_id": statement.excluded.yandex_id}
+    ).returning(User.id)
+
+    user_id = (await session.execute(statement)).scalar_one()
+    await session.commit()
 
     payload = {
-        "sub": str(user.id),
+        "sub": str(user_id),
         "exp": datetime.datetime.now(datetime.timezone.utc) +
                datetime.timedelta(seconds=request.app.state.jwt_exp_delta_seconds),
     }
@@ -100,12 +103,22 @@ async def auth_yandex_callback(request: Request, code: str):
     return TokenResponse(access_token=internal_token, token_type="bearer")
 
 
-async def get_user(token: str = Depends(oauth2_scheme)):
+USER_CACHE_CHANNEL = "user"
+USER_CACHE_FIELDS = ("id", "yandex_id", "email", "name", "is_superuser")
+
+
+async def invalidate_user(request: Request, user_id: uuid.UUID):
     """
-    Зависимость для получения текущего пользователя на основе JWT токена.
+    Сбрасывает запись пользователя в кэше get_user во всех процессах, подписанных на шину инвалидации.
+    """
+    await request.app.state.invalidation_bus.publish(USER_CACHE_CHANNEL, str(user_id))
 
-    Декодирует токен, проверяет его валидность и срок действия, а затем извлекает пользователя из базы данных.
-    Если токен недействителен, просрочен или пользователь не найден, выбрасывается HTTPException.
+
+def decode_token(token: str) -> uuid.UUID:
+    """
+    Проверяет подпись и срок действия JWT токена и возвращает идентификатор пользователя.
+
+    Не обращается к базе данных. Если токен недействителен или просрочен, выбрасывается HTTPException.
     """
     jwt_secret = os.getenv("JWT_SECRET")
     jwt_algorithm = os.getenv("JWT_ALGORITHM", "HS256")
@@ -118,18 +131,45 @@ async def get_user(token: str = Depends(oauth2_scheme)):
         if datetime.datetime.fromtimestamp(exp, tz=datetime.timezone.utc) < datetime.datetime.now(
                 datetime.timezone.utc):
             raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.PyJWTError:
+    except (jwt.PyJWTError, TypeError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid token")
+    return user_id
+
+
+async def get_user(
+        request: Request,
+        token: str = Depends(oauth2_scheme),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Зависимость для получения текущего пользователя на основе JWT токена.
 
-    async with await Database().get_session() as session:
-        async with session.begin():
-            user: User = (
-                await session.execute(
-                    select(User).where(User.id == user_id)
-                )
-            ).unique().scalar_one_or_none()
-            if user is None:
-                raise HTTPException(status_code=401, detail="Unauthorized")
+    Декодирует токен, проверяет его валидность и срок действия, а затем извлекает пользователя из базы данных.
+    Если токен недействителен, просрочен или пользователь не найден, выбрасывается HTTPException.
+    Данные пользователя кэшируются в памяти процесса (USER_CACHE_SIZE записей на USER_CACHE_TTL секунд),
+    поэтому повторные запросы обходятся без обращения к базе. Из кэша возвращается новый,
+    не привязанный к сессии экземпляр User; обработчикам, которые меняют пользователя,
+    нужно загрузить его в сессию запроса через session.get(User, user.id).
+    """
+    user_id = decode_token(token)
+
+    user_cache = request.app.state.user_cache
+    cached = user_cache.get(str(user_id))
+    if cached is not None:
+        return User(**cached)
+
+    user: User = (
+        await session.execute(
+            select(User).where(User.id == user_id)
+        )
+    ).unique().scalar_one_or_none()
+    # Завершаем транзакцию чтения, чтобы соединение не простаивало в пуле занятым,
+    # пока обработчик, например, принимает файл. Пользователь остаётся в сессии запроса.
+    await session.commit()
+    if user is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    user_cache.set(str(user_id), {field: getattr(user, field) for field in USER_CACHE_FIELDS})
     return user
 
 
@@ -0,0 +1,174 @@
+import os
+from collections import Counter
+from typing import Optional
+
+from fastapi import UploadFile
+from sqlalchemy import Integer, String, column, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from backend.db import update_from_values
+from backend.storage import StoredUpload, blob_key, get_storage, hash_file, hash_upload, save_upload
+from database.models import AudioBlob
+
+
+async def acquire_blobs(session: AsyncSession, stored: list[StoredUpload]) -> set[str]:
+    """
+    Добавляет ссылки на блобы одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Один и тот же блоб может встречаться в списке несколько раз - его счётчик
+    увеличивается на число вхождений. Строки блобов остаются заблокированными
+    до конца транзакции, поэтому параллельное освобождение последней ссылки
+    дождётся её фиксации. Блобы обрабатываются в порядке хэша, чтобы параллельные
+    пакетные загрузки не взаимоблокировались.
+
+    :return: Хэши блобов, которые только что созданы (до этого на них не было ссылок)
+    """
+    counts = Counter(item.sha256 for item in stored)
+    sizes = {item.sha256: item.size for item in stored}
+    statement = insert(AudioBlob).values([
+        {"sha256": sha256, "size": sizes[sha256], "ref_count": counts[sha256]} for sha256 in sorted(counts)
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[AudioBlob.sha256],
+        set_={"ref_count": AudioBlob.ref_count + statement.excluded.ref_count}
+    ).returning(AudioBlob.sha256, AudioBlob.ref_count)
+    rows = (await session.execute(statement)).all()
+    return {row.sha256 for row in rows if row.ref_count == counts[row.sha256]}
+
+
+async def write_upload_blob(file: UploadFile, max_size: Optional[int] = None) -> StoredUpload:
+    """
+    Считает SHA-256 UploadFile и записывает блоб, если его ещё нет ни на одном томе.
+
+    Ссылка на блоб не добавляется - для этого нужен acquire_blobs. Не обращается
+    к базе данных, поэтому может выполняться параллельно для нескольких файлов.
+    """
+    sha256, size = await hash_upload(file, max_size)
+    storage = get_storage()
+    key = await storage.locate(blob_key(sha256))
+    if key is None:
+        return await save_upload(file, storage.place(blob_key(sha256), size))
+    return StoredUpload(key=key, path=storage.local_path(key), size=size, sha256=sha256)
+
+
+async def restore_missing_blobs(uploads: list[tuple[UploadFile, StoredUpload]], created: set[str]):
+    """
+    Заново записывает только что созданные блобы, файлы которых пропали из хранилища.
+
+    Это возможно, если последнюю ссылку на блоб освободили между записью файла
+    и захватом ссылки (acquire_blobs).
+
+    :param uploads: Исходные файлы и результаты write_upload_blob
+    :param created: Хэши созданных блобов из acquire_blobs
+    """
+    storage = get_storage()
+    restored = set()
+    for file, stored in uploads:
+        if stored.sha256 in created and stored.key not in restored and await storage.stat(stored.key) is None:
+            await save_upload(file, stored.key)
+        restored.add(stored.key)
+
+
+async def store_upload_blob(session: AsyncSession, file: UploadFile, max_size: Optional[int] = None) -> StoredUpload:
+    """
+    Сохраняет UploadFile как блоб и добавляет на него ссылку.
+
+    Сначала считается SHA-256 содержимого. Если блоб с таким хэшем уже лежит в хранилище,
+    файл не записывается повторно - увеличивается только счётчик ссылок.
+    Новый блоб записывается до захвата ссылки, чтобы не держать транзакцию во время записи.
+    Изменения фиксирует вызывающий код.
+    """
+    stored = await write_upload_blob(file, max_size)
+    created = await acquire_blobs(session, [stored])
+    await restore_missing_blobs([(file, stored)], created)
+    return stored
+
+
+async def acquire_file_blob(session: AsyncSession, source: str) -> StoredUpload:
+    """
+    Считает SHA-256 файла на диске и добавляет ссылку на блоб с таким содержимым.
+
+    Файл не переносится: это делает place_file_blob в той же транзакции, когда вызывающий код
+    проверит остальные условия (например, квоту). Изменения фиксирует вызывающий код.
+    """
+    sha256, size = await hash_file(source)
+    stored = StoredUpload(key=blob_key(sha256), path=None, size=size, sha256=sha256)
+    await acquire_blobs(session, [stored])
+    return stored
+
+
+async def place_file_blob(source: str, stored: StoredUpload) -> StoredUpload:
+    """
+    Переносит файл с диска на место блоба, ссылка на который уже захвачена acquire_file_blob.
+
+    Если такой блоб уже есть, исходный файл удаляется, иначе переносится на место
+    блоба (в пределах одного тома - через os.replace без копирования).
+    """
+    storage = get_storage()
+    key = await storage.locate(stored.key)
+    if key is not None:
+        await run_in_threadpool(os.remove, source)
+    else:
+        key = storage.place(stored.key, stored.size)
+        await storage.put_file(key, source)
+
+    return StoredUpload(key=key, path=storage.local_path(key), size=stored.size, sha256=stored.sha256)
+
+
+async def release_blobs(session: AsyncSession, sha256s: list[str]) -> list[str]:
+    """
+    Уменьшает счётчики ссылок блобов одним UPDATE ... FROM VALUES и удаляет строки блобов без ссылок.
+
+    Хэш может встречаться в списке несколько раз - счётчик уменьшается на число вхождений.
+    Записи аудиофайлов, ссылавшиеся на блобы, должны быть уже удалены в этой же сессии.
+    Файлы блобов остаются на диске: если транзакция откатится, строки вернутся вместе с файлами.
+    После фиксации файлы удаляет delete_unreferenced_blobs.
+
+    :return: Хэши удалённых строк блобов
+    """
+    if not sha256s:
+        return []
+
+    counts = Counter(sha256s)
+    rows = await update_from_values(
+        session, [column("sha256", String), column("count", Integer)], sorted(counts.items()),
+        lambda released: update(AudioBlob)
+        .where(AudioBlob.sha256 == released.c.sha256)
+        .values(ref_count=AudioBlob.ref_count - released.c.count)
+        .returning(AudioBlob.sha256, AudioBlob.ref_count)
+    )
+    removed = sorted(row.sha256 for row in rows if row.ref_count <= 0)
+    if not removed:
+        return []
+
+    await session.execute(delete(AudioBlob).where(AudioBlob.sha256.in_(removed), AudioBlob.ref_count <= 0))
+    return removed
+
+
+async def delete_unreferenced_blobs(session: AsyncSession, sha256s: list[str]) -> list[str]:
+    """
+    Удаляет из хранилища файлы блобов, строк которых нет в базе. Вызывается после фиксации
+    транзакции, в которой блобы освобождены (release_blobs), и сам фиксирует транзакцию.
+
+    На время удаления файлов вставляются строки-заглушки с нулевым счётчиком ссылок. Если строка
+    блоба уже есть (его снова загрузили), файл остаётся. Параллельная загрузка того же содержимого
+    ждёт заглушку в INSERT ... ON CONFLICT (acquire_blobs), после фиксации создаёт блоб заново
+    и записывает файл (restore_missing_blobs).
+
+    :return: Хэши блобов, файлы которых удалены
+    """
+    sha256s = sorted(set(sha256s))
+    if not sha256s:
+        return []
+
+    statement = insert(AudioBlob).values([{"sha256": sha256, "size": 0, "ref_count": 0} for sha256 in sha256s])
+    statement = statement.on_conflict_do_nothing(index_elements=[AudioBlob.sha256]).returning(AudioBlob.sha256)
+    absent = list((await session.execute(statement)).scalars())
+    if absent:
+        # Ключ блоба без тома: файл удаляется со всех томов, где он мог оказаться
+        await get_storage().delete(*(blob_key(sha256) for sha256 in absent))
+        await session.execute(delete(AudioBlob).where(AudioBlob.sha256.in_(absent)))
+    await session.commit()
+    return absent
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import asyncpg
+from sqlalchemy import TextClause, text
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей.
+
+    Предназначен для однопоточного использования внутри event loop: операции
+    не ждут ввода-вывода и не требуют блокировок. Считает попадания и промахи.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Возвращает значение по ключу или None, если его нет или срок жизни истёк.
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Сохраняет значение, вытесняя давно не использованные записи при переполнении.
+        """
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class InvalidationBus:
+    """
+    Шина сообщений об инвалидации кэшей.
+
+    Реализация по умолчанию доставляет сообщения только внутри процесса.
+    Для нескольких процессов publish дополнительно рассылает сообщение через внешний
+    канал, а полученные оттуда сообщения передаются в deliver (см. PostgresInvalidationBus).
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, list[Callable[[str], Any]]] = {}
+        self._reset_subscribers: list[Callable[[], Any]] = []
+
+    def subscribe(self, channel: str, callback: Callable[[str], Any]):
+        """
+        Подписывает callback на сообщения канала. Callback получает ключ инвалидации.
+        """
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def subscribe_reset(self, callback: Callable[[], Any]):
+        """
+        Подписывает callback на сброс: сообщения могли быть потеряны, и кэши нужно очистить целиком.
+        """
+        self._reset_subscribers.append(callback)
+
+    def reset(self):
+        for callback in self._reset_subscribers:
+            callback()
+
+    def deliver(self, channel: str, key: str):
+        """
+        Передаёт сообщение подписчикам текущего процесса.
+        """
+        for callback in self._subscribers.get(channel, []):
+            callback(key)
+
+    async def publish(self, channel: str, key: str):
+        """
+        Публикует сообщение об инвалидации.
+        """
+        self.deliver(channel, key)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class PostgresInvalidationBus(InvalidationBus):
+    """
+    Шина инвалидации между процессами через PostgreSQL LISTEN/NOTIFY.
+
+    Каждый процесс держит отдельное соединение asyncpg (вне пула SQLAlchemy), подписанное
+    на канал PG_CHANNEL. publish сразу доставляет сообщение подписчикам своего процесса
+    и рассылает NOTIFY с идентификатором процесса, по которому свои уведомления пропускаются.
+    При обрыве соединение открывается заново; сообщения, разосланные за это время, теряются,
+    поэтому после переподключения подписчики получают сброс (reset).
+    Процессы без шины (скрипты) публикуют сообщения запросом invalidation_notify.
+    """
+
+    PG_CHANNEL = "cache_invalidation"
+    RECONNECT_DELAY = 30  # Максимальная пауза между попытками переподключения, секунды
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self.dsn = dsn
+        self.instance_id = uuid.uuid4().hex[:12]
+        self._connection: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()  # Одно соединение не выполняет запросы параллельно
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def start(self):
+        connection = await asyncpg.connect(self.dsn)
+        connection.add_termination_listener(self._on_terminated)
+        await connection.add_listener(self.PG_CHANNEL, self._on_notification)
+        self._connection = connection
+
+    async def publish(self, channel: str, key: str):
+        self.deliver(channel, key)
+        connection = self._connection
+        if connection is None:
+            logger.warning("Invalidation bus is disconnected, %s:%s is not published", channel, key)
+            return
+        try:
+            async with self._lock:
+                await connection.execute(
+                    "SELECT pg_notify($1, $2)", self.PG_CHANNEL, invalidation_payload(self.instance_id, channel, key)
+                )
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+            logger.warning("Failed to publish invalidation %s:%s", channel, key, exc_info=True)
+
+    async def close(self):
+        self._closed = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        if self._connection and not self._connection.is_closed():
+            await self._connection.close()
+
+    def _on_notification(self, connection, pid: int, pg_channel: str, payload: str):
+        source, channel, key = payload.split(":", 2)
+        if source != self.instance_id:
+            self.deliver(channel, key)
+
+    def _on_terminated(self, connection):
+        if not self._closed:
+            logger.warning("Invalidation bus connection lost, reconnecting")
+            self._connection = None
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._closed:
+            try:
+                await self.start()
+                self.reset()
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Invalidation bus reconnect failed: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_DELAY)
+
+
+def invalidation_payload(source: str, channel: str, key: str) -> str:
+    return f"{source}:{channel}:{key}"
+
+
+def invalidation_notify(channel: str, key: str) -> TextClause:
+    """
+    Запрос, который публикует сообщение в PostgresInvalidationBus из процесса без шины (например, скрипта).
+
+    NOTIFY доставляется при фиксации транзакции, в которой выполнен запрос, поэтому
+    процессы приложения сбрасывают кэши только после того, как изменения видны в базе.
+    """
+    return text("SELECT pg_notify(:pg_channel, :payload)").bindparams(
+        pg_channel=PostgresInvalidationBus.PG_CHANNEL, payload=invalidation_payload("script", channel, key)
+    )
+
+
+class BytesLRUCache:
+    """
+    LRU-кэш готовых тел ответов, ограниченный суммарным размером значений в байтах.
+
+    Записи не устаревают по времени: ключ должен включать версию данных, а записи
+    старых версий вытесняются новыми. Значения больше maxbytes не кэшируются.
+    """
+
+    def __init__(self, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: bytes):
+        if len(value) > self.maxbytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._data[key] = value
+        self.size += len(value)
+        while self.size > self.maxbytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data), "bytes": self.size, "maxbytes": self.maxbytes, "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+from typing import AsyncIterator, Callable, Sequence
+
+from sqlalchemy import ColumnClause, CursorResult, Executable, Result, Row, literal, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Database
+
+
+async def get_db_session() -> AsyncIterator[AsyncSession]:
+    """
+    Зависимость FastAPI: одна сессия базы данных на запрос.
+
+    FastAPI кэширует зависимость в пределах запроса, поэтому get_user и обработчик
+    получают одну и ту же сессию и работают через одно соединение из пула.
+    Транзакция начинается автоматически при первом запросе к базе; изменения
+    фиксируются явным commit в обработчике, а незафиксированные откатываются
+    при закрытии сессии после отправки ответа.
+    """
+    async with await Database().get_session() as session:
+        yield session
+
+
+def is_postgresql(session: AsyncSession) -> bool:
+    """
+    Проверяет, что сессия работает с PostgreSQL, а не с другой СУБД (SQLite нагрузочных тестов).
+    """
+    return session.bind.dialect.name == "postgresql"
+
+
+async def update_from_values(
+        session: AsyncSession,
+        columns: Sequence[ColumnClause],
+        rows: Sequence[tuple],
+        build: Callable[[SimpleNamespace], Executable]
+) -> list[Row]:
+    """
+    Выполняет UPDATE ... FROM (VALUES ...) для набора строк значений.
+
+    build получает источник значений source и строит по нему запрос, обращаясь к столбцам
+    как source.c.<имя>. В PostgreSQL источник - таблица VALUES, и запрос выполняется один раз.
+    В других СУБД такого синтаксиса нет: запрос выполняется для каждой строки, а столбцы
+    источника - параметры со значениями этой строки.
+
+    :return: Строки RETURNING всех выполненных запросов
+    """
+    if not rows:
+        return []
+    if is_postgresql(session):
+        source = values(*columns, name="source").data(list(rows))
+        return _returned(await session.execute(build(source)))
+
+    returned = []
+    for row in rows:
+        source = SimpleNamespace(c=SimpleNamespace(**{
+            column.name: literal(value, column.type) for column, value in zip(columns, row)
+        }))
+        returned.extend(_returned(await session.execute(build(source))))
+    return returned
+
+
+def _returned(result: Result) -> list[Row]:
+    # Результат запроса без RETURNING закрыт и строк не содержит
+    if isinstance(result, CursorResult) and not result.returns_rows:
+        return []
+    return list(result)
@@ -0,0 +1,139 @@
+import asyncio
+import uuid
+from typing import Optional
+
+from sqlalchemy import Row, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.blobs import delete_unreferenced_blobs, release_blobs
+from backend.storage import audio_file_key, get_storage, partial_key
+from backend.usage import release_usage
+from backend.versions import bump_versions
+from database.models import AudioFile, UploadSession
+
+DELETION_BATCH_SIZE = 500  # Сколько файлов удалять из хранилища за один вызов
+USER_FILES_BATCH_SIZE = 1000  # Сколько файлов пользователя удалять из базы в одной транзакции
+
+
+class DeletionQueue:
+    """
+    Очередь удаления файлов из хранилища.
+
+    Обработчики сначала удаляют записи из базы и фиксируют транзакцию, а ключи файлов
+    кладут в очередь. Фоновая задача (run) забирает ключи пачками до DELETION_BATCH_SIZE
+    и удаляет их через хранилище, не блокируя event loop и не удерживая соединение с базой.
+    Очередь живёт в памяти процесса: если процесс остановится раньше, чем файлы удалены,
+    их найдёт scripts.reconcile_storage.
+    """
+
+    def __init__(self, batch_size: int = DELETION_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, *keys: str):
+        """
+        Ставит ключи хранения в очередь на удаление. Каталоги удаляются целиком.
+        """
+        for key in keys:
+            self._queue.put_nowait(key)
+
+    def _take_batch(self, first: Optional[str] = None) -> list[str]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def run(self):
+        """
+        Удаляет файлы из очереди, пока задачу не отменят. Запускается из lifespan приложения.
+        """
+        while True:
+            batch = self._take_batch(await self._queue.get())
+            await get_storage().delete(*batch)
+
+    async def flush(self):
+        """
+        Удаляет всё, что осталось в очереди. Вызывается при остановке приложения.
+        """
+        while batch := self._take_batch():
+            await get_storage().delete(*batch)
+
+
+async def delete_audio_file_records(session: AsyncSession, *where) -> list[Row]:
+    """
+    Удаляет записи аудиофайлов одним DELETE ... RETURNING, освобождает их блобы
+    и уменьшает счётчики занятого места владельцев.
+
+    После фиксации транзакции пути обычных файлов нужно передать в DeletionQueue (stored_keys),
+    а файлы блобов без оставшихся ссылок - удалить через delete_unreferenced_blobs (blob_hashes).
+
+    :return: Удалённые строки (id, user_id, storage_key, blob_sha256, size_bytes)
+    """
+    deleted = (
+        await session.execute(
+            delete(AudioFile)
+            .where(*where)
+            .returning(
+                AudioFile.id, AudioFile.user_id, AudioFile.storage_key, AudioFile.blob_sha256, AudioFile.size_bytes
+            )
+        )
+    ).all()
+    await release_blobs(session, blob_hashes(deleted))
+    await release_usage(session, deleted)
+    return deleted
+
+
+def stored_keys(deleted: list[Row]) -> list[str]:
+    """
+    Возвращает ключи хранения файлов удалённых записей, которые не хранятся в блобах.
+    """
+    return [audio_file_key(row) for row in deleted if not row.blob_sha256]
+
+
+def blob_hashes(deleted: list[Row]) -> list[str]:
+    """
+    Возвращает хэши блобов удалённых записей.
+    """
+    return [row.blob_sha256 for row in deleted if row.blob_sha256]
+
+
+async def delete_user_files(session: AsyncSession, user_id: uuid.UUID, queue: DeletionQueue) -> int:
+    """
+    Удаляет все аудиофайлы и сессии загрузки пользователя.
+
+    Файлы удаляются пачками по USER_FILES_BATCH_SIZE, каждая пачка - в своей транзакции,
+    чтобы не держать долгих блокировок. Версия списка файлов пользователя увеличивается
+    в транзакции каждой пачки, сбросить её в памяти процессов должен вызывающий код.
+    Файлы, частичные загрузки и каталог пользователя из старой схемы хранения
+    (<user_id>/ на основном томе) удаляются через очередь после фиксации.
+
+    :return: Количество удалённых аудиофайлов
+    """
+    total = 0
+    while True:
+        batch_ids = (
+            select(AudioFile.id)
+            .where(AudioFile.user_id == user_id)
+            .order_by(AudioFile.id)
+            .limit(USER_FILES_BATCH_SIZE)
+        )
+        deleted = await delete_audio_file_records(session, AudioFile.id.in_(batch_ids.scalar_subquery()))
+        await bump_versions(session, {str(row.user_id) for row in deleted})
+        await session.commit()
+        queue.put(*stored_keys(deleted))
+        await delete_unreferenced_blobs(session, blob_hashes(deleted))
+        total += len(deleted)
+        if len(deleted) < USER_FILES_BATCH_SIZE:
+            break
+
+    upload_sessions = (
+        await session.execute(
+            delete(UploadSession).where(UploadSession.user_id == user_id).returning(UploadSession.id)
+        )
+    ).scalars().all()
+    await session.commit()
+    queue.put(*(partial_key(session_id) for session_id in upload_sessions), str(user_id))
+    return total
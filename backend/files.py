@@ -1,16 +1,46 @@
+import asyncio
+import mimetypes
 import os
+import time
 import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import AsyncIterator, BinaryIO, Optional
+from urllib.parse import quote
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from sqlalchemy import select
+from sqlalchemy import String, UUID, and_, any_, bindparam, column, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from backend.auth import get_admin, get_user
-from database import Database
+from backend.blobs import (acquire_blobs, delete_unreferenced_blobs, release_blobs, restore_missing_blobs,
+                           store_upload_blob, write_upload_blob)
+from backend.db import get_db_session, is_postgresql, update_from_values
+from backend.deletion import blob_hashes, delete_audio_file_records, stored_keys
+from backend.metadata import extract_audio_metadata
+from backend.metrics import COLD_READS, record_upload
+from backend.pagination import (MAX_PAGE_SIZE, decode_id_cursor, decode_rank_cursor, fetch_page, ndjson_response,
+                                page_size, wants_ndjson)
+from backend.responses import dumps_json
+from backend.storage import (CHUNK_SIZE, StorageFull, StoredUpload, UploadTooLarge, audio_file_key, audio_file_path,
+                             file_key, get_storage, save_upload, storage_path, upload_name)
+from backend.tiering import ColdTier, compute_file_peaks
+from backend.waveform import PEAKS_LEVELS, PEAKS_SCALE, WaveformUnavailable, generate_peaks, peaks_path, read_peaks
+from backend.usage import QuotaExceeded, add_usage, check_quota
+from backend.versions import bump_versions
+from backend.workers import run_in_process
 from database.models import AudioFile, User
 
 file_router = APIRouter(prefix="/file", tags=["file"])
 
+FILES_CACHE_CHANNEL = "files"  # Канал шины инвалидации: ключ - идентификатор владельца изменённых файлов
+
+MAX_BATCH_FILES = 100  # Максимальное количество файлов в одной пакетной загрузке
+MAX_BATCH_IDS = 1000  # Максимальное количество идентификаторов в одной пакетной операции
+
 
 class AudioFileResponse(BaseModel):
     """
@@ -20,6 +50,30 @@ class AudioFileResponse(BaseModel):
     filename: str = Field(..., description="Исходное имя файла")
     filepath: str = Field(..., description="Путь к файлу на сервере")
     user_id: str = Field(..., description="Идентификатор пользователя")
+    size_bytes: Optional[int] = Field(None, description="Размер файла в байтах")
+    sha256: Optional[str] = Field(None, description="SHA-256 содержимого файла")
+    duration: Optional[float] = Field(None, description="Длительность в секундах")
+    sample_rate: Optional[int] = Field(None, description="Частота дискретизации, Гц")
+    channels: Optional[int] = Field(None, description="Количество каналов")
+    bit_rate: Optional[int] = Field(None, description="Битрейт, бит/с")
+    codec: Optional[str] = Field(None, description="Кодек или формат контейнера")
+
+
+class BatchUploadResult(BaseModel):
+    """
+    Результат загрузки одного файла из пакета.
+    """
+    filename: str = Field(..., description="Исходное имя файла")
+    status_code: int = Field(..., description="HTTP-статус обработки файла")
+    detail: Optional[str] = Field(None, description="Описание ошибки")
+    file: Optional[AudioFileResponse] = Field(None, description="Созданный аудиофайл, если загрузка удалась")
+
+
+class BatchUploadResponse(BaseModel):
+    """
+    Модель ответа пакетной загрузки: результаты в порядке переданных файлов.
+    """
+    files: list[BatchUploadResult] = Field(..., description="Результаты по каждому файлу")
 
 
 class AudioFilesListResponse(BaseModel):
@@ -27,6 +81,16 @@ class AudioFilesListResponse(BaseModel):
     Модель ответа для списка аудиофайлов.
     """
     files: list[AudioFileResponse] = Field(..., description="Список аудиофайлов")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы (нет, если страница последняя)")
+
+
+class WaveformResponse(BaseModel):
+    """
+    Модель ответа с пиками волновой формы аудиофайла.
+    """
+    points: int = Field(..., description="Количество точек")
+    min: list[float] = Field(..., description="Минимумы амплитуды по интервалам, от -1 до 1")
+    max: list[float] = Field(..., description="Максимумы амплитуды по интервалам, от -1 до 1")
 
 
 class AudioFileUpdate(BaseModel):
@@ -36,172 +100,788 @@ class AudioFileUpdate(BaseModel):
     filename: str = Field(..., description="Новое имя аудиофайла")
 
 
+class AudioFileIds(BaseModel):
+    """
+    Модель со списком идентификаторов аудиофайлов для пакетных операций.
+    """
+    ids: list[uuid.UUID] = Field(..., min_length=1, max_length=MAX_BATCH_IDS, description="Идентификаторы аудиофайлов")
+
+
+class AudioFileRename(BaseModel):
+    """
+    Модель нового имени одного аудиофайла в пакетном переименовании.
+    """
+    id: uuid.UUID = Field(..., description="Идентификатор аудиофайла")
+    filename: str = Field(..., description="Новое имя аудиофайла")
+
+
+class AudioFilesRename(BaseModel):
+    """
+    Модель для пакетного переименования аудиофайлов.
+    """
+    files: list[AudioFileRename] = Field(..., min_length=1, max_length=MAX_BATCH_IDS, description="Новые имена")
+
+
+class BatchFileResult(BaseModel):
+    """
+    Результат пакетной операции над одним аудиофайлом.
+    """
+    id: str = Field(..., description="Идентификатор аудиофайла")
+    status_code: int = Field(..., description="HTTP-статус операции для этого файла")
+    detail: Optional[str] = Field(None, description="Описание ошибки")
+    file: Optional[AudioFileResponse] = Field(None, description="Данные аудиофайла")
+
+
+class BatchFilesResponse(BaseModel):
+    """
+    Модель ответа пакетной операции: результаты в порядке переданных идентификаторов.
+    """
+    files: list[BatchFileResult] = Field(..., description="Результаты по каждому идентификатору")
+
+
+def audio_file_response(audio_file: AudioFile, **kwargs) -> AudioFileResponse:
+    """
+    Собирает модель ответа по записи аудиофайла.
+    """
+    return AudioFileResponse(
+        id=str(audio_file.id),
+        filename=audio_file.filename,
+        filepath=audio_file_path(audio_file),
+        user_id=str(audio_file.user_id),
+        duration=audio_file.duration,
+        sample_rate=audio_file.sample_rate,
+        channels=audio_file.channels,
+        bit_rate=audio_file.bit_rate,
+        codec=audio_file.codec,
+        size_bytes=audio_file.size_bytes,
+        **kwargs
+    )
+
+
+# Столбцы, из которых собирается ответ списка аудиофайлов без загрузки ORM-сущностей
+AUDIO_FILE_COLUMNS = (
+    AudioFile.id, AudioFile.filename, AudioFile.user_id, AudioFile.storage_key, AudioFile.size_bytes,
+    AudioFile.duration, AudioFile.sample_rate, AudioFile.channels, AudioFile.bit_rate, AudioFile.codec,
+)
+
+
+def audio_file_payload(row) -> dict:
+    """
+    Собирает словарь ответа по строке с AUDIO_FILE_COLUMNS в формате AudioFileResponse.
+
+    В отличие от audio_file_response, модель Pydantic не создаётся: для длинных списков
+    это основная часть времени обработки запроса. Строка распаковывается по позициям,
+    что заметно быстрее обращения к столбцам Row по имени.
+    """
+    file_id, filename, user_id, storage_key, size_bytes, duration, sample_rate, channels, bit_rate, codec = row
+    return {
+        "id": file_id,
+        "filename": filename,
+        "filepath": storage_path(file_key(storage_key, user_id, file_id)),
+        "user_id": user_id,
+        "size_bytes": size_bytes,
+        "sha256": None,
+        "duration": duration,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "bit_rate": bit_rate,
+        "codec": codec,
+    }
+
+
+def schedule_post_upload(
+        background_tasks: BackgroundTasks,
+        request: Request,
+        file_id: uuid.UUID,
+        user_id: uuid.UUID,
+        path: str
+):
+    """
+    Ставит обработку загруженного файла после отправки ответа: извлечение метаданных и построение пиков.
+
+    Фоновые задачи выполняются по порядку, поэтому списки файлов пользователя сбрасываются
+    уже после сохранения метаданных.
+    """
+    pool = request.app.state.process_pool
+    background_tasks.add_task(extract_audio_metadata, pool, file_id, path)
+    background_tasks.add_task(invalidate_files, request, user_id)
+    background_tasks.add_task(generate_peaks, pool, path)
+
+
 @file_router.post("/upload", response_model=AudioFileResponse)
-async def upload_file(user: User = Depends(get_user), file: UploadFile = File(...)):
+async def upload_file(
+        request: Request,
+        background_tasks: BackgroundTasks,
+        user: User = Depends(get_user),
+        file: UploadFile = File(...),
+        session: AsyncSession = Depends(get_db_session)
+):
     """
     Загружает аудиофайл и сохраняет его на сервере.
 
-    Принимает файл, проверяет его тип (должен быть аудио), сохраняет файл
-    в директории, зависящей от идентификатора пользователя, и создаёт запись
-    в базе данных.
+    Принимает файл, проверяет его тип (должен быть аудио), потоково сохраняет файл
+    в хранилище (на один из томов с учётом свободного места, в шардированный каталог) и создаёт запись
+    в базе данных. Размер файла ограничен параметром MAX_UPLOAD_SIZE, а суммарный размер
+    файлов пользователя - квотой USER_QUOTA_BYTES: до приёма файла проверяется только строка
+    счётчиков пользователя, а при создании записи квота повторно проверяется атомарно (add_usage).
+    В режиме CONTENT_ADDRESSED_STORAGE файл сохраняется как блоб по SHA-256 содержимого,
+    и повторная загрузка того же содержимого не пишет файл на диск второй раз.
+    Метаданные (длительность, частота, каналы, битрейт, кодек) и пики волновой формы
+    вычисляются уже после ответа.
     """
     if not file.content_type.startswith("audio/"):
         raise HTTPException(status_code=400, detail="Incorrect file type. Only audio files are allowed")
 
-    file_id = uuid.uuid4()
+    quota = request.app.state.user_quota_bytes
+    if quota is not None:
+        try:
+            await check_quota(session, user.id, file.size or 0, quota)
+        except QuotaExceeded:
+            raise HTTPException(status_code=413, detail="Storage quota exceeded")
+        # Завершаем транзакцию чтения, чтобы не держать соединение во время записи файла
+        await session.commit()
 
-    directory = os.path.join("uploads", str(user.id))
-    os.makedirs(directory, exist_ok=True)
+    file_id = uuid.uuid4()
+    max_size = request.app.state.max_upload_size
+    started = time.perf_counter()
+    try:
+        if request.app.state.content_addressed_storage:
+            stored = await store_upload_blob(session, file, max_size=max_size)
+            blob_sha256 = stored.sha256
+        else:
+            key = get_storage().new_key(upload_name(file_id, file.filename), file.size)
+            stored, blob_sha256 = await save_upload(file, key, max_size=max_size), None
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File is too large")
+    except StorageFull:
+        raise HTTPException(status_code=507, detail="Insufficient storage")
+    record_upload("single", stored.size, time.perf_counter() - started)
+
+    try:
+        await add_usage(session, user.id, 1, stored.size, quota)
+    except QuotaExceeded:
+        if blob_sha256 is None:
+            await session.rollback()
+            await get_storage().delete(stored.key)
+        else:
+            # Ссылка снимается, а файл только что созданного блоба без других ссылок удаляется после фиксации
+            await release_blobs(session, [blob_sha256])
+            await session.commit()
+            await delete_unreferenced_blobs(session, [blob_sha256])
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+    audio_file = AudioFile(
+        id=file_id, filename=file.filename, user_id=user.id, storage_key=stored.key, blob_sha256=blob_sha256,
+        size_bytes=stored.size
+    )
+    session.add(audio_file)
+    await bump_versions(session, [str(user.id)])
+    await session.commit()
+    await invalidate_files(request, user.id)
+
+    schedule_post_upload(background_tasks, request, file_id, user.id, stored.path)
+    return audio_file_response(audio_file, sha256=stored.sha256)
+
+
+@file_router.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_files(
+        request: Request,
+        background_tasks: BackgroundTasks,
+        user: User = Depends(get_user),
+        files: list[UploadFile] = File(...),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Загружает несколько аудиофайлов одним запросом (например, целый альбом).
 
-    filename, file_extension = os.path.splitext(file.filename)
-    file_location = os.path.join(directory, f"{file_id}{file_extension}")
-    with open(file_location, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    Файлы пишутся на диск параллельно, не более UPLOAD_CONCURRENCY одновременно,
+    после чего все записи создаются одним INSERT в одной транзакции. Ошибка в одном
+    файле (неверный тип, превышение MAX_UPLOAD_SIZE) не мешает загрузке остальных:
+    для каждого файла возвращается свой статус. Если сохранённые файлы вместе не помещаются
+    в квоту пользователя (USER_QUOTA_BYTES), ни один из них не создаётся и для каждого возвращается 413.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. At most {MAX_BATCH_FILES} files are allowed")
 
-    async with await Database().get_session() as session:
-        async with session.begin():
-            audio_file = AudioFile(id=file_id, filename=file.filename, user_id=user.id)
+    content_addressed = request.app.state.content_addressed_storage
+    max_size = request.app.state.max_upload_size
+    semaphore = asyncio.Semaphore(request.app.state.upload_concurrency)
 
-            session.add(audio_file)
+    async def store(file: UploadFile) -> BatchUploadResult | tuple[uuid.UUID, StoredUpload]:
+        if not file.content_type or not file.content_type.startswith("audio/"):
+            return BatchUploadResult(
+                filename=file.filename, status_code=400, detail="Incorrect file type. Only audio files are allowed"
+            )
+        file_id = uuid.uuid4()
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if content_addressed:
+                    stored = await write_upload_blob(file, max_size=max_size)
+                else:
+                    key = get_storage().new_key(upload_name(file_id, file.filename), file.size)
+                    stored = await save_upload(file, key, max_size=max_size)
+            except UploadTooLarge:
+                return BatchUploadResult(filename=file.filename, status_code=413, detail="File is too large")
+            except StorageFull:
+                return BatchUploadResult(filename=file.filename, status_code=507, detail="Insufficient storage")
+            record_upload("batch", stored.size, time.perf_counter() - started)
+            return file_id, stored
+
+    results = await asyncio.gather(*(store(file) for file in files))
+    saved = [(file, result) for file, result in zip(files, results) if isinstance(result, tuple)]
+
+    try:
+        if content_addressed and saved:
+            created = await acquire_blobs(session, [stored for _, (_, stored) in saved])
+            await restore_missing_blobs([(file, stored) for file, (_, stored) in saved], created)
+        # Счётчики блокируются после блобов - в том же порядке, что и при удалении файлов
+        if saved:
+            saved_size = sum(stored.size for _, (_, stored) in saved)
+            await add_usage(session, user.id, len(saved), saved_size, request.app.state.user_quota_bytes)
+        rows = [
+            {
+                "id": file_id,
+                "filename": file.filename,
+                "user_id": user.id,
+                "storage_key": stored.key,
+                "blob_sha256": stored.sha256 if content_addressed else None,
+                "size_bytes": stored.size,
+            }
+            for file, (file_id, stored) in saved
+        ]
+        if rows:
+            await session.execute(insert(AudioFile), rows)
+            await bump_versions(session, [str(user.id)])
+        await session.commit()
+        if rows:
+            await invalidate_files(request, user.id)
+    except QuotaExceeded:
+        if content_addressed:
+            await release_blobs(session, [stored.sha256 for _, (_, stored) in saved])
             await session.commit()
+            await delete_unreferenced_blobs(session, [stored.sha256 for _, (_, stored) in saved])
+        else:
+            await session.rollback()
+            await get_storage().delete(*(stored.key for _, (_, stored) in saved))
+        results = [
+            BatchUploadResult(filename=file.filename, status_code=413, detail="Storage quota exceeded")
+            if isinstance(result, tuple) else result
+            for file, result in zip(files, results)
+        ]
+    except BaseException:
+        if content_addressed:
+            # После отката остаются только строки блобов, на которые ссылаются другие файлы;
+            # файлы блобов без строк, записанные этим запросом, удаляются
+            await session.rollback()
+            await delete_unreferenced_blobs(session, [stored.sha256 for _, (_, stored) in saved])
+        else:
+            await get_storage().delete(*(stored.key for _, (_, stored) in saved))
+        raise
+
+    response = []
+    for file, result in zip(files, results):
+        if isinstance(result, BatchUploadResult):
+            response.append(result)
+            continue
+        file_id, stored = result
+        schedule_post_upload(background_tasks, request, file_id, user.id, stored.path)
+        audio_file = AudioFile(
+            id=file_id, filename=file.filename, user_id=user.id, storage_key=stored.key, size_bytes=stored.size
+        )
+        response.append(BatchUploadResult(
+            filename=file.filename,
+            status_code=200,
+            file=audio_file_response(audio_file, sha256=stored.sha256)
+        ))
+    return BatchUploadResponse(files=response)
+
+
+def _audio_files_page(statement, cursor: Optional[str]):
+    statement = statement.order_by(AudioFile.id)
+    if cursor:
+        statement = statement.where(AudioFile.id > decode_id_cursor(cursor))
+    return statement
+
+
+async def invalidate_files(request: Request, *user_ids: uuid.UUID):
+    """
+    Сбрасывает версии списков файлов пользователей и общего списка в памяти всех процессов.
 
-    return AudioFileResponse(
-        id=str(audio_file.id),
-        filename=audio_file.filename,
-        filepath=file_location,
-        user_id=str(audio_file.user_id)
-    )
+    Версии в базе увеличивает bump_versions в той же транзакции, что и изменение списка, последним
+    запросом перед фиксацией, поэтому изменение и новая версия видны одновременно. Сброс
+    публикуется только после фиксации: иначе процесс мог бы снова прочитать старую версию.
+    """
+    for user_id in dict.fromkeys(user_ids):
+        await request.app.state.invalidation_bus.publish(FILES_CACHE_CHANNEL, str(user_id))
+
+
+async def _audio_files_list(
+        request: Request,
+        session: AsyncSession,
+        statement,
+        cursor: Optional[str],
+        limit: Optional[int],
+        user_id: Optional[uuid.UUID] = None
+):
+    """
+    Возвращает страницу списка файлов с ETag версии списка.
+
+    Версия (общая или пользователя user_id) читается до запроса страницы, поэтому страница
+    не старше своей версии. Версии общие для всех процессов и хранятся в памяти до изменения
+    списка, поэтому ответ 304 на If-None-Match с текущей версией обычно отдаётся без обращения
+    к базе, каким бы процессом ни была выдана версия. Готовые тела страниц хранятся в listing_cache
+    по версии, курсору и размеру страницы. Потоковые ответы NDJSON не кэшируются.
+    """
+    statement = _audio_files_page(statement, cursor)
+    if wants_ndjson(request):
+        if limit is not None:
+            statement = statement.limit(limit)
+        return ndjson_response(statement, audio_file_payload)
+
+    version = await request.app.state.file_versions.version(session, None if user_id is None else str(user_id))
+    headers = {"ETag": f'"{version}"', "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    cache_key = (user_id, version, cursor, limit)
+    body = request.app.state.listing_cache.get(cache_key)
+    if body is None:
+        rows, next_cursor = await fetch_page(
+            session, statement, page_size(limit), lambda row: (row.id,), scalars=False
+        )
+        body = dumps_json({"files": [audio_file_payload(row) for row in rows], "next_cursor": next_cursor})
+        request.app.state.listing_cache.set(cache_key, body)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @file_router.get("/all", response_model=AudioFilesListResponse)
-async def get_all_audio_files(_: User = Depends(get_user)):
-    """
-    Возвращает список всех аудиофайлов.
-    """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            audio_files: list[AudioFile] = list(
-                (
-                    await session.execute(
-                        select(AudioFile)
-                    )
-                ).scalars().all()
-            )
-            files = [
-                AudioFileResponse(
-                    id=str(file.id),
-                    filename=file.filename,
-                    filepath=os.path.join("uploads", str(file.user_id), str(file.id)),
-                    user_id=str(file.user_id)
-                ) for file in audio_files
-            ]
-            return AudioFilesListResponse(files=files)
+async def get_all_audio_files(
+        request: Request,
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Возвращает список всех аудиофайлов постранично (keyset-пагинация по идентификатору).
+
+    Ответ собирается из выбранных столбцов и сериализуется orjson без повторной
+    валидации по AudioFilesListResponse. Страницы кэшируются до следующего изменения
+    файлов, ETag и If-None-Match позволяют клиентам опрашивать список без повторной загрузки.
+
+    С заголовком Accept: application/x-ndjson файлы отдаются потоком NDJSON,
+    начиная с позиции курсора; без limit поток идёт до конца таблицы.
+    """
+    return await _audio_files_list(request, session, select(*AUDIO_FILE_COLUMNS), cursor, limit)
 
 
 @file_router.get("/user/{user_id}", response_model=AudioFilesListResponse)
 async def get_user_files(
+        request: Request,
         user_id: uuid.UUID,
-        _: User = Depends(get_user)
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
 ):
-    async with await Database().get_session() as session:
-        async with session.begin():
-            audio_files: list[AudioFile] = list(
-                (
-                    await session.execute(
-                        select(AudioFile).where(AudioFile.user_id == user_id)
-                    )
-                ).scalars().all()
-            )
+    """
+    Возвращает аудиофайлы пользователя постранично.
+
+    Поддерживает потоковый режим NDJSON, ETag и кэш страниц, как /file/all; версия списка
+    меняется только при изменении файлов этого пользователя.
+    """
+    statement = select(*AUDIO_FILE_COLUMNS).where(AudioFile.user_id == user_id)
+    return await _audio_files_list(request, session, statement, cursor, limit, user_id)
+
+
+def _search_rank(session: AsyncSession, q: str):
+    """
+    Условие совпадения имени файла с запросом и его релевантность.
+
+    В PostgreSQL подходят имена, содержащие запрос как подстроку (ILIKE) или похожие на него
+    по триграммам (оператор <% из pg_trgm); оба условия используют индекс ix_audio_files_filename_trgm.
+    Релевантность - word_similarity: 1 для точного вхождения, для опечаток - доля общих триграмм.
+    В других СУБД ищется только подстрока, а выше стоят имена, в которых запрос занимает большую часть.
+    """
+    if is_postgresql(session):
+        rank = func.word_similarity(q, AudioFile.filename)
+        match = or_(AudioFile.filename.icontains(q, autoescape=True), literal(q).op("<%")(AudioFile.filename))
+    else:
+        rank = literal(float(len(q))) / func.length(AudioFile.filename)
+        match = AudioFile.filename.icontains(q, autoescape=True)
+    return match, rank.label("rank")
+
+
+@file_router.get("/search", response_model=AudioFilesListResponse)
+async def search_audio_files(
+        q: str = Query(..., min_length=3, max_length=255, description="Часть имени файла"),
+        user_id: Optional[uuid.UUID] = Query(None, description="Искать только среди файлов пользователя"),
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Ищет аудиофайлы по имени: по подстроке и нечёткому совпадению (опечатки), лучшие совпадения первыми.
+
+    Совпадение и релевантность считаются в базе по триграммному индексу, поэтому время поиска
+    не растёт линейно с размером таблицы. Запрос короче трёх символов отклоняется:
+    в нём нет ни одной триграммы и индекс не сужает выборку.
+    Пагинация keyset по (релевантность, идентификатор).
+    """
+    match, rank = _search_rank(session, q)
+    statement = select(*AUDIO_FILE_COLUMNS, rank).where(match).order_by(rank.desc(), AudioFile.id)
+    if user_id is not None:
+        statement = statement.where(AudioFile.user_id == user_id)
+    if cursor:
+        last_rank, last_id = decode_rank_cursor(cursor)
+        statement = statement.where(or_(rank < last_rank, and_(rank == last_rank, AudioFile.id > last_id)))
+
+    rows, next_cursor = await fetch_page(
+        session, statement, page_size(limit), lambda row: (row.rank, row.id), scalars=False
+    )
+    body = dumps_json({"files": [audio_file_payload(row[:-1]) for row in rows], "next_cursor": next_cursor})
+    return Response(body, media_type="application/json")
+
+
+def _ids_match(session: AsyncSession, ids: list[uuid.UUID]):
+    """
+    Условие id = ANY(:ids).
+
+    Все идентификаторы передаются одним параметром-массивом, поэтому текст запроса
+    (и подготовленный запрос asyncpg) не зависит от их количества, в отличие от IN (...).
+    В других СУБД массивов нет, и используется IN (...).
+    """
+    if is_postgresql(session):
+        return AudioFile.id == any_(bindparam("ids", ids, type_=ARRAY(UUID(as_uuid=True))))
+    return AudioFile.id.in_(ids)
+
+
+def _batch_results(
+        ids: list[uuid.UUID],
+        found: dict[uuid.UUID, AudioFile],
+        with_file: bool = True
+) -> BatchFilesResponse:
+    results = []
+    for file_id in ids:
+        audio_file = found.get(file_id)
+        if audio_file is None:
+            results.append(BatchFileResult(id=str(file_id), status_code=404, detail="Audio file not found."))
+        else:
+            results.append(BatchFileResult(
+                id=str(file_id), status_code=200, file=audio_file_response(audio_file) if with_file else None
+            ))
+    return BatchFilesResponse(files=results)
+
+
+@file_router.post("/batch/get", response_model=BatchFilesResponse)
+async def get_audio_files(
+        batch: AudioFileIds,
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Возвращает данные нескольких аудиофайлов одним запросом WHERE id = ANY(...).
+
+    Для идентификаторов, которых нет в базе, возвращается статус 404.
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    audio_files = (await session.execute(select(AudioFile).where(_ids_match(session, ids)))).scalars().all()
+    return _batch_results(ids, {audio_file.id: audio_file for audio_file in audio_files})
+
+
+@file_router.patch("/batch", response_model=BatchFilesResponse)
+async def update_audio_files(
+        request: Request,
+        batch: AudioFilesRename,
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Переименовывает несколько аудиофайлов одним запросом UPDATE ... FROM (VALUES ...).
+
+    Если идентификатор передан несколько раз, применяется последнее имя.
+    Для идентификаторов, которых нет в базе, возвращается статус 404.
+    """
+    names = {item.id: item.filename for item in batch.files}
+    rows = await update_from_values(
+        session, [column("id", UUID(as_uuid=True)), column("filename", String)], list(names.items()),
+        lambda renamed: update(AudioFile)
+        .where(AudioFile.id == renamed.c.id)
+        .values(filename=renamed.c.filename)
+        .returning(AudioFile)
+        .execution_options(synchronize_session=False)
+    )
+    audio_files = [row.AudioFile for row in rows]
+    await bump_versions(session, {str(audio_file.user_id) for audio_file in audio_files})
+    await session.commit()
+    await invalidate_files(request, *(audio_file.user_id for audio_file in audio_files))
+    return _batch_results(list(names), {audio_file.id: audio_file for audio_file in audio_files})
+
+
+@file_router.post("/batch/delete", response_model=BatchFilesResponse)
+async def delete_audio_files(
+        request: Request,
+        batch: AudioFileIds,
+        _: User = Depends(get_admin),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Удаляет несколько аудиофайлов одним запросом DELETE ... RETURNING.
 
-            files = [
-                AudioFileResponse(
-                    id=str(file.id),
-                    filename=file.filename,
-                    filepath=os.path.join("uploads", str(file.user_id), str(file.id)),
-                    user_id=str(file.user_id)
-                ) for file in audio_files
-            ]
-            return AudioFilesListResponse(files=files)
+    Файлы с диска удаляются фоновой очередью после фиксации. Блобы контентно-адресуемого хранилища
+    освобождаются в той же транзакции, а их файлы удаляются после фиксации, если на них не осталось ссылок.
+    Для выполнения операции требуется статус администратора.
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    deleted = await delete_audio_file_records(session, _ids_match(session, ids))
+    await bump_versions(session, {str(row.user_id) for row in deleted})
+    await session.commit()
+    await invalidate_files(request, *(row.user_id for row in deleted))
+
+    request.app.state.deletion_queue.put(*stored_keys(deleted))
+    await delete_unreferenced_blobs(session, blob_hashes(deleted))
+    return _batch_results(ids, {row.id: row for row in deleted}, with_file=False)
 
 
 @file_router.patch("/{file_id}", response_model=AudioFileResponse)
 async def update_audio_file(
+        request: Request,
         file_id: uuid.UUID,
         update: AudioFileUpdate,
-        _: User = Depends(get_user)
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
 ):
     """
     Обновляет данные аудиофайла.
 
     Находит аудиофайл по идентификатору, обновляет его имя и сохраняет изменения в базе данных.
     """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            audio_file: AudioFile = (
-                await session.execute(
-                    select(AudioFile).where(AudioFile.id == file_id)
-                )
-            ).unique().scalar_one_or_none()
+    audio_file: AudioFile = (
+        await session.execute(
+            select(AudioFile).where(AudioFile.id == file_id)
+        )
+    ).unique().scalar_one_or_none()
 
-            if not audio_file:
-                raise HTTPException(status_code=404, detail="Audio file not found.")
+    if not audio_file:
+        raise HTTPException(status_code=404, detail="Audio file not found.")
 
-            audio_file.filename = update.filename
-            await session.commit()
-    return AudioFileResponse(
-        id=str(audio_file.id),
-        filename=audio_file.filename,
-        filepath=os.path.join("uploads", str(audio_file.user_id), str(audio_file.id)),
-        user_id=str(audio_file.user_id)
-    )
+    audio_file.filename = update.filename
+    await bump_versions(session, [str(audio_file.user_id)])
+    await session.commit()
+    await invalidate_files(request, audio_file.user_id)
+    return audio_file_response(audio_file)
 
 
 @file_router.get("/{file_id}", response_model=AudioFileResponse)
-async def get_audio_file(file_id: uuid.UUID, _: User = Depends(get_user)):
+async def get_audio_file(
+        file_id: uuid.UUID,
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
     """
     Возвращает данные аудиофайла по его идентификатору.
     """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            audio_file: AudioFile = (
-                await session.execute(
-                    select(AudioFile).where(AudioFile.id == file_id)
-                )
-            ).unique().scalar_one_or_none()
-
-            if not audio_file:
-                raise HTTPException(status_code=404, detail="Audio file not found.")
-
-            return AudioFileResponse(
-                id=str(audio_file.id),
-                filename=audio_file.filename,
-                filepath=os.path.join("uploads", str(audio_file.user_id), str(audio_file.id)),
-                user_id=str(audio_file.user_id)
+    audio_file: AudioFile = (
+        await session.execute(
+            select(AudioFile).where(AudioFile.id == file_id)
+        )
+    ).unique().scalar_one_or_none()
+
+    if not audio_file:
+        raise HTTPException(status_code=404, detail="Audio file not found.")
+
+    return audio_file_response(audio_file)
+
+
+def _file_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _is_not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    """
+    Проверяет условные заголовки запроса (If-None-Match имеет приоритет над If-Modified-Since).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _iter_file(f: BinaryIO) -> AsyncIterator[bytes]:
+    try:
+        while chunk := await run_in_threadpool(f.read, CHUNK_SIZE):
+            yield chunk
+    finally:
+        await run_in_threadpool(f.close)
+
+
+@file_router.get("/{file_id}/content")
+async def get_audio_file_content(
+        request: Request,
+        file_id: uuid.UUID,
+        background_tasks: BackgroundTasks,
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Отдаёт содержимое аудиофайла.
+
+    Поддерживает запросы Range (в том числе с несколькими диапазонами) для перемотки в плеерах,
+    заголовки ETag и Last-Modified, а на условные запросы отвечает 304 без чтения файла.
+    Если задан X_ACCEL_REDIRECT_PREFIX, тело ответа отдаёт nginx через sendfile по внутреннему
+    location, и байты файла не проходят через Python. Пути файлов дополнительных томов
+    начинаются с имени тома, и для каждого такого тома в nginx нужен свой alias.
+
+    Чтение отмечается в памяти процесса для переноса давно не читавшихся файлов в холодный уровень.
+    Файл холодного уровня распаковывается прозрачно, с теми же ETag и Last-Modified (см. backend.tiering).
+    """
+    audio_file = (
+        await session.execute(
+            select(
+                AudioFile.id, AudioFile.filename, AudioFile.user_id, AudioFile.storage_key, AudioFile.cold,
+                AudioFile.last_accessed_at
             )
+            .where(AudioFile.id == file_id)
+        )
+    ).one_or_none()
+    # Соединение возвращается в пул до начала отдачи файла
+    await session.commit()
+
+    if not audio_file:
+        raise HTTPException(status_code=404, detail="Audio file not found.")
+    request.app.state.access_tracker.touch(audio_file.id, audio_file.last_accessed_at)
+
+    storage = get_storage()
+    cold_tier: ColdTier = request.app.state.cold_tier
+    key = audio_file_key(audio_file)
+    stat_result = None if audio_file.cold else await storage.stat(key)
+    cold = None
+    if stat_result is None:
+        # Файл мог перейти между уровнями после чтения записи, поэтому проверяются оба места
+        cold = await cold_tier.info(key)
+        if cold is None and audio_file.cold:
+            stat_result = await storage.stat(key)
+        if cold is None and stat_result is None:
+            raise HTTPException(status_code=404, detail="Audio file content not found.")
+    if cold is not None:
+        stat_result = cold.stat_result()
+
+    etag = _file_etag(stat_result)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+    if _is_not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    # У блобов нет расширения, поэтому тип определяется по исходному имени файла
+    media_type = (
+        mimetypes.guess_type(audio_file.filename)[0] or mimetypes.guess_type(key)[0] or "application/octet-stream"
+    )
+
+    if cold is not None:
+        if audio_file.cold and cold_tier.should_promote(audio_file.last_accessed_at):
+            background_tasks.add_task(cold_tier.promote, audio_file.id, key)
+        cached = cold_tier.cached_path(key)
+        if cached is None:
+            # Первое чтение распаковывается потоком, без поддержки Range
+            headers["Content-Length"] = str(cold.size)
+            return StreamingResponse(cold_tier.stream(key, cold), media_type=media_type, headers=headers)
+        COLD_READS.labels("cache").inc()
+        return FileResponse(cached, media_type=media_type, headers=headers, stat_result=stat_result)
+
+    accel_prefix = request.app.state.x_accel_redirect_prefix
+    redirect_path = storage.redirect_path(key) if accel_prefix else None
+    if redirect_path is not None:
+        headers["X-Accel-Redirect"] = f"{accel_prefix.rstrip('/')}/{quote(redirect_path)}"
+        return Response(headers=headers, media_type=media_type)
+
+    path = storage.local_path(key)
+    if path is None:
+        # Хранилище без локальных файлов: содержимое отдаётся потоком, без поддержки Range
+        headers["Content-Length"] = str(stat_result.st_size)
+        return StreamingResponse(_iter_file(await storage.get(key)), media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+@file_router.get("/{file_id}/waveform", response_model=WaveformResponse)
+async def get_audio_file_waveform(
+        request: Request,
+        file_id: uuid.UUID,
+        points: int = Query(1024, ge=1, le=PEAKS_LEVELS[-1], description="Количество точек"),
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Возвращает пики волновой формы аудиофайла: минимум и максимум амплитуды по points интервалам.
+
+    Пики считаются один раз после загрузки и хранятся рядом с файлом в нескольких разрешениях,
+    поэтому запрос читает из отображённого в память файла пиков несколько килобайт.
+    Если файла пиков нет, он строится в пуле процессов при первом запросе; файл холодного уровня
+    для этого распаковывается во временный файл.
+    """
+    audio_file = (
+        await session.execute(
+            select(AudioFile.id, AudioFile.user_id, AudioFile.storage_key).where(AudioFile.id == file_id)
+        )
+    ).one_or_none()
+    await session.commit()
+
+    if not audio_file:
+        raise HTTPException(status_code=404, detail="Audio file not found.")
+
+    path = audio_file_path(audio_file)
+    peaks = await run_in_threadpool(read_peaks, peaks_path(path), points)
+    if peaks is None:
+        cached = request.app.state.cold_tier.cached_path(audio_file_key(audio_file))
+        try:
+            await run_in_process(request.app.state.process_pool, compute_file_peaks, path, cached)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Audio file content not found.")
+        except WaveformUnavailable:
+            raise HTTPException(status_code=422, detail="Unable to decode audio file")
+        peaks = await run_in_threadpool(read_peaks, peaks_path(path), points)
+
+    values = (peaks / PEAKS_SCALE).round(4)
+    return WaveformResponse(points=len(values), min=values[:, 0].tolist(), max=values[:, 1].tolist())
 
 
 @file_router.delete("/{file_id}")
-async def delete_audio_file(file_id: uuid.UUID, _: User = Depends(get_admin)):
+async def delete_audio_file(
+        request: Request,
+        file_id: uuid.UUID,
+        _: User = Depends(get_admin),
+        session: AsyncSession = Depends(get_db_session)
+):
     """
     Удаляет аудиофайл по его идентификатору.
 
-    Находит аудиофайл в базе данных, удаляет файл с диска и запись из базы данных.
+    Запись удаляется из базы данных, а файл с диска - фоновой очередью после фиксации транзакции.
+    Файл из хранилища блобов удаляется только вместе с последней ссылкой на него.
     Для выполнения операции требуется статус администратора.
     """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            audio_file: AudioFile = (
-                await session.execute(
-                    select(AudioFile).where(AudioFile.id == file_id)
-                )
-            ).unique().scalar_one_or_none()
-
-            if not audio_file:
-                raise HTTPException(status_code=404, detail="Audio file not found.")
-
-            filepath = os.path.join("uploads", str(audio_file.user_id), str(audio_file.id))
-            os.remove(filepath)
-
-            await session.delete(audio_file)
-            await session.commit()
+    deleted = await delete_audio_file_records(session, AudioFile.id == file_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Audio file not found.")
+
+    await bump_versions(session, [str(deleted[0].user_id)])
+    await session.commit()
+    await invalidate_files(request, deleted[0].user_id)
+    request.app.state.deletion_queue.put(*stored_keys(deleted))
+    await delete_unreferenced_blobs(session, blob_hashes(deleted))
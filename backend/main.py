@@ -1,13 +1,26 @@
+import asyncio
 import os
+import time
 from contextlib import asynccontextmanager
 
+import aiohttp
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.datastructures import State
 
+from backend.admission import UploadAdmission, UploadAdmissionMiddleware
 from backend.api import api_router
-from backend.auth import auth_router
-from backend.files import file_router
+from backend.auth import USER_CACHE_CHANNEL, auth_router
+from backend.cache import BytesLRUCache, InvalidationBus, PostgresInvalidationBus, TTLCache
+from backend.deletion import DeletionQueue
+from backend.files import FILES_CACHE_CHANNEL, file_router
+from backend.metrics import (MetricsMiddleware, instrument_engine, metrics_router, record_startup,
+                             release_process_metrics)
+from backend.resumable import run_upload_session_cleanup
+from backend.storage import create_storage, get_storage, set_storage
+from backend.tiering import AccessTracker, ColdTier
+from backend.versions import SharedVersions
+from backend.workers import create_process_pool
 from database import Database
 
 load_dotenv()
@@ -15,26 +28,129 @@ load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    started = time.perf_counter()
     if not hasattr(app, "state"):
         app.state = State()
 
     app.state.yandex_client_id = os.getenv("YANDEX_CLIENT_ID")
     app.state.yandex_client_secret = os.getenv("YANDEX_CLIENT_SECRET")
     app.state.yandex_redirect_uri = os.getenv("YANDEX_REDIRECT_URI")
+    app.state.yandex_authorize_url = os.getenv("YANDEX_AUTHORIZE_URL", "https://oauth.yandex.ru/authorize")
+    app.state.yandex_token_url = os.getenv("YANDEX_TOKEN_URL", "https://oauth.yandex.com/token")
+    app.state.yandex_user_info_url = os.getenv("YANDEX_USER_INFO_URL", "https://login.yandex.ru/info")
     app.state.jwt_secret = os.getenv("JWT_SECRET")
     app.state.jwt_algorithm = os.getenv("JWT_ALGORITHM", "HS256")
     app.state.jwt_exp_delta_seconds = int(os.getenv("JWT_EXP_DELTA_SECONDS"))
+    app.state.max_upload_size = int(os.getenv("MAX_UPLOAD_SIZE", 500 * 1024 * 1024))
+    app.state.upload_concurrency = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+    # Допуск загрузок: одновременные загрузки процесса и пользователя, очередь ожидания
+    # и скорость приёма пользователя в байтах в секунду (UPLOAD_USER_RATE, 0 - без ограничения)
+    app.state.upload_admission = UploadAdmission(
+        max_active=int(os.getenv("UPLOAD_MAX_ACTIVE", 8)),
+        max_per_user=int(os.getenv("UPLOAD_MAX_PER_USER", 4)),
+        max_queue=int(os.getenv("UPLOAD_QUEUE_SIZE", 32)),
+        queue_timeout=float(os.getenv("UPLOAD_QUEUE_TIMEOUT", 30)),
+        user_rate=float(os.getenv("UPLOAD_USER_RATE", 0)) or None,
+        user_burst=float(os.getenv("UPLOAD_USER_BURST", 0)) or None,
+        retry_after=int(os.getenv("UPLOAD_RETRY_AFTER", 5)),
+    )
+    # Квота на суммарный размер файлов пользователя в байтах (0 - без ограничения)
+    app.state.user_quota_bytes = int(os.getenv("USER_QUOTA_BYTES", 0)) or None
+    app.state.x_accel_redirect_prefix = os.getenv("X_ACCEL_REDIRECT_PREFIX")
+    app.state.upload_session_ttl = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 60 * 60))
+    app.state.content_addressed_storage = (
+        os.getenv("CONTENT_ADDRESSED_STORAGE", "false").lower() in ("1", "true", "yes")
+    )
+
+    app.state.user_cache = TTLCache(
+        maxsize=int(os.getenv("USER_CACHE_SIZE", 10000)),
+        ttl=float(os.getenv("USER_CACHE_TTL", 60))
+    )
+    # Версии списков файлов и кэш готовых страниц списков (LISTING_CACHE_BYTES байт)
+    app.state.file_versions = SharedVersions()
+    app.state.listing_cache = BytesLRUCache(maxbytes=int(os.getenv("LISTING_CACHE_BYTES", 64 * 1024 * 1024)))
 
     await Database().init()
+    # Замер времени SQL-запросов и метрики пула для /metrics
+    instrument_engine(Database().engine.sync_engine, float(os.getenv("DB_SLOW_QUERY_SECONDS", 0.5)))
+
+    # Инвалидация кэшей во всех процессах через LISTEN/NOTIFY. INVALIDATION_BUS_DSN задаёт
+    # прямое подключение к PostgreSQL, если DATABASE_URL указывает на pgbouncer в режиме транзакций.
+    engine_url = Database().engine.url
+    if engine_url.get_backend_name() == "postgresql":
+        app.state.invalidation_bus = PostgresInvalidationBus(os.getenv("INVALIDATION_BUS_DSN") or (
+            engine_url.set(drivername="postgresql").render_as_string(hide_password=False)
+        ))
+    else:
+        app.state.invalidation_bus = InvalidationBus()
+    app.state.invalidation_bus.subscribe(USER_CACHE_CHANNEL, app.state.user_cache.invalidate)
+    app.state.invalidation_bus.subscribe(FILES_CACHE_CHANNEL, app.state.file_versions.invalidate)
+    app.state.invalidation_bus.subscribe_reset(app.state.user_cache.clear)
+    app.state.invalidation_bus.subscribe_reset(app.state.file_versions.reset)
+    await app.state.invalidation_bus.start()
+
+    # Хранилище файлов: тома и резерв места из STORAGE_VOLUMES и STORAGE_MIN_FREE
+    set_storage(create_storage())
+
+    # Общий HTTP-клиент для запросов к Яндексу: пул соединений с keep-alive и кэшем DNS
+    # переживает отдельные запросы, поэтому TLS-рукопожатие не повторяется на каждый вход.
+    app.state.http_client = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=int(os.getenv("HTTP_CLIENT_POOL_SIZE", 100)),
+            keepalive_timeout=30,
+            ttl_dns_cache=300,
+        ),
+        timeout=aiohttp.ClientTimeout(total=float(os.getenv("HTTP_CLIENT_TIMEOUT", 10)), connect=3),
+    )
+
+    # Пул процессов для разбора аудиофайлов после загрузки
+    app.state.process_pool = create_process_pool(int(os.getenv("AUDIO_WORKERS", os.cpu_count() or 1)))
+
+    # Очередь удаления файлов с диска после удаления записей из базы
+    app.state.deletion_queue = DeletionQueue()
+    deletion_task = asyncio.create_task(app.state.deletion_queue.run())
+
+    cleanup_task = asyncio.create_task(
+        run_upload_session_cleanup(int(os.getenv("UPLOAD_SESSION_CLEANUP_INTERVAL", 10 * 60)))
+    )
+
+    # Уровни хранения: отметки чтения файлов пишутся в базу раз в ACCESS_FLUSH_INTERVAL секунд,
+    # не чаще раза в ACCESS_RESOLUTION секунд на файл. Распакованные копии холодных файлов кэшируются
+    # в COLD_CACHE_DIR (по умолчанию во временном каталоге) до COLD_CACHE_BYTES байт, а файл,
+    # прочитанный повторно в течение COLD_PROMOTE_WINDOW секунд (0 - никогда), возвращается в горячий уровень.
+    app.state.access_tracker = AccessTracker(resolution=float(os.getenv("ACCESS_RESOLUTION", 60 * 60)))
+    access_task = asyncio.create_task(app.state.access_tracker.run(float(os.getenv("ACCESS_FLUSH_INTERVAL", 60))))
+    app.state.cold_tier = ColdTier(
+        directory=os.getenv("COLD_CACHE_DIR"),
+        maxbytes=int(os.getenv("COLD_CACHE_BYTES", 1024 * 1024 * 1024)),
+        promote_window=float(os.getenv("COLD_PROMOTE_WINDOW", 24 * 60 * 60)),
+    )
+    record_startup(time.perf_counter() - started)
     yield
+    cleanup_task.cancel()
+    deletion_task.cancel()
+    access_task.cancel()
+    await app.state.deletion_queue.flush()
+    await app.state.access_tracker.flush()
+    await app.state.cold_tier.close()
+    await app.state.http_client.close()
+    app.state.process_pool.shutdown(wait=False, cancel_futures=True)
+    await get_storage().close()
+    await app.state.invalidation_bus.close()
+    release_process_metrics()
 
 
 app = FastAPI(lifespan=lifespan)
+# Последний добавленный middleware внешний: отклонённые при допуске загрузки тоже попадают в метрики
+app.add_middleware(UploadAdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth_router)
 app.include_router(api_router)
+app.include_router(metrics_router)
 
 if __name__ == '__main__':
     import uvicorn
 
+    # Запуск для разработки; в продакшене используется python -m backend.server
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
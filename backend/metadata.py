@@ -0,0 +1,67 @@
+import logging
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from sqlalchemy import update
+
+from backend.versions import bump_versions
+from backend.workers import run_in_process
+from database import Database
+from database.models import AudioFile
+
+logger = logging.getLogger(__name__)
+
+METADATA_FIELDS = ("duration", "sample_rate", "channels", "bit_rate", "codec")
+
+
+def extract_metadata(path: str) -> dict:
+    """
+    Разбирает заголовки контейнера аудиофайла (WAV, FLAC, MP3, OGG и др.) через mutagen.
+
+    Выполняется в пуле процессов. Данные аудио не декодируются, читаются только заголовки.
+    Для нераспознанного или отсутствующего файла все поля равны None.
+    """
+    import mutagen
+
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    try:
+        audio = mutagen.File(path)
+    except (mutagen.MutagenError, OSError):
+        return metadata
+    if audio is None:
+        return metadata
+
+    info = audio.info
+    metadata["duration"] = getattr(info, "length", None)
+    metadata["sample_rate"] = getattr(info, "sample_rate", None) or None
+    metadata["channels"] = getattr(info, "channels", None) or None
+    metadata["bit_rate"] = getattr(info, "bitrate", None) or None
+    metadata["codec"] = getattr(info, "codec", None) or type(audio).__name__.lower()
+    return metadata
+
+
+async def extract_audio_metadata(pool: ProcessPoolExecutor, file_id: uuid.UUID, path: str) -> Optional[dict]:
+    """
+    Извлекает метаданные файла в пуле процессов и сохраняет их в запись аудиофайла.
+
+    Запускается фоновой задачей после ответа на загрузку. Ошибки пишутся в лог:
+    такие записи остаются необработанными и подхватываются скриптом scripts.backfill_metadata.
+    """
+    try:
+        metadata = await run_in_process(pool, extract_metadata, path)
+        async with await Database().get_session() as session:
+            async with session.begin():
+                user_ids = (
+                    await session.execute(
+                        update(AudioFile)
+                        .where(AudioFile.id == file_id)
+                        .values(**metadata, metadata_extracted=True)
+                        .returning(AudioFile.user_id)
+                    )
+                ).scalars().all()
+                await bump_versions(session, {str(user_id) for user_id in user_ids})
+        return metadata
+    except Exception:
+        logger.exception("Failed to extract metadata of audio file %s", file_id)
+        return None
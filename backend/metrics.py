@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+from fastapi.routing import iter_route_contexts
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+UNMATCHED_ROUTE = "<unmatched>"  # Метка для запросов, которые не совпали ни с одним маршрутом
+STATEMENT_KINDS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"})
+THROUGHPUT_BUCKETS = tuple(2 ** power for power in range(16, 32, 2))  # 64 КБ/с .. 512 МБ/с
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса до отправки последнего байта ответа",
+    ["method", "route"]
+)
+REQUESTS = Counter("http_requests", "Количество HTTP-запросов по статусу ответа", ["method", "route", "status"])
+# В режиме нескольких процессов (PROMETHEUS_MULTIPROC_DIR) показатели процессов складываются
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Количество HTTP-запросов в обработке", multiprocess_mode="livesum"
+)
+
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса", ["statement"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+SLOW_QUERIES = Counter("db_slow_queries", "Количество медленных SQL-запросов", ["statement"])
+POOL_SIZE = Gauge("db_pool_size", "Постоянный размер пула соединений", multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Соединения, выданные из пула", multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Соединения сверх размера пула (отрицательно, пока пул не заполнен)",
+    multiprocess_mode="livesum"
+)
+
+UPLOAD_BYTES = Counter("upload_bytes", "Принятые байты загрузок", ["kind"])
+UPLOAD_FILES = Counter("upload_files", "Принятые файлы (для возобновляемых загрузок - части)", ["kind"])
+UPLOAD_THROUGHPUT = Histogram(
+    "upload_throughput_bytes_per_second", "Скорость приёма и записи одной загрузки", ["kind"],
+    buckets=THROUGHPUT_BUCKETS
+)
+
+UPLOADS_ADMITTED = Gauge(
+    "upload_admission_active", "Загрузки, допущенные к приёму тела", multiprocess_mode="livesum"
+)
+UPLOAD_QUEUE_DEPTH = Gauge(
+    "upload_admission_queue_depth", "Загрузки, ожидающие допуска в очереди", multiprocess_mode="livesum"
+)
+UPLOAD_QUEUE_WAIT = Histogram(
+    "upload_admission_wait_seconds", "Время ожидания загрузки в очереди допуска",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+UPLOAD_REJECTIONS = Counter(
+    "upload_admission_rejections", "Загрузки, отклонённые при допуске, по причине", ["reason"]
+)
+UPLOAD_THROTTLED_SECONDS = Counter(
+    "upload_throttled_seconds", "Суммарная задержка приёма загрузок ограничением скорости пользователя"
+)
+
+COLD_READS = Counter(
+    "cold_tier_reads", "Чтения файлов холодного уровня: из кэша распакованных копий или с распаковкой", ["source"]
+)
+COLD_PROMOTIONS = Counter("cold_tier_promotions", "Файлы, возвращённые из холодного уровня в горячий")
+
+STARTUP_SECONDS = Gauge(
+    "app_startup_seconds", "Время запуска процесса приложения (lifespan) до готовности принимать запросы",
+    multiprocess_mode="livemax"
+)
+COLD_START_SECONDS = Gauge(
+    "app_cold_start_seconds", "Время от запуска backend.server до готовности процесса, включая импорт модулей",
+    multiprocess_mode="livemax"
+)
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Отдаёт метрики в текстовом формате Prometheus.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR (backend.server с несколькими процессами), метрики
+    собираются из файлов всех процессов, поэтому ответ не зависит от того, какой процесс принял запрос.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware, которое считает время обработки и статусы запросов по маршрутам.
+
+    Меткой служит шаблон маршрута (/api/file/{file_id}), а не реальный путь, поэтому
+    число временных рядов не растёт с числом файлов и пользователей. Маршрутизатор
+    кладёт в scope["route"] исходный маршрут с путём без префиксов вложенных роутеров,
+    поэтому полные шаблоны один раз собираются из маршрутов приложения (iter_route_contexts).
+    Время считается до отправки последнего байта ответа, поэтому потоковые ответы
+    учитываются целиком.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Optional[dict[int, str]] = None
+
+    def _route_path(self, scope: Scope) -> str:
+        route = scope.get("route")
+        if route is None:
+            return UNMATCHED_ROUTE
+        if self._route_paths is None:
+            self._route_paths = {
+                id(context.original_route): context.path_format for context in iter_route_contexts(scope["app"].routes)
+            }
+        return self._route_paths.get(id(route)) or getattr(route, "path", UNMATCHED_ROUTE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            labels = (scope["method"], self._route_path(scope))
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+            REQUESTS.labels(*labels, str(status)).inc()
+
+
+_slow_query_seconds = 0.5  # Порог медленного запроса, задаётся в instrument_engine
+_pool: Optional[Pool] = None  # Пул соединений движка, задаётся в instrument_engine
+
+
+def _statement_kind(statement: str) -> str:
+    # Смотрим только на начало запроса, чтобы не копировать длинный текст
+    words = statement[:8].split(None, 1)
+    kind = words[0].upper() if words else ""
+    return kind if kind in STATEMENT_KINDS else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    kind = _statement_kind(statement)
+    QUERY_LATENCY.labels(kind).observe(elapsed)
+    if elapsed >= _slow_query_seconds:
+        SLOW_QUERIES.labels(kind).inc()
+        logger.warning("Slow query (%.3f s): %s", elapsed, " ".join(statement.split())[:500])
+
+
+def _handle_error(context):
+    # Запрос с ошибкой не доходит до after_cursor_execute: снимаем его время со стека
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _update_pool_metrics(*args):
+    POOL_CHECKED_OUT.set(_pool.checkedout())
+    POOL_OVERFLOW.set(_pool.overflow())
+
+
+def _on_checkin(*args):
+    # checkin срабатывает до возврата соединения в пул, поэтому показатели читаются после него
+    try:
+        asyncio.get_running_loop().call_soon(_update_pool_metrics)
+    except RuntimeError:
+        _update_pool_metrics()
+
+
+def instrument_engine(engine: Engine, slow_query_seconds: float):
+    """
+    Подключает к движку замер времени SQL-запросов и метрики пула соединений.
+
+    Запросы дольше slow_query_seconds дополнительно считаются в db_slow_queries
+    и пишутся в лог с текстом запроса (без параметров).
+
+    События cursor_execute срабатывают на каждом запросе, поэтому обработчики только
+    засекают время и выбирают метки по первому слову запроса. Показатели пула
+    обновляются при выдаче и возврате соединений: в режиме нескольких процессов
+    значения читаются из файлов процессов, а не из пула в момент сбора метрик.
+    При повторном вызове для того же движка обработчики не дублируются.
+    """
+    global _slow_query_seconds, _pool
+    _slow_query_seconds = slow_query_seconds
+
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+    _pool = engine.pool
+    if not event.contains(_pool, "checkout", _update_pool_metrics):
+        event.listen(_pool, "checkout", _update_pool_metrics)
+        event.listen(_pool, "checkin", _on_checkin)
+    POOL_SIZE.set(_pool.size())
+    _update_pool_metrics()
+
+
+def record_upload(kind: str, size: int, seconds: float):
+    """
+    Учитывает принятую загрузку: байты и скорость приёма.
+
+    :param kind: Способ загрузки: single, batch или resumable
+    """
+    UPLOAD_BYTES.labels(kind).inc(size)
+    UPLOAD_FILES.labels(kind).inc()
+    if seconds > 0:
+        UPLOAD_THROUGHPUT.labels(kind).observe(size / seconds)
+
+
+def record_startup(seconds: float):
+    """
+    Учитывает время запуска процесса приложения.
+
+    Если процесс запущен через backend.server, дополнительно учитывается время холодного старта
+    от запуска сервера (SERVER_STARTED_AT) до готовности процесса.
+    """
+    STARTUP_SECONDS.set(seconds)
+    logger.info("Application startup completed in %.3f s", seconds)
+    server_started_at = os.getenv("SERVER_STARTED_AT")
+    if server_started_at:
+        cold_start = time.time() - float(server_started_at)
+        COLD_START_SECONDS.set(cold_start)
+        logger.info("Cold start completed in %.3f s", cold_start)
+
+
+def release_process_metrics():
+    """
+    Убирает показатели завершающегося процесса из метрик нескольких процессов.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
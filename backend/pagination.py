@@ -0,0 +1,124 @@
+import base64
+import binascii
+import json
+import uuid
+from typing import Any, Callable, Optional
+
+import orjson
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.responses import dumps_json
+from database import Database
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 500  # Сколько строк читать из серверного курсора за раз
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Кодирует значения ключа последней строки страницы в непрозрачный курсор.
+    """
+    raw = json.dumps([str(value) for value in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[str]:
+    """
+    Декодирует курсор, полученный от encode_cursor.
+
+    При некорректном курсоре выбрасывается HTTPException 400.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def decode_id_cursor(cursor: str) -> uuid.UUID:
+    """
+    Декодирует курсор, ключом которого является только идентификатор записи.
+    """
+    values = decode_cursor(cursor)
+    try:
+        (last_id,) = values
+        return uuid.UUID(last_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, uuid.UUID]:
+    """
+    Декодирует курсор выдачи, отсортированной по релевантности и идентификатору.
+    """
+    values = decode_cursor(cursor)
+    try:
+        rank, last_id = values
+        return float(rank), uuid.UUID(last_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_size(limit: Optional[int]) -> int:
+    return DEFAULT_PAGE_SIZE if limit is None else limit
+
+
+async def fetch_page(
+        session: AsyncSession,
+        statement: Select,
+        limit: int,
+        cursor_key: Callable[[Any], tuple],
+        scalars: bool = True
+) -> tuple[list, Optional[str]]:
+    """
+    Выполняет запрос страницы keyset-пагинации.
+
+    Запрос должен быть уже отсортирован по стабильному ключу и отфильтрован по курсору.
+    Выбирается limit + 1 строка: лишняя строка показывает, что есть следующая страница.
+
+    :param scalars: Вернуть сущности (select(Model)); при False возвращаются строки Row
+        с выбранными столбцами
+    :return: Строки страницы и курсор следующей страницы (None, если страница последняя)
+    """
+    result = await session.execute(statement.limit(limit + 1))
+    rows = list(result.scalars().all() if scalars else result.all())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*cursor_key(rows[-1]))
+    return rows, next_cursor
+
+
+def wants_ndjson(request: Request) -> bool:
+    """
+    Проверяет, запросил ли клиент потоковый ответ в формате NDJSON.
+    """
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(statement: Select, serialize: Callable[[Any], dict]) -> StreamingResponse:
+    """
+    Возвращает потоковый ответ NDJSON: по одной JSON-строке на запись.
+
+    Строки Row читаются из серверного курсора (session.stream) пачками по NDJSON_BATCH_SIZE,
+    превращаются в словари функцией serialize, сериализуются orjson (dumps_json) и сразу отправляются
+    клиенту, поэтому память не зависит от размера таблицы.
+    Сессия открывается внутри генератора и живёт, пока идёт отправка ответа.
+    """
+
+    async def generate():
+        async with await Database().get_session() as session:
+            async with session.begin():
+                result = await session.stream(statement.execution_options(yield_per=NDJSON_BATCH_SIZE))
+                async for partition in result.partitions():
+                    yield b"".join(dumps_json(serialize(row), orjson.OPT_APPEND_NEWLINE) for row in partition)
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,27 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON-ответ, который сериализуется orjson.
+
+    Используется обработчиками списков, которые собирают ответ из словарей по строкам
+    запроса (Row) и возвращают его напрямую: FastAPI не валидирует такой ответ
+    по response_model второй раз, а response_model остаётся только для схемы OpenAPI.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def dumps_json(content: Any, option: int = 0) -> bytes:
+    """
+    Сериализует content в JSON через orjson.
+
+    asyncpg возвращает UUID собственного подкласса uuid.UUID, который orjson не принимает,
+    поэтому такие значения (и другие неизвестные orjson типы) переводятся в строку.
+    """
+    return orjson.dumps(content, default=str, option=option)
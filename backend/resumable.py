@@ -0,0 +1,315 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Request, Response
+from pydantic import BaseModel, Field
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from backend.auth import get_user
+from backend.blobs import acquire_file_blob, place_file_blob
+from backend.db import get_db_session
+from backend.files import AudioFileResponse, audio_file_response, invalidate_files, schedule_post_upload
+from backend.metrics import record_upload
+from backend.storage import (StorageFull, UploadConflict, UploadTooLarge, append_stream, get_storage, lock_partial,
+                             partial_path, partial_size, upload_name)
+from backend.usage import QuotaExceeded, add_usage, check_quota
+from backend.versions import bump_versions
+from database import Database
+from database.models import AudioFile, UploadSession, User
+
+logger = logging.getLogger(__name__)
+
+resumable_router = APIRouter(prefix="/file/resumable", tags=["file"])
+
+
+class UploadSessionCreate(BaseModel):
+    """
+    Модель для создания сессии возобновляемой загрузки.
+    """
+    filename: str = Field(..., description="Исходное имя файла")
+    content_type: str = Field(..., description="MIME-тип файла (должен быть аудио)")
+    total_size: Optional[int] = Field(None, ge=0, description="Полный размер файла в байтах, если известен")
+
+
+class UploadSessionResponse(BaseModel):
+    """
+    Модель ответа с состоянием сессии возобновляемой загрузки.
+    """
+    id: str = Field(..., description="Идентификатор сессии загрузки")
+    filename: str = Field(..., description="Исходное имя файла")
+    offset: int = Field(..., description="Количество уже полученных байт")
+    total_size: Optional[int] = Field(None, description="Полный размер файла в байтах")
+    expires_at: datetime.datetime = Field(..., description="Время, после которого сессия будет удалена")
+
+
+def _session_response(upload_session: UploadSession, offset: int) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        id=str(upload_session.id),
+        filename=upload_session.filename,
+        offset=offset,
+        total_size=upload_session.total_size,
+        expires_at=upload_session.expires_at
+    )
+
+
+def _expires_at(request: Request) -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        seconds=request.app.state.upload_session_ttl
+    )
+
+
+async def _get_upload_session(
+        session: AsyncSession,
+        session_id: uuid.UUID,
+        user: User,
+        for_update: bool = False
+) -> UploadSession:
+    statement = select(UploadSession).where(UploadSession.id == session_id, UploadSession.user_id == user.id)
+    if for_update:
+        statement = statement.with_for_update()
+    upload_session: UploadSession = (await session.execute(statement)).unique().scalar_one_or_none()
+
+    if not upload_session:
+        raise HTTPException(status_code=404, detail="Upload session not found.")
+    return upload_session
+
+
+@resumable_router.post("", response_model=UploadSessionResponse, status_code=201)
+async def create_upload_session(
+        request: Request,
+        create: UploadSessionCreate,
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Создаёт сессию возобновляемой загрузки.
+
+    Дальше файл передаётся частями через PATCH, а после получения всех байт
+    загрузка завершается через POST /file/resumable/{session_id}/complete.
+    """
+    if not create.content_type.startswith("audio/"):
+        raise HTTPException(status_code=400, detail="Incorrect file type. Only audio files are allowed")
+
+    max_upload_size = request.app.state.max_upload_size
+    if create.total_size is not None and max_upload_size is not None and create.total_size > max_upload_size:
+        raise HTTPException(status_code=413, detail="File is too large")
+    if create.total_size is not None:
+        try:
+            await check_quota(session, user.id, create.total_size, request.app.state.user_quota_bytes)
+        except QuotaExceeded:
+            raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
+    upload_session = UploadSession(
+        id=uuid.uuid4(),
+        user_id=user.id,
+        filename=create.filename,
+        total_size=create.total_size,
+        expires_at=_expires_at(request)
+    )
+    session.add(upload_session)
+    await session.commit()
+
+    return _session_response(upload_session, 0)
+
+
+@resumable_router.get("/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+        session_id: uuid.UUID,
+        response: Response,
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Возвращает текущее смещение сессии загрузки.
+
+    Смещение также передаётся в заголовке Upload-Offset: с него клиент
+    продолжает загрузку после обрыва соединения.
+    """
+    upload_session = await _get_upload_session(session, session_id, user)
+
+    offset = await run_in_threadpool(partial_size, partial_path(upload_session.id))
+    response.headers["Upload-Offset"] = str(offset)
+    return _session_response(upload_session, offset)
+
+
+@resumable_router.patch("/{session_id}", response_model=UploadSessionResponse)
+async def upload_chunk(
+        request: Request,
+        session_id: uuid.UUID,
+        response: Response,
+        upload_offset: int = Header(..., ge=0),
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Дописывает очередную часть файла, переданную в теле запроса.
+
+    Заголовок Upload-Offset должен совпадать с текущим смещением сессии,
+    иначе возвращается 409 и клиент должен запросить актуальное смещение.
+    """
+    upload_session = await _get_upload_session(session, session_id, user)
+    upload_session.expires_at = _expires_at(request)
+    # Фиксируем продление сессии до приёма тела, чтобы не держать соединение во время загрузки
+    await session.commit()
+
+    max_size = request.app.state.max_upload_size
+    if upload_session.total_size is not None:
+        max_size = upload_session.total_size
+
+    started = time.perf_counter()
+    try:
+        offset = await append_stream(request.stream(), partial_path(upload_session.id), upload_offset, max_size)
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Chunk exceeds the declared file size")
+    except ClientDisconnect:
+        return Response(status_code=400)
+    record_upload("resumable", offset - upload_offset, time.perf_counter() - started)
+
+    response.headers["Upload-Offset"] = str(offset)
+    return _session_response(upload_session, offset)
+
+
+@resumable_router.post("/{session_id}/complete", response_model=AudioFileResponse)
+async def complete_upload_session(
+        request: Request,
+        session_id: uuid.UUID,
+        background_tasks: BackgroundTasks,
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Завершает возобновляемую загрузку.
+
+    Частичный файл переносится на место постоянного хранения (без копирования, если
+    выбранный том совпадает с основным), создаётся запись аудиофайла, а сессия удаляется.
+    В режиме CONTENT_ADDRESSED_STORAGE файл становится блобом, а если такое содержимое
+    уже хранится, частичный файл просто удаляется.
+
+    Строка сессии блокируется до конца транзакции, чтобы параллельное завершение дождалось
+    удаления сессии, а частичный файл - на время проверки размера и переноса, чтобы его
+    не дописывали после проверки.
+    """
+    upload_session = await _get_upload_session(session, session_id, user, for_update=True)
+
+    source = partial_path(upload_session.id)
+    try:
+        partial = await run_in_threadpool(lock_partial, source)
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        size = os.fstat(partial.fileno()).st_size
+        if size == 0:
+            raise HTTPException(status_code=409, detail="Upload is empty")
+        if upload_session.total_size is not None and size != upload_session.total_size:
+            raise HTTPException(status_code=409, detail="Upload is not complete")
+
+        # Место резервируется до переноса файла: если квоту заняла параллельная загрузка, транзакция
+        # откатывается, частичный файл остаётся на месте, и загрузку можно завершить после освобождения места
+        quota = request.app.state.user_quota_bytes
+        try:
+            await check_quota(session, user.id, size, quota)
+            blob = None
+            if request.app.state.content_addressed_storage:
+                # Ссылка на блоб захватывается до счётчиков - в том же порядке, что и при удалении файлов
+                blob = await acquire_file_blob(session, source)
+            await add_usage(session, user.id, 1, size, quota)
+        except QuotaExceeded:
+            await session.rollback()
+            raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
+        file_id = uuid.uuid4()
+        storage = get_storage()
+        try:
+            if blob is not None:
+                stored = await place_file_blob(source, blob)
+                key, blob_sha256, sha256 = stored.key, stored.sha256, stored.sha256
+            else:
+                key, blob_sha256 = storage.new_key(upload_name(file_id, upload_session.filename), size), None
+                sha256 = None
+                await storage.put_file(key, source)
+        except StorageFull:
+            raise HTTPException(status_code=507, detail="Insufficient storage")
+    finally:
+        await run_in_threadpool(partial.close)
+
+    audio_file = AudioFile(
+        id=file_id, filename=upload_session.filename, user_id=user.id, storage_key=key, blob_sha256=blob_sha256,
+        size_bytes=size
+    )
+    session.add(audio_file)
+    await session.delete(upload_session)
+    await bump_versions(session, [str(user.id)])
+    await session.commit()
+    await invalidate_files(request, user.id)
+
+    schedule_post_upload(background_tasks, request, file_id, user.id, storage.local_path(key))
+    return audio_file_response(audio_file, sha256=sha256)
+
+
+@resumable_router.delete("/{session_id}")
+async def abort_upload_session(
+        session_id: uuid.UUID,
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Отменяет сессию загрузки и удаляет частичный файл.
+    """
+    upload_session = await _get_upload_session(session, session_id, user)
+    await session.delete(upload_session)
+    await session.commit()
+
+    await run_in_threadpool(_remove_partial, upload_session.id)
+    return {"message": "Upload session deleted"}
+
+
+def _remove_partial(session_id: uuid.UUID):
+    try:
+        os.remove(partial_path(session_id))
+    except FileNotFoundError:
+        pass
+
+
+async def purge_expired_upload_sessions() -> int:
+    """
+    Удаляет просроченные сессии загрузки вместе с их частичными файлами.
+
+    :return: Количество удалённых сессий
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    async with await Database().get_session() as session:
+        async with session.begin():
+            expired = list(
+                (
+                    await session.execute(
+                        delete(UploadSession).where(UploadSession.expires_at < now).returning(UploadSession.id)
+                    )
+                ).scalars().all()
+            )
+            await session.commit()
+
+    for session_id in expired:
+        await run_in_threadpool(_remove_partial, session_id)
+    return len(expired)
+
+
+async def run_upload_session_cleanup(interval: float):
+    """
+    Периодически удаляет просроченные сессии загрузки. Запускается из lifespan приложения.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await purge_expired_upload_sessions()
+        except Exception:
+            logger.exception("Failed to purge expired upload sessions")
@@ -0,0 +1,85 @@
+"""
+Запуск приложения в продакшене: несколько процессов uvicorn на uvloop и httptools.
+
+Перед запуском процессов:
+    - отключается create_all при старте (DB_CREATE_ALL=false): каждый процесс только сверяет
+      версию схемы в alembic_version с последней миграцией, которая вычисляется здесь один раз
+      и передаётся процессам в DB_SCHEMA_HEADS;
+    - для нескольких процессов создаётся каталог метрик Prometheus (PROMETHEUS_MULTIPROC_DIR),
+      чтобы /metrics отдавал сумму по всем процессам;
+    - запоминается время запуска (SERVER_STARTED_AT) для метрики холодного старта;
+    - если AUDIO_WORKERS не задан, ядра делятся между пулами разбора аудио всех процессов.
+
+Пул соединений с базой (DB_POOL_SIZE + DB_MAX_OVERFLOW) создаётся в каждом процессе,
+поэтому max_connections PostgreSQL должен покрывать его, умноженный на --workers.
+
+По SIGTERM процессы перестают принимать соединения и ждут завершения начатых запросов,
+в том числе загрузок, не дольше --shutdown-timeout секунд. Время остановки контейнера
+(docker stop -t) должно быть больше этого значения.
+
+Использование:
+    python -m backend.server --workers 4 --port 8000
+    alembic upgrade head && python -m backend.server
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import uvicorn
+from dotenv import load_dotenv
+
+from database import schema_heads
+
+
+def prepare_metrics_dir(workers: int):
+    """
+    Готовит каталог метрик Prometheus для нескольких процессов.
+
+    Файлы предыдущего запуска удаляются, иначе их значения попадут в новые метрики.
+    """
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        if workers == 1:
+            return
+        directory = tempfile.mkdtemp(prefix="prometheus-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(path)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", os.cpu_count() or 1)),
+                        help="Количество процессов (по умолчанию - число ядер)")
+    parser.add_argument("--shutdown-timeout", type=int, default=int(os.getenv("SHUTDOWN_TIMEOUT", 30)),
+                        help="Сколько секунд ждать завершения начатых запросов при остановке")
+    args = parser.parse_args()
+
+    os.environ["SERVER_STARTED_AT"] = str(time.time())
+    os.environ.setdefault("DB_CREATE_ALL", "false")
+    if os.environ["DB_CREATE_ALL"].lower() not in ("1", "true", "yes"):
+        os.environ["DB_SCHEMA_HEADS"] = ",".join(sorted(schema_heads()))
+    os.environ.setdefault("AUDIO_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    prepare_metrics_dir(args.workers)
+
+    uvicorn.run(
+        "backend.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop",
+        http="httptools",
+        timeout_graceful_shutdown=args.shutdown_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    )
+
+
+if __name__ == "__main__":
+    main()
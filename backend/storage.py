@@ -0,0 +1,628 @@
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Optional
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads"  # Каталог единственного тома, если STORAGE_VOLUMES не задан
+PARTIAL_PREFIX = ".partial"  # Каталог частичных файлов возобновляемых загрузок на основном томе
+BLOB_PREFIX = "blobs"  # Каталог контентно-адресуемых файлов внутри тома
+PEAKS_SUFFIX = ".peaks"  # Файл пиков волновой формы рядом с аудиофайлом
+COLD_SUFFIX = ".cold"  # Сжатая копия аудиофайла в холодном уровне хранения (backend.tiering)
+SIDECAR_SUFFIXES = (PEAKS_SUFFIX, COLD_SUFFIX)  # Производные файлы, которые удаляются вместе с аудиофайлом
+CHUNK_SIZE = 1024 * 1024  # Размер блока копирования: 1 МБ
+CAPACITY_TTL = 5.0  # Сколько секунд считать известный объём свободного места на томе актуальным
+TMPFS_DIR = "/dev/shm"  # Файловая система в памяти для TmpfsStorageBackend
+
+
+class UploadTooLarge(Exception):
+    """
+    Загружаемый файл превышает допустимый размер.
+    """
+
+
+class UploadConflict(Exception):
+    """
+    Частичный файл уже дописывается другим запросом или смещение не совпадает с его размером.
+    """
+
+
+class StorageFull(Exception):
+    """
+    Ни на одном томе хранилища нет места для нового файла.
+    """
+
+
+@dataclass
+class StoredUpload:
+    """
+    Результат сохранения загруженного файла в хранилище.
+    """
+    key: str
+    path: Optional[str]
+    size: int
+    sha256: str
+
+
+@dataclass(frozen=True)
+class StorageVolume:
+    """
+    Том локального хранилища: каталог на отдельной точке монтирования.
+
+    Имя тома записывается в ключи хранения, поэтому после появления файлов его нельзя менять.
+    """
+    name: str
+    root: str
+    reserve: int = 0  # Сколько байт оставлять свободными; заполненный том не получает новых файлов
+
+
+def upload_name(file_id: uuid.UUID, filename: str) -> str:
+    """
+    Возвращает имя файла в хранилище: идентификатор записи и расширение исходного файла.
+    """
+    _, file_extension = os.path.splitext(filename)
+    return f"{file_id}{file_extension}"
+
+
+def shard_key(name: str) -> str:
+    """
+    Раскладывает файл по двум уровням подкаталогов из первых символов хэша имени.
+
+    Так файлы распределяются по 65536 каталогам равномерно и ни в одном каталоге
+    не оказывается сотен тысяч записей, сколько бы файлов ни загрузил один пользователь.
+    """
+    digest = hashlib.md5(name.encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def blob_key(sha256: str) -> str:
+    """
+    Возвращает ключ хранения блоба по SHA-256 его содержимого (без тома).
+
+    Блобы раскладываются по двум уровням подкаталогов из первых символов хэша,
+    чтобы в одном каталоге не оказывалось слишком много файлов.
+    """
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def partial_key(session_id: uuid.UUID) -> str:
+    """
+    Возвращает ключ частичного файла сессии возобновляемой загрузки.
+    """
+    return f"{PARTIAL_PREFIX}/{session_id}.part"
+
+
+def remove_stored_file(path: str):
+    """
+    Удаляет файл из хранилища вместе с производными файлами рядом с ним.
+    """
+    for file_path in (path, *(f"{path}{suffix}" for suffix in SIDECAR_SUFFIXES)):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _copy_to_disk(source: BinaryIO, destination: str, max_size: Optional[int]) -> tuple[str, int]:
+    """
+    Копирует поток в файл блоками по CHUNK_SIZE, попутно считая SHA-256 и размер.
+
+    Данные пишутся во временный файл рядом с итоговым и атомарно переносятся на место
+    через os.replace, поэтому по пути destination никогда не лежит недописанный файл.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    partial = f"{destination}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    try:
+        with open(partial, "wb") as f:
+            while True:
+                read = source.readinto(buffer)
+                if not read:
+                    break
+                size += read
+                if max_size is not None and size > max_size:
+                    raise UploadTooLarge()
+                chunk = view[:read]
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    return digest.hexdigest(), size
+
+
+def _move_file(source: str, destination: str):
+    """
+    Переносит файл на место destination: в пределах файловой системы - через os.replace,
+    на другой том - копированием во временный файл рядом с destination и атомарной заменой.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    partial = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        shutil.copyfile(source, partial)
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.remove(source)
+
+
+def _remove_paths(paths: list[str]):
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                remove_stored_file(path)
+        except OSError:
+            logger.exception("Failed to remove %s", path)
+
+
+class StorageBackend(ABC):
+    """
+    Хранилище файлов аудиозаписей.
+
+    Файлы адресуются ключами хранения, которые записываются в audio_files.storage_key.
+    Обработчики получают ключ нового файла через new_key и работают с файлами
+    только через ключи, не собирая пути на диске сами.
+    """
+
+    @abstractmethod
+    def place(self, relative: str, size: Optional[int] = None) -> str:
+        """
+        Выбирает место для нового объекта с путём relative и возвращает его ключ.
+
+        :raises StorageFull: Если ни одно место не вмещает size байт
+        """
+
+    def new_key(self, name: str, size: Optional[int] = None) -> str:
+        """
+        Возвращает ключ для нового файла с именем name в шардированном каталоге.
+        """
+        return self.place(shard_key(name), size)
+
+    @abstractmethod
+    def local_path(self, key: str) -> Optional[str]:
+        """
+        Возвращает путь к файлу на локальном диске или None, если хранилище не локальное.
+
+        Путь нужен для отдачи файла через FileResponse и для обработки в пуле процессов.
+        """
+
+    def redirect_path(self, key: str) -> Optional[str]:
+        """
+        Возвращает путь файла для X-Accel-Redirect или None, если nginx не может отдать файл сам.
+        """
+        return None
+
+    @abstractmethod
+    async def put(self, key: str, source: BinaryIO, max_size: Optional[int] = None) -> StoredUpload:
+        """
+        Записывает поток по ключу, попутно считая SHA-256 и размер.
+
+        :raises UploadTooLarge: Если поток длиннее max_size; частично записанные данные удаляются
+        """
+
+    @abstractmethod
+    async def put_file(self, key: str, source: str):
+        """
+        Переносит локальный файл source в хранилище по ключу. Исходный файл удаляется.
+        """
+
+    @abstractmethod
+    async def get(self, key: str) -> BinaryIO:
+        """
+        Открывает файл по ключу на чтение. Файл закрывает вызывающий код.
+
+        :raises FileNotFoundError: Если файла нет
+        """
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[os.stat_result]:
+        """
+        Возвращает сведения о файле (размер, время изменения) или None, если файла нет.
+        """
+
+    @abstractmethod
+    async def locate(self, relative: str) -> Optional[str]:
+        """
+        Ищет уже записанный объект с путём relative (например, блоб) и возвращает его ключ.
+        """
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        """
+        Удаляет файлы вместе с производными файлами. Ключ может указывать на каталог,
+        тогда он удаляется целиком. Отсутствующие файлы пропускаются.
+        """
+
+    async def close(self):
+        """
+        Освобождает ресурсы хранилища. Вызывается при остановке приложения.
+        """
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Хранилище на локальных дисках, разложенное по нескольким томам.
+
+    Ключ нового файла имеет вид <том>:<путь в томе>. Том выбирается случайно
+    с вероятностью, пропорциональной свободному месту за вычетом резерва, поэтому
+    нагрузка распределяется между дисками, а почти заполненный диск получает меньше файлов.
+    Ключи без тома (файлы, загруженные до появления томов, частичные загрузки)
+    относятся к первому тому.
+    """
+
+    def __init__(self, volumes: list[StorageVolume]):
+        if not volumes:
+            raise ValueError("At least one storage volume is required")
+        self.volumes = {volume.name: volume for volume in volumes}
+        self.primary = volumes[0]
+        self._free: dict[str, tuple[float, int]] = {}
+
+    def _split(self, key: str) -> tuple[StorageVolume, str]:
+        name, separator, relative = key.partition(":")
+        if not separator:
+            return self.primary, key
+        try:
+            return self.volumes[name], relative
+        except KeyError:
+            raise ValueError(f"Unknown storage volume {name!r}")
+
+    def _available(self, volume: StorageVolume) -> int:
+        """
+        Возвращает свободное место на томе за вычетом резерва.
+
+        shutil.disk_usage кэшируется на CAPACITY_TTL секунд, чтобы не делать statvfs на каждую загрузку.
+        """
+        now = time.monotonic()
+        cached = self._free.get(volume.name)
+        if cached is None or now - cached[0] > CAPACITY_TTL:
+            os.makedirs(volume.root, exist_ok=True)
+            cached = (now, shutil.disk_usage(volume.root).free)
+            self._free[volume.name] = cached
+        return cached[1] - volume.reserve
+
+    def place(self, relative: str, size: Optional[int] = None) -> str:
+        needed = size or 0
+        candidates = [
+            (volume, available) for volume in self.volumes.values()
+            if (available := self._available(volume)) > needed
+        ]
+        if not candidates:
+            raise StorageFull()
+
+        volume = random.choices([volume for volume, _ in candidates], [available for _, available in candidates])[0]
+        # Место под файл учитывается сразу, чтобы серия загрузок не ушла целиком на один том
+        checked_at, free = self._free[volume.name]
+        self._free[volume.name] = (checked_at, free - needed)
+        return f"{volume.name}:{relative}"
+
+    def local_path(self, key: str) -> str:
+        volume, relative = self._split(key)
+        return os.path.join(volume.root, relative)
+
+    def redirect_path(self, key: str) -> str:
+        """
+        Файлы основного тома отдаются по пути внутри тома (как до появления томов),
+        файлы остальных - с именем тома в начале пути, которому в nginx соответствует свой alias.
+        """
+        volume, relative = self._split(key)
+        return relative if volume is self.primary else f"{volume.name}/{relative}"
+
+    def _paths(self, key: str) -> list[str]:
+        """
+        Возвращает пути файла на всех томах, где он может лежать: ключ без тома ищется везде.
+        """
+        if ":" in key:
+            return [self.local_path(key)]
+        return [os.path.join(volume.root, key) for volume in self.volumes.values()]
+
+    async def put(self, key: str, source: BinaryIO, max_size: Optional[int] = None) -> StoredUpload:
+        path = self.local_path(key)
+        sha256, size = await run_in_threadpool(_copy_to_disk, source, path, max_size)
+        return StoredUpload(key=key, path=path, size=size, sha256=sha256)
+
+    async def put_file(self, key: str, source: str):
+        await run_in_threadpool(_move_file, source, self.local_path(key))
+
+    async def get(self, key: str) -> BinaryIO:
+        return await run_in_threadpool(open, self.local_path(key), "rb")
+
+    async def stat(self, key: str) -> Optional[os.stat_result]:
+        try:
+            return await run_in_threadpool(os.stat, self.local_path(key))
+        except FileNotFoundError:
+            return None
+
+    async def locate(self, relative: str) -> Optional[str]:
+        def find() -> Optional[str]:
+            for volume in self.volumes.values():
+                if os.path.exists(os.path.join(volume.root, relative)):
+                    return f"{volume.name}:{relative}"
+            return None
+
+        return await run_in_threadpool(find)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await run_in_threadpool(_remove_paths, [path for key in keys for path in self._paths(key)])
+
+
+class TmpfsStorageBackend(LocalStorageBackend):
+    """
+    Хранилище с одним томом во временном каталоге в памяти (tmpfs, /dev/shm) для тестов
+    и локальной отладки. Если /dev/shm нет, используется обычный временный каталог.
+    Каталог удаляется вместе со всеми файлами при close().
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix="uploads-", dir=TMPFS_DIR if os.path.isdir(TMPFS_DIR) else None)
+        super().__init__([StorageVolume(name="tmpfs", root=self.root)])
+
+    async def close(self):
+        await run_in_threadpool(shutil.rmtree, self.root, ignore_errors=True)
+
+
+def parse_volumes(spec: str, reserve: int = 0) -> list[StorageVolume]:
+    """
+    Разбирает список томов вида "main=uploads,disk2=/mnt/disk2/uploads". Первый том - основной.
+    """
+    volumes = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, separator, root = (part.strip() for part in item.partition("="))
+        if not separator or not name or not root or ":" in name:
+            raise ValueError(f"Invalid storage volume {item!r}, expected name=path")
+        volumes.append(StorageVolume(name=name, root=root, reserve=reserve))
+    return volumes
+
+
+def create_storage() -> StorageBackend:
+    """
+    Создаёт хранилище по переменным окружения.
+
+    STORAGE_BACKEND - local (по умолчанию) или tmpfs, STORAGE_VOLUMES - тома локального
+    хранилища (по умолчанию один том main=uploads), STORAGE_MIN_FREE - резерв свободного
+    места на каждом томе в байтах.
+    """
+    backend = os.getenv("STORAGE_BACKEND", "local")
+    if backend == "tmpfs":
+        return TmpfsStorageBackend()
+    if backend != "local":
+        raise ValueError(f"Unknown storage backend {backend!r}")
+    return LocalStorageBackend(
+        parse_volumes(os.getenv("STORAGE_VOLUMES", f"main={UPLOAD_DIR}"), int(os.getenv("STORAGE_MIN_FREE", 0)))
+    )
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """
+    Возвращает хранилище процесса. Если его не задали через set_storage, оно создаётся по окружению.
+    """
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def set_storage(storage: Optional[StorageBackend]):
+    """
+    Задаёт хранилище процесса (в lifespan приложения или в тестах).
+    """
+    global _storage
+    _storage = storage
+
+
+def storage_path(storage_key: str) -> Optional[str]:
+    """
+    Возвращает путь к файлу на диске по ключу хранения.
+    """
+    return get_storage().local_path(storage_key)
+
+
+def file_key(storage_key: Optional[str], user_id: uuid.UUID, file_id: uuid.UUID) -> str:
+    """
+    Возвращает ключ хранения аудиозаписи по её столбцам.
+
+    Для записей без ключа хранения используется старая схема <user_id>/<id> на основном томе.
+    """
+    return storage_key or f"{user_id}/{file_id}"
+
+
+def audio_file_key(audio_file) -> str:
+    """
+    Возвращает ключ хранения аудиозаписи (записи audio_files или строки с её столбцами).
+    """
+    return file_key(audio_file.storage_key, audio_file.user_id, audio_file.id)
+
+
+def audio_file_path(audio_file) -> Optional[str]:
+    """
+    Возвращает реальный путь к файлу аудиозаписи на диске, включая расширение.
+    """
+    return storage_path(audio_file_key(audio_file))
+
+
+def partial_path(session_id: uuid.UUID) -> str:
+    """
+    Возвращает путь к частичному файлу сессии возобновляемой загрузки.
+    """
+    return storage_path(partial_key(session_id))
+
+
+async def save_upload(file: UploadFile, key: str, max_size: Optional[int] = None) -> StoredUpload:
+    """
+    Сохраняет UploadFile в хранилище по ключу, не загружая его целиком в память.
+
+    Starlette уже держит тело файла в SpooledTemporaryFile (в памяти до 1 МБ, дальше - на диске),
+    поэтому файл копируется из него блоками в пуле потоков и не блокирует event loop.
+    Если размер превышает max_size, выбрасывается UploadTooLarge, а частичный файл удаляется.
+    """
+    if max_size is not None and file.size is not None and file.size > max_size:
+        raise UploadTooLarge()
+
+    await file.seek(0)
+    return await get_storage().put(key, file.file, max_size)
+
+
+def _hash_stream(source: BinaryIO, max_size: Optional[int] = None) -> tuple[str, int]:
+    """
+    Читает поток блоками по CHUNK_SIZE и возвращает SHA-256 и размер содержимого.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    while True:
+        read = source.readinto(buffer)
+        if not read:
+            break
+        size += read
+        if max_size is not None and size > max_size:
+            raise UploadTooLarge()
+        digest.update(view[:read])
+    return digest.hexdigest(), size
+
+
+def _hash_path(path: str) -> tuple[str, int]:
+    with open(path, "rb") as f:
+        return _hash_stream(f)
+
+
+async def hash_upload(file: UploadFile, max_size: Optional[int] = None) -> tuple[str, int]:
+    """
+    Считает SHA-256 и размер UploadFile, ничего не записывая на диск.
+
+    Если размер превышает max_size, выбрасывается UploadTooLarge.
+    """
+    if max_size is not None and file.size is not None and file.size > max_size:
+        raise UploadTooLarge()
+
+    await file.seek(0)
+    return await run_in_threadpool(_hash_stream, file.file, max_size)
+
+
+async def hash_file(path: str) -> tuple[str, int]:
+    """
+    Считает SHA-256 и размер файла на диске.
+    """
+    return await run_in_threadpool(_hash_path, path)
+
+
+def lock_partial(path: str) -> BinaryIO:
+    """
+    Открывает частичный файл на дозапись под эксклюзивной блокировкой и возвращает его.
+    Файл вместе с блокировкой закрывает вызывающий код.
+
+    Блокировка flock не даёт двум запросам (в том числе из разных процессов) одновременно
+    дописывать один и тот же файл, а завершению загрузки - переносить файл, пока его дописывают.
+    Если файл перенесли между открытием и блокировкой, дописывать его уже нельзя.
+
+    :raises UploadConflict: Если файл уже заблокирован или перенесён
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = open(path, "ab")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise UploadConflict("Upload is already in progress")
+    try:
+        moved = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        moved = True
+    if moved:
+        f.close()
+        raise UploadConflict("Upload is already completed")
+    return f
+
+
+def _open_partial(path: str, offset: int) -> BinaryIO:
+    """
+    Открывает частичный файл на дозапись под эксклюзивной блокировкой (см. lock_partial)
+    и сверяет смещение клиента с размером файла.
+    """
+    f = lock_partial(path)
+    if f.tell() != offset:
+        f.close()
+        raise UploadConflict("Upload offset mismatch")
+    return f
+
+
+def partial_size(path: str) -> int:
+    """
+    Возвращает текущий размер частичного файла (0, если файла ещё нет).
+    """
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+async def append_stream(
+        stream: AsyncIterator[bytes],
+        path: str,
+        offset: int,
+        max_size: Optional[int] = None
+) -> int:
+    """
+    Дописывает поток в конец частичного файла и возвращает новое смещение.
+
+    Ранее записанные данные не перечитываются: файл открывается на дозапись,
+    а смещение клиента сверяется с текущим размером. Входящие блоки копятся
+    в буфере до CHUNK_SIZE и пишутся в пуле потоков. При обрыве соединения
+    уже полученные данные сохраняются, чтобы клиент мог продолжить с них.
+    Если итоговый размер превысит max_size, файл обрезается до исходного смещения.
+    """
+    f = await run_in_threadpool(_open_partial, path, offset)
+    buffer = bytearray()
+    size = offset
+    try:
+        async for chunk in stream:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                buffer.clear()
+                await run_in_threadpool(f.truncate, offset)
+                raise UploadTooLarge()
+            buffer += chunk
+            if len(buffer) >= CHUNK_SIZE:
+                await run_in_threadpool(f.write, buffer)
+                buffer.clear()
+    finally:
+        if buffer:
+            await run_in_threadpool(f.write, buffer)
+        await run_in_threadpool(f.close)
+    return size
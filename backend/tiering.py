@@ -0,0 +1,615 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Iterator, Optional
+
+import numpy as np
+from sqlalchemy import UUID, DateTime, column, func, update
+from starlette.concurrency import run_in_threadpool
+
+from backend.db import update_from_values
+from backend.metrics import COLD_PROMOTIONS, COLD_READS
+from backend.storage import CHUNK_SIZE, COLD_SUFFIX, get_storage, remove_stored_file
+from backend.waveform import WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_PCM, WaveformUnavailable, compute_peaks, peaks_path
+from database import Database
+from database.models import AudioFile
+
+logger = logging.getLogger(__name__)
+
+COLD_MAGIC = b"COLD"
+COLD_VERSION = 1
+# Сигнатура, версия, кодек, разрядность и каналы отсчётов, частота, размер и время изменения
+# исходного файла, длины заголовка и хвоста WAV, которые хранятся как есть перед потоком FLAC
+COLD_HEADER = struct.Struct("<4sBBBBIQqII")
+CODEC_FLAC = 1  # Отсчёты WAV PCM во FLAC
+CODEC_ZLIB = 2  # Весь файл в zlib: отсчёты, которые FLAC не хранит без потерь
+FLAC_SUBTYPES = {16: "PCM_16", 24: "PCM_24"}
+ZLIB_LEVEL = 6
+ACCESS_FLUSH_BATCH = 1000  # Сколько отметок чтения записывать одним UPDATE
+
+
+@dataclass(frozen=True)
+class ColdInfo:
+    """
+    Заголовок файла холодного уровня.
+    """
+    codec: int
+    bits: int
+    channels: int
+    sample_rate: int
+    size: int  # Размер исходного файла
+    mtime_ns: int  # Время изменения исходного файла: ETag и Last-Modified не меняются при переносе
+    head_length: int
+    tail_length: int
+
+    def stat_result(self) -> os.stat_result:
+        """
+        Возвращает сведения об исходном файле в виде os.stat_result для заголовков ответа.
+        """
+        mtime = self.mtime_ns / 1e9
+        return os.stat_result(
+            (0o100644, 0, 0, 1, 0, 0, self.size, int(mtime), int(mtime), int(mtime)),
+            {"st_mtime": mtime, "st_mtime_ns": self.mtime_ns}
+        )
+
+
+class _Section:
+    """
+    Часть открытого файла, начиная со смещения offset: через неё libsndfile пишет и читает
+    поток FLAC внутри файла холодного уровня, как если бы он лежал в отдельном файле.
+    """
+
+    def __init__(self, f: BinaryIO, offset: int):
+        self.f = f
+        self.offset = offset
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            offset += self.offset
+        return self.f.seek(offset, whence) - self.offset
+
+    def tell(self) -> int:
+        return self.f.tell() - self.offset
+
+    def read(self, size: int = -1) -> bytes:
+        return self.f.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self.f.readinto(buffer)
+
+    def write(self, data: bytes) -> int:
+        return self.f.write(data)
+
+
+def cold_path(path: str) -> str:
+    """
+    Возвращает путь к сжатой копии, которая лежит рядом с местом аудиофайла.
+    """
+    return f"{path}{COLD_SUFFIX}"
+
+
+def _pcm_layout(f: BinaryIO, size: int) -> Optional[tuple[int, int, int, int, int]]:
+    """
+    Разбирает RIFF-заголовок WAV-файла с целочисленными отсчётами, которые FLAC хранит без потерь.
+
+    :return: Разрядность, количество каналов, частота, смещение и размер отсчётов (целыми кадрами)
+        или None, если файл не WAV либо формат отсчётов не подходит
+    """
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        return None
+
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size)
+            if len(fmt) < 16:
+                return None
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            format_tag, channels, sample_rate = struct.unpack_from("<HHI", fmt)
+            block_align, bits = struct.unpack_from("<HH", fmt, 12)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                format_tag = struct.unpack_from("<H", fmt, 24)[0]
+            if format_tag != WAVE_FORMAT_PCM or bits not in FLAC_SUBTYPES or not 0 < channels <= 8:
+                return None
+            if block_align != channels * bits // 8:
+                return None
+            data_size = min(chunk_size, size - f.tell())
+            return bits, channels, sample_rate, f.tell(), data_size - data_size % block_align
+        else:
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _pcm_frames(chunk: bytes, bits: int, channels: int) -> np.ndarray:
+    if bits == 16:
+        return np.frombuffer(chunk, "<i2").reshape(-1, channels)
+    # 24-битный отсчёт дополняется младшим нулевым байтом до int32: так libsndfile передаёт 24 бита
+    padded = np.zeros((len(chunk) // 3, 4), np.uint8)
+    padded[:, 1:] = np.frombuffer(chunk, np.uint8).reshape(-1, 3)
+    return padded.view("<i4").reshape(-1, channels)
+
+
+def _pcm_bytes(frames: np.ndarray, bits: int) -> bytes:
+    if bits == 16:
+        return frames.astype("<i2", copy=False).tobytes()
+    return np.ascontiguousarray(frames, "<i4").view(np.uint8).reshape(-1, 4)[:, 1:].tobytes()
+
+
+def _write_flac(source: BinaryIO, out: BinaryIO, stat_result: os.stat_result) -> Optional[str]:
+    """
+    Пишет файл холодного уровня с отсчётами WAV во FLAC.
+
+    :return: SHA-256 исходного файла или None, если файл не WAV PCM 16/24 бит
+    """
+    import soundfile
+
+    layout = _pcm_layout(source, stat_result.st_size)
+    if layout is None:
+        return None
+    bits, channels, sample_rate, offset, pcm_size = layout
+
+    source.seek(0)
+    head = source.read(offset)
+    source.seek(offset + pcm_size)
+    tail = source.read()
+    out.write(COLD_HEADER.pack(
+        COLD_MAGIC, COLD_VERSION, CODEC_FLAC, bits, channels, sample_rate, stat_result.st_size,
+        stat_result.st_mtime_ns, len(head), len(tail)
+    ))
+    out.write(head)
+    out.write(tail)
+
+    digest = hashlib.sha256(head)
+    source.seek(offset)
+    block = CHUNK_SIZE - CHUNK_SIZE % (channels * bits // 8)
+    try:
+        with soundfile.SoundFile(
+                _Section(out, out.tell()), "w", sample_rate, channels, FLAC_SUBTYPES[bits], format="FLAC"
+        ) as flac:
+            remaining = pcm_size
+            while remaining:
+                chunk = source.read(min(block, remaining))
+                if not chunk:
+                    raise EOFError("Audio file is shorter than its header says")
+                remaining -= len(chunk)
+                digest.update(chunk)
+                flac.write(_pcm_frames(chunk, bits, channels))
+    except (RuntimeError, soundfile.SoundFileError):
+        return None
+    digest.update(tail)
+    return digest.hexdigest()
+
+
+def _write_zlib(source: BinaryIO, out: BinaryIO, stat_result: os.stat_result) -> str:
+    """
+    Пишет файл холодного уровня со всем исходным файлом в zlib.
+
+    :return: SHA-256 исходного файла
+    """
+    out.write(COLD_HEADER.pack(
+        COLD_MAGIC, COLD_VERSION, CODEC_ZLIB, 0, 0, 0, stat_result.st_size, stat_result.st_mtime_ns, 0, 0
+    ))
+    digest = hashlib.sha256()
+    compressor = zlib.compressobj(ZLIB_LEVEL)
+    while chunk := source.read(CHUNK_SIZE):
+        digest.update(chunk)
+        out.write(compressor.compress(chunk))
+    out.write(compressor.flush())
+    return digest.hexdigest()
+
+
+def _read_info(f: BinaryIO) -> ColdInfo:
+    header = f.read(COLD_HEADER.size)
+    if len(header) < COLD_HEADER.size:
+        raise ValueError("Truncated cold file")
+    magic, version, *fields = COLD_HEADER.unpack(header)
+    if magic != COLD_MAGIC or version != COLD_VERSION:
+        raise ValueError("Not a cold file")
+    return ColdInfo(*fields)
+
+
+def read_cold_info(path: str) -> ColdInfo:
+    """
+    Читает заголовок файла холодного уровня.
+
+    :raises FileNotFoundError: Если файла нет
+    """
+    with open(path, "rb") as f:
+        return _read_info(f)
+
+
+def _zlib_blocks(f: BinaryIO) -> Iterator[bytes]:
+    # Распакованный блок ограничен CHUNK_SIZE: длинная тишина сжимается в сотни раз
+    decompressor = zlib.decompressobj()
+    while data := f.read(CHUNK_SIZE):
+        while data:
+            yield decompressor.decompress(data, CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _flac_blocks(f: BinaryIO, info: ColdInfo) -> Iterator[bytes]:
+    import soundfile
+
+    yield f.read(info.head_length)
+    tail = f.read(info.tail_length)
+    frames = CHUNK_SIZE // (info.channels * info.bits // 8)
+    with soundfile.SoundFile(_Section(f, f.tell())) as flac:
+        for block in flac.blocks(frames, dtype="int16" if info.bits == 16 else "int32", always_2d=True):
+            yield _pcm_bytes(block, info.bits)
+    yield tail
+
+
+def decompress_blocks(path: str) -> Iterator[bytes]:
+    """
+    Распаковывает файл холодного уровня блоками не больше CHUNK_SIZE (кроме заголовка и хвоста WAV),
+    не держа файл в памяти целиком. Пустых блоков нет.
+    """
+    with open(path, "rb") as f:
+        info = _read_info(f)
+        blocks = _zlib_blocks(f) if info.codec == CODEC_ZLIB else _flac_blocks(f, info)
+        for block in blocks:
+            if block:
+                yield block
+
+
+def _restored_digest(path: str) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        for block in decompress_blocks(path):
+            digest.update(block)
+    except (RuntimeError, ValueError, zlib.error):
+        return None
+    return digest.hexdigest()
+
+
+def compress_file(path: str, destination: str) -> int:
+    """
+    Сжимает аудиофайл без потерь в файл холодного уровня destination и возвращает его размер.
+
+    Отсчёты WAV PCM 16 и 24 бит кодируются во FLAC (заголовок и хвост WAV сохраняются как есть),
+    остальные файлы - в zlib. Сжатый файл сразу распаковывается и сверяется с исходным по SHA-256;
+    если FLAC не восстановил файл байт в байт, он сжимается в zlib. Данные пишутся во временный
+    файл рядом с destination и атомарно переносятся на место.
+    """
+    stat_result = os.stat(path)
+    partial = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        for write in (_write_flac, _write_zlib):
+            with open(path, "rb") as source, open(partial, "wb") as out:
+                digest = write(source, out, stat_result)
+            if digest is not None and _restored_digest(partial) == digest:
+                os.replace(partial, destination)
+                return os.stat(destination).st_size
+        raise ValueError(f"Unable to compress {path} losslessly")
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def demote_file(path: str, max_ratio: float) -> Optional[tuple[int, int]]:
+    """
+    Готовит аудиофайл к переносу в холодный уровень: строит пики, если их ещё нет (волновая форма
+    холодного файла отдаётся без распаковки), и сжимает файл рядом с исходным. Исходный файл
+    не удаляется: это делает вызывающий код после того, как запись помечена cold.
+
+    Выполняется в пуле процессов.
+
+    :return: Размеры исходного и сжатого файлов или None, если сжатый файл больше max_ratio исходного
+    """
+    if not os.path.exists(peaks_path(path)):
+        try:
+            compute_peaks(path)
+        except WaveformUnavailable:
+            pass
+
+    size = os.stat(path).st_size
+    cold_size = compress_file(path, cold_path(path))
+    if cold_size > size * max_ratio:
+        os.remove(cold_path(path))
+        return None
+    return size, cold_size
+
+
+def compute_file_peaks(path: str, cached: Optional[str] = None) -> str:
+    """
+    Строит пики аудиофайла рядом с path. Если исходного файла нет, потому что файл в холодном уровне,
+    сжатая копия распаковывается во временный файл рядом (или копируется распакованная копия cached
+    из кэша), и пики считаются по нему.
+
+    Выполняется в пуле процессов.
+
+    :return: Путь к файлу пиков
+    :raises FileNotFoundError: Если нет ни исходного файла, ни сжатой копии
+    """
+    if os.path.exists(path):
+        return compute_peaks(path)
+    source = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        try:
+            restore_file(cold_path(path), source, cached)
+        except (RuntimeError, ValueError, zlib.error) as e:
+            raise WaveformUnavailable(str(e))
+        return compute_peaks(source, peaks_path(path))
+    finally:
+        _remove_files([source])
+
+
+def restore_file(source: str, destination: str, cached: Optional[str] = None):
+    """
+    Восстанавливает исходный файл из файла холодного уровня source на место destination
+    вместе с временем изменения, поэтому ETag файла не меняется.
+
+    Если есть уже распакованная копия cached, она копируется без декодирования.
+    Данные пишутся во временный файл рядом с destination и атомарно переносятся на место.
+    """
+    info = read_cold_info(source)
+    partial = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        try:
+            if cached is None:
+                raise FileNotFoundError(source)
+            shutil.copyfile(cached, partial)
+        except FileNotFoundError:
+            with open(partial, "wb") as out:
+                for block in decompress_blocks(source):
+                    out.write(block)
+        if os.stat(partial).st_size != info.size:
+            raise ValueError(f"Restored file size does not match {source}")
+        os.utime(partial, ns=(info.mtime_ns, info.mtime_ns))
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def _next_block(blocks: Iterator[bytes], cache: Optional[BinaryIO]) -> bytes:
+    block = next(blocks, b"")
+    if cache is not None and block:
+        cache.write(block)
+    return block
+
+
+def _elapsed(moment: datetime.datetime) -> datetime.timedelta:
+    """
+    Возвращает время, прошедшее с moment. Время без часового пояса (так его возвращает SQLite) считается UTC.
+    """
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return datetime.datetime.now(datetime.timezone.utc) - moment
+
+
+def _remove_files(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class AccessTracker:
+    """
+    Учёт последнего чтения аудиофайлов (audio_files.last_accessed_at) для переноса в холодный уровень.
+
+    Чтение содержимого только отмечает файл в памяти процесса, без запроса к базе. Отметка
+    пропускается, если время в записи новее resolution секунд: для переноса файлов, не читавшихся
+    днями, такой точности достаточно, и часто читаемые файлы не пишутся в базу на каждое чтение.
+    Фоновая задача (run) раз в interval секунд записывает накопленные отметки пачками одним
+    UPDATE ... FROM VALUES. Отметки, не записанные из-за ошибки или остановки процесса, теряются:
+    в худшем случае файл раньше попадёт в холодный уровень и будет распакован при следующем чтении.
+    """
+
+    def __init__(self, resolution: float):
+        self.resolution = datetime.timedelta(seconds=resolution)
+        self._pending: dict[uuid.UUID, datetime.datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, file_id: uuid.UUID, last_accessed_at: Optional[datetime.datetime]):
+        """
+        Отмечает чтение файла. last_accessed_at - время последнего чтения из записи файла.
+        """
+        if last_accessed_at is not None and _elapsed(last_accessed_at) < self.resolution:
+            return
+        self._pending[file_id] = datetime.datetime.now(datetime.timezone.utc)
+
+    async def flush(self) -> int:
+        """
+        Записывает накопленные отметки в базу.
+
+        :return: Количество записанных отметок
+        """
+        pending = sorted(self._pending.items())
+        self._pending = {}
+        for start in range(0, len(pending), ACCESS_FLUSH_BATCH):
+            batch = pending[start:start + ACCESS_FLUSH_BATCH]
+            async with await Database().get_session() as session:
+                async with session.begin():
+                    await update_from_values(
+                        session, [column("id", UUID), column("accessed_at", DateTime(timezone=True))], batch,
+                        lambda accessed: update(AudioFile)
+                        .where(AudioFile.id == accessed.c.id, AudioFile.last_accessed_at < accessed.c.accessed_at)
+                        .values(last_accessed_at=accessed.c.accessed_at)
+                    )
+        return len(pending)
+
+    async def run(self, interval: float):
+        """
+        Периодически записывает отметки чтения. Запускается из lifespan приложения.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to record audio file access times")
+
+
+class ColdTier:
+    """
+    Чтение файлов холодного уровня: потоковая распаковка, кэш распакованных копий
+    и возврат снова читаемых файлов в горячий уровень.
+
+    Файл холодного уровня лежит рядом с местом исходного файла (ключ хранения + COLD_SUFFIX),
+    поэтому ключ записи не меняется. Первое чтение распаковывается потоком прямо в ответ
+    (запрос Range в этом случае получает весь файл) и одновременно пишется в кэш на локальном диске.
+    Следующие чтения отдаются из кэша как обычный файл, с Range. Кэш ограничен maxbytes байт
+    и вытесняет давно не читавшиеся копии; у каждого процесса свой каталог кэша, который удаляется
+    при остановке.
+
+    Если холодный файл читают повторно в течение promote_window секунд, он возвращается
+    в горячий уровень (promote): распаковка оплачивается один раз, а не на каждое чтение.
+    """
+
+    def __init__(self, directory: Optional[str], maxbytes: int, promote_window: float):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="cold-cache-", dir=directory)
+        self.maxbytes = maxbytes
+        self.promote_window = datetime.timedelta(seconds=promote_window) if promote_window else None
+        self.size = 0
+        self._cached: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._restoring: set[str] = set()
+        self._promoting: set[str] = set()
+
+    async def info(self, key: str) -> Optional[ColdInfo]:
+        """
+        Возвращает заголовок файла холодного уровня по ключу хранения или None, если файла нет.
+        """
+        path = get_storage().local_path(key)
+        if path is None:
+            return None
+        try:
+            return await run_in_threadpool(read_cold_info, cold_path(path))
+        except FileNotFoundError:
+            return None
+
+    def cached_path(self, key: str) -> Optional[str]:
+        """
+        Возвращает путь к распакованной копии файла в кэше или None.
+        """
+        entry = self._cached.get(key)
+        if entry is None:
+            return None
+        self._cached.move_to_end(key)
+        return entry[0]
+
+    async def _store(self, key: str, path: str, size: int):
+        evicted = []
+        old = self._cached.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+            evicted.append(old[0])
+        self._cached[key] = (path, size)
+        self.size += size
+        while self.size > self.maxbytes:
+            evicted_path, evicted_size = self._cached.popitem(last=False)[1]
+            self.size -= evicted_size
+            evicted.append(evicted_path)
+        await run_in_threadpool(_remove_files, evicted)
+
+    async def _discard(self, key: str):
+        entry = self._cached.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            await run_in_threadpool(_remove_files, [entry[0]])
+
+    async def stream(self, key: str, info: ColdInfo) -> AsyncIterator[bytes]:
+        """
+        Распаковывает файл холодного уровня потоком и попутно сохраняет распакованную копию в кэш.
+
+        Копию пишет только один запрос на ключ; если клиент отключился раньше конца, она удаляется.
+        """
+        blocks = decompress_blocks(cold_path(get_storage().local_path(key)))
+        cache = None
+        if key not in self._restoring and info.size <= self.maxbytes:
+            self._restoring.add(key)
+            cache = await run_in_threadpool(open, os.path.join(self.directory, uuid.uuid4().hex), "wb")
+
+        COLD_READS.labels("decode").inc()
+        restored = 0
+        try:
+            while block := await run_in_threadpool(_next_block, blocks, cache):
+                restored += len(block)
+                yield block
+        finally:
+            await run_in_threadpool(blocks.close)
+            if cache is not None:
+                await run_in_threadpool(cache.close)
+                self._restoring.discard(key)
+                if restored == info.size:
+                    await self._store(key, cache.name, info.size)
+                else:
+                    await run_in_threadpool(_remove_files, [cache.name])
+
+    def should_promote(self, last_accessed_at: Optional[datetime.datetime]) -> bool:
+        """
+        Проверяет, нужно ли вернуть холодный файл в горячий уровень: его уже читали недавно.
+        """
+        if self.promote_window is None or last_accessed_at is None:
+            return False
+        return _elapsed(last_accessed_at) < self.promote_window
+
+    async def promote(self, file_id: uuid.UUID, key: str):
+        """
+        Возвращает холодный файл в горячий уровень: восстанавливает исходный файл на его место,
+        снимает отметку cold с записи и после фиксации удаляет сжатую копию.
+
+        Запускается фоновой задачей после ответа. Читатели, которые ещё видят запись холодной,
+        открывают сжатую копию до её удаления, а после - исходный файл (см. get_audio_file_content).
+        """
+        if key in self._promoting:
+            return
+        self._promoting.add(key)
+        try:
+            path = get_storage().local_path(key)
+            await run_in_threadpool(restore_file, cold_path(path), path, self.cached_path(key))
+            async with await Database().get_session() as session:
+                async with session.begin():
+                    promoted = (
+                        await session.execute(
+                            update(AudioFile)
+                            .where(AudioFile.id == file_id)
+                            .values(cold=False, last_accessed_at=func.now())
+                            .returning(AudioFile.id)
+                        )
+                    ).first()
+            if promoted is None:
+                # Запись удалили, пока файл восстанавливался
+                await run_in_threadpool(remove_stored_file, path)
+            else:
+                await run_in_threadpool(_remove_files, [cold_path(path)])
+                COLD_PROMOTIONS.inc()
+            await self._discard(key)
+        except Exception:
+            logger.exception("Failed to promote cold audio file %s", file_id)
+        finally:
+            self._promoting.discard(key)
+
+    async def close(self):
+        """
+        Удаляет каталог кэша. Вызывается при остановке приложения.
+        """
+        self._cached.clear()
+        self.size = 0
+        await run_in_threadpool(shutil.rmtree, self.directory, ignore_errors=True)
@@ -0,0 +1,104 @@
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import BigInteger, Row, UUID, column, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db import update_from_values
+from database.models import UserUsage
+
+
+class QuotaExceeded(Exception):
+    """
+    Файлы не помещаются в квоту пользователя на занятое место.
+    """
+
+
+async def get_usage(session: AsyncSession, user_id: uuid.UUID) -> tuple[int, int]:
+    """
+    Возвращает число файлов и занятые байты пользователя, читая только его строку счётчиков.
+    """
+    row = (
+        await session.execute(
+            select(UserUsage.file_count, UserUsage.total_bytes).where(UserUsage.user_id == user_id)
+        )
+    ).first()
+    return (row.file_count, row.total_bytes) if row is not None else (0, 0)
+
+
+async def check_quota(session: AsyncSession, user_id: uuid.UUID, size: int, quota: Optional[int]):
+    """
+    Предварительно проверяет, что size байт помещаются в квоту, по строке счётчиков пользователя.
+
+    Позволяет отклонить загрузку до записи файла в хранилище; окончательно квота
+    проверяется атомарно в add_usage.
+
+    :raises QuotaExceeded: Если с этими байтами пользователь превысил бы квоту
+    """
+    if quota is None:
+        return
+    _, used = await get_usage(session, user_id)
+    if used + size > quota:
+        raise QuotaExceeded()
+
+
+async def add_usage(
+        session: AsyncSession,
+        user_id: uuid.UUID,
+        files: int,
+        size: int,
+        quota: Optional[int] = None
+):
+    """
+    Добавляет к счётчикам пользователя файлы и байты одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Если задана квота, счётчики меняются только при total_bytes + size <= quota. Проверка
+    и увеличение выполняются одной командой под блокировкой строки, поэтому параллельные
+    загрузки не превысят квоту вместе. Строка остаётся заблокированной до конца транзакции.
+    Изменения фиксирует вызывающий код.
+
+    :raises QuotaExceeded: Если с этими байтами пользователь превысил бы квоту; счётчики не меняются
+    """
+    if quota is not None and size > quota:
+        raise QuotaExceeded()
+
+    statement = insert(UserUsage).values(user_id=user_id, file_count=files, total_bytes=size)
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserUsage.user_id],
+        set_={
+            "file_count": UserUsage.file_count + statement.excluded.file_count,
+            "total_bytes": UserUsage.total_bytes + statement.excluded.total_bytes,
+        },
+        where=None if quota is None else UserUsage.total_bytes + statement.excluded.total_bytes <= quota
+    ).returning(UserUsage.user_id)
+    if (await session.execute(statement)).first() is None:
+        raise QuotaExceeded()
+
+
+async def release_usage(session: AsyncSession, deleted: list[Row]):
+    """
+    Вычитает удалённые файлы из счётчиков их владельцев одним UPDATE ... FROM VALUES.
+
+    :param deleted: Удалённые строки с user_id и size_bytes (см. delete_audio_file_records)
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for row in deleted:
+        if row.user_id is not None:
+            totals[row.user_id][0] += 1
+            totals[row.user_id][1] += row.size_bytes or 0
+    if not totals:
+        return
+
+    await update_from_values(
+        session,
+        [column("user_id", UUID), column("file_count", BigInteger), column("total_bytes", BigInteger)],
+        [(user_id, count, size) for user_id, (count, size) in sorted(totals.items())],
+        lambda released: update(UserUsage)
+        .where(UserUsage.user_id == released.c.user_id)
+        .values(
+            file_count=UserUsage.file_count - released.c.file_count,
+            total_bytes=UserUsage.total_bytes - released.c.total_bytes
+        )
+    )
@@ -1,13 +1,20 @@
 import uuid
-from typing import Optional
+from typing import Literal, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel, Field
-from sqlalchemy import select
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from backend.auth import get_admin, get_user
-from database import Database
-from database.models import User
+from backend.auth import get_admin, get_user, invalidate_user
+from backend.db import get_db_session
+from backend.deletion import delete_user_files
+from backend.files import AUDIO_FILE_COLUMNS, AudioFileResponse, audio_file_payload, invalidate_files
+from backend.pagination import MAX_PAGE_SIZE, decode_id_cursor, fetch_page, ndjson_response, page_size, wants_ndjson
+from backend.responses import FastJSONResponse
+from backend.usage import get_usage
+from database.models import User, UserUsage
 
 user_router = APIRouter(prefix="/user", tags=["user"])
 
@@ -30,17 +37,35 @@ class UserResponse(BaseModel):
     email: str = Field(..., description="Email пользователя")
 
 
+class UserListItem(UserResponse):
+    """
+    Модель пользователя в списке: дополнительные поля заполняются по параметру include.
+    """
+    file_count: Optional[int] = Field(None, description="Количество аудиофайлов (include=usage)")
+    total_bytes: Optional[int] = Field(None, description="Суммарный размер аудиофайлов в байтах (include=usage)")
+    files: Optional[list[AudioFileResponse]] = Field(None, description="Аудиофайлы пользователя (include=files)")
+
+
 class UsersListResponse(BaseModel):
     """
     Модель ответа для списка пользователей.
     """
-    users: list[UserResponse] = Field(..., description="Список пользователей")
+    users: list[UserListItem] = Field(..., description="Список пользователей")
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы (нет, если страница последняя)")
 
 
-@user_router.get("/me", response_model=UserResponse)
-async def get_me(user: User = Depends(get_user)):
+class UsageResponse(BaseModel):
     """
-    Возвращает данные текущего авторизованного пользователя.
+    Модель ответа с занятым пользователем местом.
+    """
+    file_count: int = Field(..., description="Количество аудиофайлов")
+    total_bytes: int = Field(..., description="Суммарный размер аудиофайлов в байтах")
+    quota_bytes: Optional[int] = Field(None, description="Квота в байтах (нет, если место не ограничено)")
+
+
+def user_response(user: User) -> UserResponse:
+    """
+    Собирает модель ответа по записи пользователя.
     """
     return UserResponse(
         id=str(user.id),
@@ -50,89 +75,195 @@ async def get_me(user: User = Depends(get_user)):
     )
 
 
+# Столбцы, из которых собирается ответ списка пользователей без загрузки ORM-сущностей
+USER_COLUMNS = (User.id, User.yandex_id, User.name, User.email)
+
+
+def user_payload(row) -> dict:
+    """
+    Собирает словарь ответа по строке с USER_COLUMNS в формате UserResponse.
+    """
+    user_id, yandex_id, name, email = row
+    return {"id": user_id, "yandex_id": yandex_id, "name": name, "email": email}
+
+
+def _users_list_statement(include: set[str]):
+    """
+    Запрос списка пользователей с дополнительными данными из include и функция сборки ответа по строке.
+
+    usage - счётчики из user_usage через LEFT JOIN в том же запросе (пользователь без строки
+    счётчиков получает нули); files - сущности User, файлы которых загружаются selectinload
+    одним дополнительным запросом IN на страницу. Число запросов не зависит от числа пользователей.
+    """
+    usage_columns = ()
+    if "usage" in include:
+        usage_columns = (
+            func.coalesce(UserUsage.file_count, 0).label("file_count"),
+            func.coalesce(UserUsage.total_bytes, 0).label("total_bytes"),
+        )
+
+    if "files" in include:
+        statement = select(User, *usage_columns).options(selectinload(User.audio_files))
+        file_fields = tuple(column.key for column in AUDIO_FILE_COLUMNS)
+
+        def serialize(row) -> dict:
+            user = row[0]
+            payload = user_payload((user.id, user.yandex_id, user.name, user.email))
+            payload["files"] = [
+                audio_file_payload(tuple(getattr(audio_file, field) for field in file_fields))
+                for audio_file in sorted(user.audio_files, key=lambda audio_file: audio_file.id)
+            ]
+            if usage_columns:
+                payload["file_count"], payload["total_bytes"] = row[1:]
+            return payload
+    else:
+        statement = select(*USER_COLUMNS, *usage_columns)
+
+        def serialize(row) -> dict:
+            payload = user_payload(row[:len(USER_COLUMNS)])
+            if usage_columns:
+                payload["file_count"], payload["total_bytes"] = row[len(USER_COLUMNS):]
+            return payload
+
+    if usage_columns:
+        statement = statement.outerjoin(UserUsage, UserUsage.user_id == User.id)
+    return statement.order_by(User.id), serialize
+
+
+@user_router.get("/me", response_model=UserResponse)
+async def get_me(user: User = Depends(get_user)):
+    """
+    Возвращает данные текущего авторизованного пользователя.
+    """
+    return user_response(user)
+
+
 @user_router.patch("/me", response_model=UserResponse)
-async def patch_me(update: UserUpdate, user: User = Depends(get_user)):
+async def patch_me(
+        request: Request,
+        update: UserUpdate,
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
     """
     Обновляет данные текущего пользователя и возвращает обновлённую информацию.
     """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            if update.name:
-                user.name = update.name
-            if update.email:
-                user.email = update.email
+    # Если get_user читал пользователя из базы, он уже есть в сессии запроса и запрос не выполняется
+    user = await session.get(User, user.id)
+    if user is None:
+        # Пользователь из кэша get_user мог быть уже удалён
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if update.name:
+        user.name = update.name
+    if update.email:
+        user.email = update.email
 
-            await session.commit()
-    return UserResponse(
-        id=str(user.id),
-        yandex_id=user.yandex_id,
-        name=user.name,
-        email=user.email
+    await session.commit()
+    await invalidate_user(request, user.id)
+    return user_response(user)
+
+
+@user_router.get("/me/usage", response_model=UsageResponse)
+async def get_my_usage(
+        request: Request,
+        user: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Возвращает количество и суммарный размер файлов текущего пользователя и его квоту.
+
+    Значения читаются из строки счётчиков пользователя, которую загрузки и удаления
+    обновляют в своих транзакциях, без подсчёта по таблице файлов.
+    """
+    file_count, total_bytes = await get_usage(session, user.id)
+    return UsageResponse(
+        file_count=file_count, total_bytes=total_bytes, quota_bytes=request.app.state.user_quota_bytes
     )
 
 
 @user_router.get("/all", response_model=UsersListResponse)
-async def patch_me(_: User = Depends(get_user)):
-    """
-    Возвращает список всех пользователей.
-    """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            users: list[User] = list(
-                (
-                    await session.execute(
-                        select(User)
-                    )
-                ).scalars().all()
-            )
-    return UsersListResponse(
-        users=[
-            UserResponse(
-                id=str(user.id),
-                yandex_id=user.yandex_id,
-                name=user.name,
-                email=user.email
-            )
-            for user in users
-        ]
-    )
+async def get_all_users(
+        request: Request,
+        cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+        include: list[Literal["usage", "files"]] = Query(
+            [], description="Дополнительные данные: usage - количество и размер файлов, files - сами файлы"
+        ),
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Возвращает список всех пользователей постранично (keyset-пагинация по идентификатору).
+
+    Ответ собирается из выбранных столбцов и сериализуется orjson без повторной
+    валидации по UsersListResponse.
+    С заголовком Accept: application/x-ndjson пользователи отдаются потоком NDJSON.
+
+    Параметр include (можно повторять) добавляет к пользователям file_count и total_bytes (usage)
+    и список файлов (files), поэтому страница админки загружается одним запросом к API
+    и постоянным числом запросов к базе. С include=files стоит уменьшать limit: файлы
+    пользователей страницы загружаются целиком.
+    """
+    statement, serialize = _users_list_statement(set(include))
+    if cursor:
+        statement = statement.where(User.id > decode_id_cursor(cursor))
+
+    if wants_ndjson(request):
+        if limit is not None:
+            statement = statement.limit(limit)
+        return ndjson_response(statement, serialize)
+
+    # С include=files первый элемент строки - сущность User, иначе - столбец id
+    cursor_key = (lambda row: (row[0].id,)) if "files" in include else (lambda row: (row.id,))
+    rows, next_cursor = await fetch_page(session, statement, page_size(limit), cursor_key, scalars=False)
+    return FastJSONResponse({"users": [serialize(row) for row in rows], "next_cursor": next_cursor})
 
 
 @user_router.get("/{user_id}", response_model=UserResponse)
-async def get_user_req(user_id: uuid.UUID, _: User = Depends(get_user)):
+async def get_user_req(
+        user_id: uuid.UUID,
+        _: User = Depends(get_user),
+        session: AsyncSession = Depends(get_db_session)
+):
     """
     Возвращает данные пользователя по его идентификатору.
     """
-    async with await Database().get_session() as session:
-        user: User = (
-            await session.execute(
-                select(User).where(User.id == user_id)
-            )
-        ).unique().scalar_one_or_none()
-        return UserResponse(
-            id=str(user.id),
-            yandex_id=user.yandex_id,
-            name=user.name,
-            email=user.email
+    user: User = (
+        await session.execute(
+            select(User).where(User.id == user_id)
         )
+    ).unique().scalar_one_or_none()
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return user_response(user)
 
 
 @user_router.delete("/{user_id}")
-async def delete_user(user_id: uuid.UUID, _: User = Depends(get_admin)):
+async def delete_user(
+        request: Request,
+        user_id: uuid.UUID,
+        _: User = Depends(get_admin),
+        session: AsyncSession = Depends(get_db_session)
+):
     """
     Удаляет пользователя по его идентификатору. Для выполнения операции требуется статус администратора.
+
+    Вместе с пользователем пачками удаляются его аудиофайлы и сессии загрузки,
+    а файлы на диске и каталог пользователя удаляются фоновой очередью.
     """
-    async with await Database().get_session() as session:
-        async with session.begin():
-            user_to_delete: User = (
-                await session.execute(
-                    select(User).where(User.id == user_id)
-                )
-            ).unique().scalar_one_or_none()
+    user_to_delete: User = (
+        await session.execute(
+            select(User).where(User.id == user_id)
+        )
+    ).unique().scalar_one_or_none()
 
-            if not user_to_delete:
-                return {"message": "User not found"}
+    if not user_to_delete:
+        return {"message": "User not found"}
 
-            await session.delete(user_to_delete)
-            await session.commit()
+    await delete_user_files(session, user_id, request.app.state.deletion_queue)
+    await session.delete(user_to_delete)
+    await session.commit()
+    await invalidate_user(request, user_id)
+    await invalidate_files(request, user_id)
     return {"message": "User deleted"}
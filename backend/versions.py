@@ -0,0 +1,67 @@
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import FileListVersion
+
+GLOBAL_VERSION_KEY = "*"  # Ключ версии общего списка файлов
+
+
+async def bump_versions(session: AsyncSession, keys: Iterable[str]):
+    """
+    Увеличивает версии ключей и общую версию одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Строки блокируются до конца транзакции в порядке ключей, поэтому параллельные вызовы
+    не взаимоблокируются. Изменения фиксирует вызывающий код.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    statement = insert(FileListVersion).values([
+        {"key": key, "version": 1} for key in sorted(keys | {GLOBAL_VERSION_KEY})
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[FileListVersion.key],
+        set_={"version": FileListVersion.version + 1}
+    )
+    await session.execute(statement)
+
+
+class SharedVersions:
+    """
+    Версии списков файлов из таблицы file_list_versions с кэшем в памяти процесса.
+
+    Версии хранятся в базе и одинаковы во всех процессах, поэтому ETag, выданный одним процессом,
+    подходит и для остальных. Версия ключа читается из базы один раз и хранится в памяти, пока
+    шина инвалидации не сообщит об изменении ключа (invalidate) или о потере сообщений (reset).
+    """
+
+    def __init__(self):
+        self._versions: dict[str, int] = {}
+        self._generation = 0  # Меняется при каждом сбросе, чтобы не сохранить версию, прочитанную до него
+
+    async def version(self, session: AsyncSession, key: Optional[str] = None) -> int:
+        """
+        Возвращает версию ключа или общую версию (key=None).
+        """
+        key = GLOBAL_VERSION_KEY if key is None else key
+        version = self._versions.get(key)
+        if version is None:
+            generation = self._generation
+            version = (
+                await session.execute(select(FileListVersion.version).where(FileListVersion.key == key))
+            ).scalar() or 0
+            if generation == self._generation:
+                self._versions[key] = version
+        return version
+
+    def invalidate(self, key: str):
+        self._versions.pop(key, None)
+        self._versions.pop(GLOBAL_VERSION_KEY, None)
+        self._generation += 1
+
+    def reset(self):
+        self._versions.clear()
+        self._generation += 1
@@ -0,0 +1,240 @@
+import logging
+import os
+import struct
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+from backend.storage import PEAKS_SUFFIX
+from backend.workers import run_in_process
+
+logger = logging.getLogger(__name__)
+
+PEAKS_MAGIC = b"PEAK"
+PEAKS_VERSION = 1
+PEAKS_HEADER = struct.Struct("<4sHH")  # Сигнатура, версия, количество уровней
+PEAKS_LEVELS = (256, 1024, 4096, 16384)  # Разрешения, которые хранятся в файле пиков
+PEAKS_SCALE = 32767  # Пики хранятся как int16: значение / PEAKS_SCALE лежит в [-1, 1]
+BLOCK_BUCKETS = 256  # Сколько интервалов старшего уровня обрабатывать за одно чтение
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+WAVE_DTYPES = {(WAVE_FORMAT_PCM, 8): np.uint8, (WAVE_FORMAT_PCM, 16): np.int16,
+               (WAVE_FORMAT_PCM, 32): np.int32, (WAVE_FORMAT_IEEE_FLOAT, 32): np.float32}
+
+
+class WaveformUnavailable(Exception):
+    """
+    Аудиофайл не удалось декодировать для построения пиков.
+    """
+
+
+def peaks_path(path: str) -> str:
+    """
+    Возвращает путь к файлу пиков, который лежит рядом с аудиофайлом.
+    """
+    return f"{path}{PEAKS_SUFFIX}"
+
+
+def _wave_layout(path: str) -> Optional[tuple[np.dtype, int, int, int]]:
+    """
+    Разбирает RIFF-заголовок WAV-файла.
+
+    :return: Тип отсчётов, количество каналов, смещение и размер блока данных
+        или None, если файл не WAV либо формат отсчётов нельзя отобразить в NumPy напрямую
+    :raises WaveformUnavailable: Если блок fmt короче, чем требует формат
+    """
+    try:
+        return _read_wave_layout(path)
+    except struct.error as e:
+        raise WaveformUnavailable(f"Malformed WAV header: {e}")
+
+
+def _read_wave_layout(path: str) -> Optional[tuple[np.dtype, int, int, int]]:
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+
+        dtype = channels = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                format_tag, channels = struct.unpack_from("<HH", fmt)
+                bits = struct.unpack_from("<H", fmt, 14)[0]
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    format_tag = struct.unpack_from("<H", fmt, 24)[0]
+                dtype = WAVE_DTYPES.get((format_tag, bits))
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if dtype is None or not channels:
+                    return None
+                data_size = min(chunk_size, os.fstat(f.fileno()).st_size - f.tell())
+                return np.dtype(dtype), channels, f.tell(), data_size
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _normalize(block: np.ndarray) -> np.ndarray:
+    if block.dtype == np.uint8:
+        return (block.astype(np.float32) - 128) / 128
+    if block.dtype.kind == "i":
+        return block.astype(np.float32) / -np.iinfo(block.dtype).min
+    return np.clip(block.astype(np.float32), -1, 1)
+
+
+def _pcm_source(path: str) -> tuple[int, Callable[[int], Iterator[np.ndarray]]]:
+    """
+    Открывает аудиофайл для чтения отсчётов.
+
+    Несжатый WAV отображается в память через np.memmap и не копируется целиком,
+    остальные форматы (FLAC, MP3, OGG и др.) декодируются libsndfile блоками.
+
+    :return: Количество кадров и функция, которая по размеру блока в кадрах
+        возвращает итератор по блокам отсчётов формы (кадры, каналы)
+    """
+    layout = _wave_layout(path)
+    if layout is not None:
+        dtype, channels, offset, data_size = layout
+        frames = data_size // (dtype.itemsize * channels)
+
+        def wave_blocks(block_frames: int) -> Iterator[np.ndarray]:
+            if not frames:
+                return
+            samples = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(frames, channels))
+            for start in range(0, frames, block_frames):
+                yield samples[start:start + block_frames]
+
+        return frames, wave_blocks
+
+    import soundfile
+
+    try:
+        frames = soundfile.info(path).frames
+    except RuntimeError as e:
+        raise WaveformUnavailable(str(e))
+
+    def decoded_blocks(block_frames: int) -> Iterator[np.ndarray]:
+        return soundfile.blocks(path, blocksize=block_frames, dtype="int16", always_2d=True)
+
+    return frames, decoded_blocks
+
+
+def _reduce(peaks: np.ndarray, points: int) -> np.ndarray:
+    """
+    Сводит массив пиков формы (n, 2) к points интервалам: минимум минимумов и максимум максимумов.
+    """
+    if len(peaks) <= points:
+        return peaks
+    starts = np.linspace(0, len(peaks), points, endpoint=False).astype(np.intp)
+    return np.stack([np.minimum.reduceat(peaks[:, 0], starts), np.maximum.reduceat(peaks[:, 1], starts)], axis=1)
+
+
+def compute_peaks(path: str, destination: Optional[str] = None) -> str:
+    """
+    Строит пики аудиофайла во всех разрешениях PEAKS_LEVELS и сохраняет их в destination,
+    по умолчанию - рядом с файлом.
+
+    Выполняется в пуле процессов. Отсчёты читаются блоками, для каждого интервала
+    старшего уровня векторно считаются минимум и максимум по всем каналам,
+    младшие уровни получаются сведением старшего.
+
+    Формат файла пиков: заголовок PEAKS_HEADER, количество точек каждого уровня (uint32),
+    затем уровни подряд как int16 пары (min, max).
+
+    :return: Путь к файлу пиков
+    """
+    top = PEAKS_LEVELS[-1]
+    try:
+        frames, read_blocks = _pcm_source(path)
+        # Размер блока кратен интервалу, поэтому интервалы не разрываются между блоками
+        bucket = max(1, -(-frames // top))
+
+        mins, maxs = [], []
+        for block in read_blocks(bucket * BLOCK_BUCKETS):
+            if not len(block):
+                continue
+            starts = np.arange(0, len(block), bucket)
+            mins.append(np.minimum.reduceat(block.min(axis=1), starts))
+            maxs.append(np.maximum.reduceat(block.max(axis=1), starts))
+    except (OSError, ValueError, RuntimeError) as e:
+        raise WaveformUnavailable(str(e))
+
+    if mins:
+        peaks = np.stack([_normalize(np.concatenate(mins)), _normalize(np.concatenate(maxs))], axis=1)
+    else:
+        peaks = np.zeros((0, 2), dtype=np.float32)
+    peaks = np.round(peaks * PEAKS_SCALE).astype("<i2")
+
+    levels = [_reduce(peaks, points) for points in PEAKS_LEVELS]
+    destination = destination or peaks_path(path)
+    partial = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        with open(partial, "wb") as f:
+            f.write(PEAKS_HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, len(levels)))
+            f.write(struct.pack(f"<{len(levels)}I", *(len(level) for level in levels)))
+            for level in levels:
+                f.write(level.tobytes())
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return destination
+
+
+def read_peaks(path: str, points: int) -> Optional[np.ndarray]:
+    """
+    Читает пики из файла пиков, отображённого в память.
+
+    Выбирается наименьший уровень, в котором не меньше points точек, и из файла
+    читается только он (несколько килобайт), после чего сводится ровно к points точкам.
+
+    :return: Массив формы (points, 2) со значениями int16 или None, если файла пиков нет
+        или он в неизвестном формате
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(PEAKS_HEADER.size)
+            if len(header) < PEAKS_HEADER.size:
+                return None
+            magic, version, level_count = PEAKS_HEADER.unpack(header)
+            if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+                return None
+            sizes = struct.unpack(f"<{level_count}I", f.read(4 * level_count))
+    except FileNotFoundError:
+        return None
+    if not sizes:
+        return None
+
+    offset = PEAKS_HEADER.size + 4 * level_count
+    for size in sizes:
+        if size >= points or size == sizes[-1]:
+            break
+        offset += size * 4
+    if not size:
+        return np.zeros((0, 2), dtype=np.int16)
+
+    level = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(size, 2))
+    return np.array(_reduce(level, points))
+
+
+async def generate_peaks(pool: ProcessPoolExecutor, path: str) -> Optional[str]:
+    """
+    Строит файл пиков в пуле процессов. Запускается фоновой задачей после загрузки.
+    """
+    try:
+        return await run_in_process(pool, compute_peaks, path)
+    except WaveformUnavailable as e:
+        logger.info("Waveform is not available for %s: %s", path, e)
+    except Exception:
+        logger.exception("Failed to compute waveform peaks for %s", path)
+    return None
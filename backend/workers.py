@@ -0,0 +1,21 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+
+def create_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Создаёт пул процессов для CPU-задач (разбор аудиофайлов), чтобы не блокировать event loop.
+
+    Процессы запускаются через spawn: fork процесса с работающим event loop и открытыми
+    соединениями к базе небезопасен.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def run_in_process(pool: ProcessPoolExecutor, func: Callable[..., Any], *args) -> Any:
+    """
+    Выполняет функцию в пуле процессов. Функция и аргументы должны сериализоваться pickle.
+    """
+    return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
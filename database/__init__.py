@@ -1,10 +1,16 @@
+import asyncio
 import os
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 SqlAlchemyBase = declarative_base()
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic")
+
 from database.models import *
 
 
@@ -32,6 +38,38 @@ class Database:
         self._engine = None
         self._session_factory = None
 
+    def _engine_options(self) -> dict:
+        """
+        Параметры пула соединений из переменных окружения.
+
+        DB_POOL_SIZE - постоянное число соединений в пуле;
+        DB_MAX_OVERFLOW - сколько соединений можно открыть сверх пула под пиковую нагрузку;
+        DB_POOL_TIMEOUT - сколько секунд ждать свободное соединение;
+        DB_POOL_RECYCLE - через сколько секунд пересоздавать соединение;
+        DB_POOL_PRE_PING - проверять соединение перед выдачей из пула;
+        DB_STATEMENT_CACHE_SIZE - размер кэша подготовленных запросов asyncpg (0 - для pgbouncer).
+
+        Для SQLite (sqlite+aiosqlite://, используется нагрузочными тестами без PostgreSQL)
+        параметры asyncpg не передаются, а вместо них задаётся ожидание блокировки файла базы.
+        """
+        if make_url(self.db_url).get_backend_name() == "sqlite":
+            return {
+                "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+                "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+                "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                "connect_args": {"timeout": float(os.getenv("DB_POOL_TIMEOUT", 30))},
+            }
+        return {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+            "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+            "connect_args": {
+                "prepared_statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+            },
+        }
+
     async def init(self) -> "Database":
         """
         Инициализация асинхронного движка и фабрики сессий
@@ -45,7 +83,7 @@ class Database:
             return self
 
         # Создаем асинхронный движок
-        self._engine = create_async_engine(self.db_url, echo=False)
+        self._engine = create_async_engine(self.db_url, echo=False, **self._engine_options())
 
         # Создаем фабрику асинхронных сессий
         self._session_factory = async_sessionmaker(
@@ -53,14 +91,63 @@ class Database:
             expire_on_commit=False
         )
 
-        # Создаем таблицы
-        async with self._engine.begin() as conn:
-            await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+        # Создаем таблицы (DB_CREATE_ALL) или только проверяем, что база на последней миграции
+        if os.getenv("DB_CREATE_ALL", "true").lower() in ("1", "true", "yes"):
+            async with self._engine.begin() as conn:
+                await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+        else:
+            await self.check_schema()
+
+        # Заранее открываем соединения, чтобы первые запросы не ждали их установки
+        await self.warmup(int(os.getenv("DB_POOL_WARMUP", self._engine.pool.size())))
 
         self._initialized = True
 
         return self
 
+    @property
+    def engine(self) -> AsyncEngine:
+        """
+        Асинхронный движок базы данных (например, для подключения обработчиков событий).
+        """
+        if not self._engine:
+            raise Exception("База данных не инициализирована. Сначала вызовите await Database().init().")
+        return self._engine
+
+    async def check_schema(self):
+        """
+        Проверяет, что версия схемы в таблице alembic_version совпадает с последней миграцией.
+
+        Ожидаемые версии берутся из DB_SCHEMA_HEADS (через запятую; их один раз вычисляет
+        backend.server перед запуском процессов), иначе - из каталога миграций Alembic.
+        Проверка стоит одного запроса вместо DDL create_all при каждом старте процесса.
+        """
+        expected = {head for head in os.getenv("DB_SCHEMA_HEADS", "").split(",") if head} or schema_heads()
+        async with self._engine.connect() as conn:
+            try:
+                current = set((await conn.execute(text("SELECT version_num FROM alembic_version"))).scalars())
+            except DBAPIError:
+                current = set()
+
+        if current != expected:
+            raise Exception(
+                f"Версия схемы базы данных ({', '.join(sorted(current)) or 'нет'}) не совпадает с последней "
+                f"миграцией ({', '.join(sorted(expected))}). Выполните alembic upgrade head."
+            )
+
+    async def warmup(self, connections: int):
+        """
+        Открывает connections соединений одновременно и возвращает их в пул.
+
+        :param connections: Сколько соединений открыть (не больше размера пула)
+        """
+        async def ping():
+            async with self._engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+
+        connections = min(connections, self._engine.pool.size())
+        await asyncio.gather(*(ping() for _ in range(connections)))
+
     async def get_session(self) -> AsyncSession:
         """
         Создает и возвращает асинхронную сессию
@@ -71,3 +158,15 @@ class Database:
         if not self._session_factory:
             raise Exception("База данных не инициализирована. Сначала вызовите await Database().init().")
         return self._session_factory()
+
+
+def schema_heads() -> set[str]:
+    """
+    Возвращает последние версии (heads) из каталога миграций Alembic.
+    """
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    return set(ScriptDirectory.from_config(config).get_heads())
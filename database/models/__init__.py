@@ -1,2 +1,6 @@
 from database.models.user import *
+from database.models.blob import *
 from database.models.audio import *
+from database.models.upload_session import *
+from database.models.usage import *
+from database.models.file_list_version import *
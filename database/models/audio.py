@@ -1,6 +1,7 @@
 import uuid
 
-from sqlalchemy import Column, ForeignKey, String, UUID
+from sqlalchemy import (DDL, BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, UUID,
+                        event, false, func)
 from sqlalchemy.orm import relationship
 
 from database import SqlAlchemyBase
@@ -8,9 +9,46 @@ from database import SqlAlchemyBase
 
 class AudioFile(SqlAlchemyBase):
     __tablename__ = "audio_files"
+    __table_args__ = (
+        # Списки файлов пользователя фильтруются по user_id и пагинируются по id
+        Index("ix_audio_files_user_id_id", "user_id", "id"),
+        # Частичный индекс по ещё не разобранным файлам для дозаполнения метаданных
+        Index("ix_audio_files_metadata_pending", "id", postgresql_where="NOT metadata_extracted"),
+        # Триграммный индекс для поиска по имени файла (подстрока и нечёткое совпадение, pg_trgm)
+        Index(
+            "ix_audio_files_filename_trgm", "filename",
+            postgresql_using="gin", postgresql_ops={"filename": "gin_trgm_ops"}
+        ),
+        # Частичный индекс по файлам горячего уровня для выбора давно не читавшихся (scripts.tier_storage)
+        Index("ix_audio_files_hot_accessed", "last_accessed_at", "id", postgresql_where="NOT cold"),
+    )
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     filename = Column(String, nullable=False)
     user_id = Column(UUID, ForeignKey("users.id"))
+    storage_key = Column(String, nullable=True)
+    # Размер содержимого в байтах; у файлов, загруженных до учёта места, заполняется scripts.recount_usage
+    size_bytes = Column(BigInteger, nullable=True)
+    # Заполняется в режиме контентно-адресуемого хранения: файл лежит в общем блобе
+    blob_sha256 = Column(String(64), ForeignKey("audio_blobs.sha256"), nullable=True, index=True)
+
+    # Метаданные из заголовков контейнера, заполняются после загрузки (backend.metadata)
+    duration = Column(Float, nullable=True)
+    sample_rate = Column(Integer, nullable=True)
+    channels = Column(Integer, nullable=True)
+    bit_rate = Column(Integer, nullable=True)
+    codec = Column(String, nullable=True)
+    metadata_extracted = Column(Boolean, nullable=False, default=False, server_default=false())
+
+    # Уровень хранения (backend.tiering): время последнего чтения содержимого с точностью до
+    # ACCESS_RESOLUTION и признак того, что файл сжат в холодный уровень
+    last_accessed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    cold = Column(Boolean, nullable=False, default=False, server_default=false())
 
     owner = relationship("User", back_populates="audio_files")
+
+
+# Класс операторов gin_trgm_ops нужен до создания индекса (при create_all; в миграциях - отдельно)
+event.listen(
+    AudioFile.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
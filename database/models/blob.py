@@ -0,0 +1,11 @@
+from sqlalchemy import BigInteger, Column, Integer, String
+
+from database import SqlAlchemyBase
+
+
+class AudioBlob(SqlAlchemyBase):
+    __tablename__ = "audio_blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,11 @@
+from sqlalchemy import BigInteger, Column, String
+
+from database import SqlAlchemyBase
+
+
+class FileListVersion(SqlAlchemyBase):
+    __tablename__ = "file_list_versions"
+
+    # Версии списков файлов, общие для всех процессов: ключ - идентификатор владельца или "*" для общего списка
+    key = Column(String(36), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
@@ -0,0 +1,15 @@
+import uuid
+
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, String, UUID
+
+from database import SqlAlchemyBase
+
+
+class UploadSession(SqlAlchemyBase):
+    __tablename__ = "upload_sessions"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    total_size = Column(BigInteger, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
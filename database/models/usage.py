@@ -0,0 +1,12 @@
+from sqlalchemy import BigInteger, Column, ForeignKey, UUID
+
+from database import SqlAlchemyBase
+
+
+class UserUsage(SqlAlchemyBase):
+    __tablename__ = "user_usage"
+
+    # Счётчики занятого места пользователя: меняются в тех же транзакциях, что и записи audio_files
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    file_count = Column(BigInteger, nullable=False, default=0, server_default="0")
+    total_bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
@@ -9,7 +9,7 @@ from database import SqlAlchemyBase
 class User(SqlAlchemyBase):
     __tablename__ = "users"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     yandex_id = Column(String, unique=True, index=True, nullable=True)
     email = Column(String, unique=True, nullable=True)
     name = Column(String, nullable=True)
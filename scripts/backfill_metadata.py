@@ -0,0 +1,81 @@
+"""
+Дозаполнение метаданных аудиофайлов, загруженных до появления их извлечения.
+
+Выбирает пачками записи с metadata_extracted = false (по частичному индексу
+ix_audio_files_metadata_pending), разбирает заголовки файлов в пуле процессов
+и сохраняет результат одним UPDATE на пачку. Каждая пачка фиксируется отдельно,
+поэтому прерванный скрипт можно запустить снова - он продолжит с необработанных записей.
+
+Запускается из каталога, где лежит uploads (как и само приложение).
+
+Использование:
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.backfill_metadata --batch-size 500 --workers 4
+"""
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.cache import invalidation_notify
+from backend.files import FILES_CACHE_CHANNEL
+from backend.metadata import extract_metadata
+from backend.storage import audio_file_path
+from backend.versions import bump_versions
+from backend.workers import create_process_pool, run_in_process
+from database.models import AudioFile
+
+
+async def main(batch_size: int, workers: int) -> int:
+    engine = create_async_engine(os.getenv("DATABASE_URL"))
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    pool = create_process_pool(workers)
+    processed = 0
+    try:
+        while True:
+            async with session_factory() as session:
+                async with session.begin():
+                    rows = (
+                        await session.execute(
+                            select(AudioFile.id, AudioFile.user_id, AudioFile.storage_key)
+                            .where(AudioFile.metadata_extracted.is_(False))
+                            .order_by(AudioFile.id)
+                            .limit(batch_size)
+                        )
+                    ).all()
+                    if not rows:
+                        break
+
+                    extracted = await asyncio.gather(
+                        *(run_in_process(pool, extract_metadata, audio_file_path(row)) for row in rows)
+                    )
+                    await session.execute(
+                        update(AudioFile),
+                        [
+                            {"id": row.id, **metadata, "metadata_extracted": True}
+                            for row, metadata in zip(rows, extracted)
+                        ]
+                    )
+                    # Версии списков файлов меняются вместе с пачкой, а кэши приложения сбрасываются после её фиксации
+                    user_ids = {str(row.user_id) for row in rows}
+                    await bump_versions(session, user_ids)
+                    for user_id in user_ids:
+                        await session.execute(invalidation_notify(FILES_CACHE_CHANNEL, user_id))
+
+            processed += len(rows)
+            print(f"processed {processed}")
+    finally:
+        pool.shutdown()
+        await engine.dispose()
+    return processed
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.workers))
@@ -0,0 +1,440 @@
+"""
+Воспроизводимый нагрузочный тест API, который не требует сети.
+
+Скрипт:
+    - пересоздаёт таблицы в базе DATABASE_URL и заполняет их --users пользователями и --rows
+      записями аудиофайлов (без файлов на диске); без DATABASE_URL используется временная база
+      SQLite (sqlite+aiosqlite) в рабочем каталоге;
+    - запускает заглушку Яндекс OAuth (scripts.yandex_oauth_stub) и приложение через backend.server
+      (--workers процессов) с хранилищем STORAGE_BACKEND=tmpfs и замеряет время холодного старта;
+    - выпускает JWT напрямую с тем же JWT_SECRET, поэтому сценариям не нужен вход через OAuth;
+    - прогоняет сценарии с --concurrency одновременными запросами и замеряет задержки,
+      число запросов в секунду и пиковую RSS процесса сервера (вместе с пулом разбора аудио).
+
+Сценарии: вход через заглушку OAuth, загрузка WAV-файлов размеров из --upload-sizes,
+страницы списков файлов и пользователей, поток NDJSON по всей таблице файлов, поиск по имени файла,
+чтение данных файла по идентификатору и удаление файлов.
+
+Результат печатается (или пишется в --output) одним JSON-документом: параметры запуска,
+время холодного старта сервера до первого ответа и для каждого сценария число запросов
+и ошибок, длительность, RPS, перцентили задержки p50/p95/p99 в миллисекундах
+и пиковая RSS сервера (всех процессов) в байтах. При одинаковых параметрах
+и --seed набор данных и последовательность запросов совпадают, поэтому результаты
+разных запусков можно сравнивать между собой.
+
+ВНИМАНИЕ: таблицы базы DATABASE_URL удаляются и создаются заново, указывайте отдельную базу.
+Пиковая RSS читается из /proc и доступна только в Linux.
+
+Использование:
+    python -m scripts.benchmark --rows 100000 --concurrency 32 --output benchmark.json
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.benchmark --rows 1000000
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable
+
+import aiohttp
+import jwt
+import orjson
+from aiohttp import web
+from sqlalchemy import insert, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend.pagination import encode_cursor
+from database import SqlAlchemyBase
+from database.models import AudioFile, User
+from scripts.yandex_oauth_stub import create_app as create_oauth_stub
+
+SEED_BATCH_SIZE = 10000
+JWT_SECRET = "benchmark-secret-" + "0" * 32
+SAMPLE_RATE = 44100
+RSS_SAMPLE_INTERVAL = 0.05
+SERVER_START_TIMEOUT = 60
+# Слова имён файлов: из них собираются разнообразные имена для поиска по триграммам
+FILENAME_WORDS = (
+    "morning", "evening", "river", "mountain", "ocean", "forest", "city", "night", "summer", "winter",
+    "piano", "guitar", "violin", "drums", "choir", "ambient", "demo", "live", "remix", "session",
+)
+# Запросы поиска: слова целиком, части слов и слова с опечатками
+SEARCH_QUERIES = ("piano", "mountain live", "rive", "gutiar", "sesion", "ocean remix", "winte", "violn demo")
+
+Request = Callable[[aiohttp.ClientSession, int], Awaitable[int]]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_size(value: str) -> int:
+    """
+    Переводит размер вида 64K, 1M или 1048576 в байты.
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def make_wav(size: int, rng: random.Random) -> bytes:
+    """
+    Возвращает моно 16-битный WAV примерно size байт с шумом, чтобы разбор метаданных
+    и расчёт пиков после загрузки работали так же, как для настоящих файлов.
+    """
+    frames = max(1, (size - 44) // 2)
+    data = rng.randbytes(frames * 2)
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(data), b"WAVE", b"fmt ", 16, 1, 1,
+        SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16, b"data", len(data)
+    )
+    return header + data
+
+
+def make_token(user_id: uuid.UUID) -> str:
+    payload = {
+        "sub": str(user_id),
+        "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=12),
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга (values должны быть отсортированы).
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def process_tree(pid: int) -> list[int]:
+    """
+    Возвращает pid процесса и всех его потомков.
+    """
+    pids = [pid]
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_rss(pid: int) -> int:
+    """
+    Суммарная RSS процесса и его потомков в байтах.
+    """
+    total = 0
+    for child in process_tree(pid):
+        try:
+            with open(f"/proc/{child}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+def seed_filename(i: int) -> str:
+    words = len(FILENAME_WORDS)
+    return f"{FILENAME_WORDS[i % words]} {FILENAME_WORDS[i // words % words]} {i}.wav"
+
+
+async def seed(database_url: str, users: int, rows: int, rng: random.Random) -> dict:
+    """
+    Пересоздаёт таблицы и заполняет их пользователями и записями аудиофайлов.
+
+    :return: Идентификаторы администратора, пользователей и файлов
+    """
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            # WAL сохраняется в файле базы и позволяет читать во время записи
+            await conn.execute(text("PRAGMA journal_mode=WAL"))
+        await conn.run_sync(SqlAlchemyBase.metadata.drop_all)
+        await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+
+    def new_id() -> uuid.UUID:
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    admin_id = new_id()
+    user_ids = [new_id() for _ in range(users)]
+    file_ids = [new_id() for _ in range(rows)]
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [
+            {"id": admin_id, "yandex_id": "benchmark-admin", "email": "admin@benchmark.local", "name": "admin",
+             "is_superuser": True},
+            *({"id": user_id, "yandex_id": f"benchmark-{i}", "email": f"user{i}@benchmark.local", "name": f"user {i}",
+               "is_superuser": False} for i, user_id in enumerate(user_ids)),
+        ])
+    for start in range(0, rows, SEED_BATCH_SIZE):
+        async with engine.begin() as conn:
+            await conn.execute(insert(AudioFile), [
+                {"id": file_id, "filename": seed_filename(start + i), "user_id": user_ids[(start + i) % users],
+                 "storage_key": f"{file_id}.wav", "duration": 180.0, "sample_rate": SAMPLE_RATE, "channels": 2,
+                 "bit_rate": 1411200, "codec": "wav", "metadata_extracted": True}
+                for i, file_id in enumerate(file_ids[start:start + SEED_BATCH_SIZE])
+            ])
+    await engine.dispose()
+    return {"admin": admin_id, "users": user_ids, "files": file_ids}
+
+
+async def start_server(port: int, workers: int, env: dict) -> subprocess.Popen:
+    """
+    Запускает приложение через backend.server и ждёт ответа /metrics.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "backend.server", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers)],
+        env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    async with aiohttp.ClientSession() as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                async with client.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    if response.status == 200:
+                        return server
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start in time")
+
+
+async def run_scenario(
+        client: aiohttp.ClientSession,
+        server_pid: int,
+        request: Request,
+        requests: int,
+        concurrency: int
+) -> dict:
+    """
+    Выполняет requests запросов не более чем по concurrency одновременно.
+
+    Запрос с номером i выполняется функцией request(client, i), которая читает ответ целиком
+    и возвращает его статус; ошибкой считается статус 4xx/5xx и ошибка соединения.
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+    peak_rss = tree_rss(server_pid)
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                if await request(client, i) >= 400:
+                    errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, tree_rss(server_pid))
+            await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    duration = time.perf_counter() - started
+    sampler.cancel()
+    peak_rss = max(peak_rss, tree_rss(server_pid))
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "concurrency": min(concurrency, requests),
+        "duration_s": round(duration, 3),
+        "rps": round(requests / duration, 1) if duration else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+async def read_status(request) -> int:
+    """
+    Выполняет запрос, читает ответ до конца (не накапливая его в памяти) и возвращает статус.
+    """
+    async with request as response:
+        async for _ in response.content.iter_any():
+            pass
+        return response.status
+
+
+def make_scenarios(data: dict, args: argparse.Namespace, rng: random.Random) -> dict[str, tuple[Request, int]]:
+    """
+    Возвращает сценарии: имя -> (функция запроса, число запросов).
+    """
+    admin = {"Authorization": f"Bearer {make_token(data['admin'])}"}
+    user_headers = [{"Authorization": f"Bearer {make_token(user_id)}"} for user_id in data["users"]]
+    files = data["files"]
+    # Файлы для чтения выбираются заранее, удаляются - другие, чтобы сценарии не мешали друг другу
+    deleted = files[-min(args.requests, len(files) // 2):]
+    read = [rng.choice(files[:len(files) - len(deleted)]) for _ in range(args.requests)]
+    page = max(1, min(100, len(files) // max(1, args.requests)))
+
+    async def login(client, i):
+        return await read_status(client.get("/auth/yandex/callback", params={"code": f"login-{i % 100}"}))
+
+    async def list_files(client, i):
+        # Каждый запрос - страница из своей части таблицы: курсор - идентификатор перед ней
+        sorted_ids = data["sorted_files"]
+        cursor = encode_cursor(sorted_ids[(i * page) % len(sorted_ids)])
+        return await read_status(client.get("/api/file/all", params={"limit": 100, "cursor": cursor}, headers=admin))
+
+    async def list_users(client, i):
+        return await read_status(client.get("/api/user/all", params={"limit": 100}, headers=admin))
+
+    async def stream_files(client, i):
+        return await read_status(client.get("/api/file/all", headers={**admin, "Accept": "application/x-ndjson"}))
+
+    async def search_files(client, i):
+        params = {"q": SEARCH_QUERIES[i % len(SEARCH_QUERIES)], "limit": 20}
+        return await read_status(client.get("/api/file/search", params=params, headers=admin))
+
+    async def get_file(client, i):
+        return await read_status(client.get(f"/api/file/{read[i]}", headers=user_headers[i % len(user_headers)]))
+
+    async def delete_file(client, i):
+        return await read_status(client.delete(f"/api/file/{deleted[i % len(deleted)]}", headers=admin))
+
+    scenarios = {"login": (login, args.requests)}
+    for size in args.upload_sizes:
+        body = make_wav(size, rng)
+
+        async def upload(client, i, body=body):
+            form = aiohttp.FormData()
+            form.add_field("file", body, filename=f"upload-{i}.wav", content_type="audio/wav")
+            return await read_status(
+                client.post("/api/file/upload", data=form, headers=user_headers[i % len(user_headers)])
+            )
+
+        # Крупных файлов загружается меньше, чтобы сценарий занимал сравнимое время
+        scenarios[f"upload_{size}"] = (upload, max(args.concurrency, args.requests * 65536 // max(size, 65536)))
+    scenarios.update({
+        "list_files": (list_files, args.requests),
+        "list_users": (list_users, args.requests),
+        "stream_files": (stream_files, args.streams),
+        "search_files": (search_files, args.requests),
+        "get_file": (get_file, args.requests),
+        "delete_file": (delete_file, len(deleted)),
+    })
+    return scenarios
+
+
+async def main(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(work_dir, 'benchmark.db')}"
+
+    seed_started = time.perf_counter()
+    data = await seed(database_url, args.users, args.rows, rng)
+    data["sorted_files"] = sorted(data["files"])
+    seed_seconds = time.perf_counter() - seed_started
+
+    oauth_port, port = free_port(), free_port()
+    oauth = web.AppRunner(create_oauth_stub())
+    await oauth.setup()
+    await web.TCPSite(oauth, "127.0.0.1", oauth_port).start()
+
+    cold_start_started = time.perf_counter()
+    server = await start_server(port, args.workers, {
+        "DATABASE_URL": database_url,
+        # Таблицы созданы при заполнении без миграций Alembic
+        "DB_CREATE_ALL": "true",
+        "JWT_SECRET": JWT_SECRET,
+        "JWT_ALGORITHM": "HS256",
+        "JWT_EXP_DELTA_SECONDS": "3600",
+        "STORAGE_BACKEND": "tmpfs",
+        "YANDEX_CLIENT_ID": "benchmark",
+        "YANDEX_CLIENT_SECRET": "benchmark",
+        "YANDEX_REDIRECT_URI": f"http://127.0.0.1:{port}/auth/yandex/callback",
+        "YANDEX_AUTHORIZE_URL": f"http://127.0.0.1:{oauth_port}/authorize",
+        "YANDEX_TOKEN_URL": f"http://127.0.0.1:{oauth_port}/token",
+        "YANDEX_USER_INFO_URL": f"http://127.0.0.1:{oauth_port}/info",
+    })
+    cold_start_seconds = time.perf_counter() - cold_start_started
+    results = {}
+    try:
+        async with aiohttp.ClientSession(
+                base_url=f"http://127.0.0.1:{port}",
+                connector=aiohttp.TCPConnector(limit=args.concurrency),
+                timeout=aiohttp.ClientTimeout(total=300),
+        ) as client:
+            for name, (request, requests) in make_scenarios(data, args, rng).items():
+                if args.scenarios and name not in args.scenarios:
+                    continue
+                results[name] = await run_scenario(client, server.pid, request, requests, args.concurrency)
+                print(f"{name}: {results[name]['rps']} rps, p99 {results[name]['latency_ms']['p99']} ms",
+                      file=sys.stderr)
+    finally:
+        server.terminate()
+        server.wait()
+        await oauth.cleanup()
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "database": make_url(database_url).get_backend_name(),
+        "config": {
+            "rows": args.rows, "users": args.users, "requests": args.requests, "streams": args.streams,
+            "concurrency": args.concurrency, "workers": args.workers, "upload_sizes": args.upload_sizes,
+            "seed": args.seed,
+        },
+        "seed_s": round(seed_seconds, 3),
+        "cold_start_s": round(cold_start_seconds, 3),
+        "scenarios": results,
+    }
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(output)
+    else:
+        sys.stdout.buffer.write(output + b"\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="База для теста (по умолчанию - временная SQLite)")
+    parser.add_argument("--rows", type=int, default=10000, help="Количество записей аудиофайлов")
+    parser.add_argument("--users", type=int, default=100, help="Количество пользователей")
+    parser.add_argument("--requests", type=int, default=1000, help="Запросов в каждом сценарии")
+    parser.add_argument("--streams", type=int, default=5, help="Полных потоков NDJSON по таблице файлов")
+    parser.add_argument("--concurrency", type=int, default=16, help="Одновременных запросов")
+    parser.add_argument("--workers", type=int, default=1, help="Процессов сервера")
+    parser.add_argument("--upload-sizes", type=lambda value: [parse_size(size) for size in value.split(",")],
+                        default="64K,1M,8M", help="Размеры загружаемых файлов через запятую")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=None,
+                        help="Запустить только перечисленные сценарии")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию - stdout)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,108 @@
+"""
+Микробенчмарк сериализации ответов списков /api/file/all и /api/user/all.
+
+Сравнивает время на ROWS строк для двух способов собрать ответ:
+    - before: ORM-сущности -> модели Pydantic в обработчике -> повторная валидация
+      по response_model и сериализация FastAPI (TypeAdapter.validate_python + dump_json);
+    - after: строки Row с нужными столбцами -> словари -> orjson (FastJSONResponse).
+
+База данных не нужна: строки создаются в памяти, поэтому измеряется только работа
+Python над ответом, без времени запроса к базе.
+
+Использование:
+    python -m scripts.benchmark_serialization --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import time
+import uuid
+from typing import Callable
+
+from asyncpg.pgproto.pgproto import UUID
+from pydantic import TypeAdapter
+from sqlalchemy.engine.result import result_tuple
+
+from backend.files import AUDIO_FILE_COLUMNS, AudioFilesListResponse, audio_file_payload, audio_file_response
+from backend.responses import FastJSONResponse
+from backend.user import USER_COLUMNS, UsersListResponse, user_payload, user_response
+from database.models import AudioFile, User
+
+
+def make_rows(rows: int) -> tuple[list, list]:
+    """
+    Возвращает строки Row аудиофайлов и пользователей с теми же столбцами, что выбирают обработчики.
+    """
+
+    def new_id() -> UUID:
+        # Идентификаторы того же типа, что возвращает asyncpg
+        return UUID(uuid.uuid4().bytes)
+
+    file_row = result_tuple([column.key for column in AUDIO_FILE_COLUMNS])
+    user_row = result_tuple([column.key for column in USER_COLUMNS])
+    user_ids = [new_id() for _ in range(max(1, rows // 100))]
+    files = [
+        file_row((
+            new_id(), f"track-{i}.mp3", user_ids[i % len(user_ids)], f"main:ab/cd/{i}.mp3",
+            183.4, 44100, 2, 320000, "mp3",
+        ))
+        for i in range(rows)
+    ]
+    users = [user_row((new_id(), str(i), f"user {i}", f"user{i}@example.com")) for i in range(rows)]
+    return files, users
+
+
+def files_before(rows: list) -> bytes:
+    entities = [AudioFile(**row._mapping) for row in rows]
+    content = AudioFilesListResponse(files=[audio_file_response(entity) for entity in entities], next_cursor=None)
+    adapter = TypeAdapter(AudioFilesListResponse)
+    return adapter.dump_json(adapter.validate_python(content))
+
+
+def files_after(rows: list) -> bytes:
+    return FastJSONResponse({"files": [audio_file_payload(row) for row in rows], "next_cursor": None}).body
+
+
+def users_before(rows: list) -> bytes:
+    entities = [User(**row._mapping) for row in rows]
+    content = UsersListResponse(users=[user_response(entity) for entity in entities], next_cursor=None)
+    adapter = TypeAdapter(UsersListResponse)
+    return adapter.dump_json(adapter.validate_python(content))
+
+
+def users_after(rows: list) -> bytes:
+    return FastJSONResponse({"users": [user_payload(row) for row in rows], "next_cursor": None}).body
+
+
+def measure(func: Callable[[list], bytes], rows: list, repeat: int) -> float:
+    """
+    Возвращает лучшее из repeat время выполнения func в миллисекундах.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(rows: int, repeat: int):
+    files, users = make_rows(rows)
+    # Оба способа должны давать один и тот же JSON
+    assert json.loads(files_before(files)) == json.loads(files_after(files))
+    assert json.loads(users_before(users)) == json.loads(users_after(users))
+
+    for name, before, after, data in (
+            ("/api/file/all", files_before, files_after, files),
+            ("/api/user/all", users_before, users_after, users),
+    ):
+        before_ms = measure(before, data, repeat)
+        after_ms = measure(after, data, repeat)
+        print(f"{name}: {rows} rows, before {before_ms:.1f} ms, after {after_ms:.1f} ms, x{before_ms / after_ms:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
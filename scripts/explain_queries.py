@@ -0,0 +1,122 @@
+"""
+Проверка планов основных запросов к PostgreSQL.
+
+Наполняет базу тестовыми пользователями и аудиофайлами, собирает статистику
+и выполняет EXPLAIN для запросов, которые делают обработчики API. Если хотя бы
+один запрос читает users или audio_files последовательным сканированием,
+скрипт завершается с кодом 1. Все данные создаются в одной транзакции,
+которая в конце откатывается, поэтому база остаётся нетронутой.
+
+Схема должна быть создана миграциями (alembic upgrade head).
+
+Использование:
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.explain_queries --users 1000 --files-per-user 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import func, literal, or_, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database.models import AudioFile, User
+
+PAGE_SIZE = 100
+
+SEED_USERS = text(
+    "INSERT INTO users (id, yandex_id, name, is_superuser) "
+    "SELECT gen_random_uuid(), 'explain-' || g, 'explain user ' || g, false "
+    "FROM generate_series(1, :users) AS g"
+)
+SEED_FILES = text(
+    "WITH seed AS MATERIALIZED ("
+    "    SELECT gen_random_uuid() AS id, u.id AS user_id, g "
+    "    FROM users AS u CROSS JOIN generate_series(1, :files_per_user) AS g "
+    "    WHERE u.yandex_id LIKE 'explain-%'"
+    ") "
+    "INSERT INTO audio_files (id, filename, user_id, storage_key) "
+    "SELECT id, 'track-' || g || '.wav', user_id, user_id::text || '/' || id::text || '.wav' FROM seed"
+)
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+async def explain(conn, statement) -> dict:
+    compiled = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    result = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))).scalar_one()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Plan"]
+
+
+async def main(users: int, files_per_user: int) -> int:
+    engine = create_async_engine(os.getenv("DATABASE_URL"))
+    failed = False
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            await conn.execute(SEED_USERS, {"users": users})
+            await conn.execute(SEED_FILES, {"files_per_user": files_per_user})
+            await conn.execute(text("ANALYZE users"))
+            await conn.execute(text("ANALYZE audio_files"))
+
+            user = (await conn.execute(select(User.id, User.yandex_id).limit(1))).one()
+            file_id = (
+                await conn.execute(select(AudioFile.id).where(AudioFile.user_id == user.id).limit(1))
+            ).scalar_one()
+
+            queries = {
+                "files of user, first page":
+                    select(AudioFile).where(AudioFile.user_id == user.id).order_by(AudioFile.id).limit(PAGE_SIZE + 1),
+                "files of user, next page":
+                    select(AudioFile).where(AudioFile.user_id == user.id, AudioFile.id > file_id)
+                    .order_by(AudioFile.id).limit(PAGE_SIZE + 1),
+                "all files, next page":
+                    select(AudioFile).where(AudioFile.id > file_id).order_by(AudioFile.id).limit(PAGE_SIZE + 1),
+                "file by id": select(AudioFile).where(AudioFile.id == file_id),
+                "all users, next page":
+                    select(User).where(User.id > user.id).order_by(User.id).limit(PAGE_SIZE + 1),
+                "user by id": select(User).where(User.id == user.id),
+                "user by yandex_id": select(User).where(User.yandex_id == user.yandex_id),
+                "files by name":
+                    select(AudioFile).where(or_(
+                        AudioFile.filename.icontains("track-123", autoescape=True),
+                        literal("track-123").op("<%")(AudioFile.filename)
+                    )).order_by(func.word_similarity("track-123", AudioFile.filename).desc(), AudioFile.id)
+                    .limit(PAGE_SIZE + 1),
+                "files of user by name":
+                    select(AudioFile).where(
+                        AudioFile.user_id == user.id, AudioFile.filename.icontains("track-12", autoescape=True)
+                    ).order_by(AudioFile.id).limit(PAGE_SIZE + 1),
+            }
+
+            for name, statement in queries.items():
+                plan = await explain(conn, statement)
+                scans = [
+                    f"{node['Node Type']} on {node.get('Index Name') or node['Relation Name']}"
+                    for node in plan_nodes(plan) if "Relation Name" in node or "Index Name" in node
+                ]
+                seq_scan = any(node["Node Type"] == "Seq Scan" for node in plan_nodes(plan))
+                failed = failed or seq_scan
+                print(f"{'FAIL' if seq_scan else 'ok  '} {name}: {', '.join(scans)} (cost {plan['Total Cost']})")
+        finally:
+            await transaction.rollback()
+    await engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--files-per-user", type=int, default=100)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.users, args.files_per_user)))
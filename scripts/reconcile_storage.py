@@ -0,0 +1,191 @@
+"""
+Сверка томов локального хранилища (STORAGE_VOLUMES) с базой данных.
+
+Находит:
+    - файлы на диске, на которые не ссылается ни одна запись audio_files или audio_blobs
+      (в том числе недописанные .part и частичные загрузки без сессии);
+    - записи audio_files, у которых на диске нет ни файла, ни его сжатой копии холодного уровня;
+    - блобы, счётчик ссылок которых не совпадает с числом ссылающихся записей.
+
+Файлы моложе --min-age секунд не считаются потерянными: это могут быть загрузки,
+запись о которых ещё не зафиксирована. По умолчанию скрипт только печатает отчёт;
+с --apply удаляет потерянные файлы и записи без файлов и исправляет счётчики блобов.
+
+Запускается с теми же STORAGE_VOLUMES и из того же каталога, что и само приложение.
+
+Использование:
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.reconcile_storage --min-age 3600 --apply
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.cache import invalidation_notify
+from backend.blobs import delete_unreferenced_blobs
+from backend.deletion import blob_hashes, delete_audio_file_records
+from backend.files import FILES_CACHE_CHANNEL
+from backend.storage import SIDECAR_SUFFIXES, LocalStorageBackend, audio_file_path, blob_key, get_storage, partial_path
+from backend.tiering import cold_path
+from backend.versions import bump_versions
+from database.models import AudioBlob, AudioFile, UploadSession
+
+BATCH_SIZE = 1000
+
+
+def scan_uploads(storage: LocalStorageBackend, min_age: float) -> list[str]:
+    """
+    Возвращает пути всех файлов на томах хранилища старше min_age секунд.
+    """
+    deadline = time.time() - min_age
+    paths = []
+    for directory, _, filenames in (entry for volume in storage.volumes.values() for entry in os.walk(volume.root)):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if os.stat(path).st_mtime <= deadline:
+                    paths.append(path)
+            except FileNotFoundError:
+                pass
+    return paths
+
+
+def base_path(path: str) -> str:
+    """
+    Возвращает путь основного файла для производного файла (например, пиков), иначе сам путь.
+    """
+    for suffix in SIDECAR_SUFFIXES:
+        if path.endswith(suffix):
+            return path.removesuffix(suffix)
+    return path
+
+
+def content_exists(path: str) -> bool:
+    """
+    Проверяет, что на диске есть содержимое записи: исходный файл или его сжатая копия.
+
+    Отметка cold не учитывается: файл мог перейти между уровнями после чтения записи, а при переходе
+    новая копия пишется до изменения записи и старая удаляется после, поэтому одна из них есть всегда.
+    """
+    return os.path.exists(path) or os.path.exists(cold_path(path))
+
+
+async def main(min_age: float, apply: bool):
+    engine = create_async_engine(os.getenv("DATABASE_URL"))
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    storage = get_storage()
+    disk = await asyncio.to_thread(scan_uploads, storage, min_age)
+
+    # Все запросы сверки видят один снимок базы
+    async with session_factory(bind=engine.execution_options(isolation_level="REPEATABLE READ")) as session:
+        referenced = set()
+        missing_rows = []
+        result = await session.stream(
+            select(AudioFile.id, AudioFile.user_id, AudioFile.storage_key, AudioFile.blob_sha256)
+            .execution_options(yield_per=BATCH_SIZE)
+        )
+        async for row in result:
+            path = audio_file_path(row)
+            referenced.add(path)
+            if not row.blob_sha256 and not await asyncio.to_thread(content_exists, path):
+                missing_rows.append(row.id)
+
+        blob_refs = dict(
+            (await session.execute(
+                select(AudioFile.blob_sha256, func.count())
+                .where(AudioFile.blob_sha256.is_not(None))
+                .group_by(AudioFile.blob_sha256)
+            )).all()
+        )
+        drifted = []
+        for sha256, ref_count in (await session.execute(select(AudioBlob.sha256, AudioBlob.ref_count))).all():
+            key = await storage.locate(blob_key(sha256))
+            if ref_count != blob_refs.get(sha256, 0):
+                drifted.append((sha256, blob_refs.get(sha256, 0)))
+            if key is None:
+                print(f"missing blob file: {blob_key(sha256)}")
+            else:
+                referenced.add(storage.local_path(key))
+
+        referenced.update(
+            partial_path(session_id) for session_id in (await session.execute(select(UploadSession.id))).scalars()
+        )
+        await session.commit()
+
+    orphans = [path for path in disk if base_path(path) not in referenced]
+
+    for path in orphans:
+        print(f"orphan file: {path}")
+    for file_id in missing_rows:
+        print(f"row without file: {file_id}")
+    for sha256, ref_count in drifted:
+        print(f"blob ref_count drift: {sha256} -> {ref_count}")
+    print(f"{len(orphans)} orphan files, {len(missing_rows)} rows without files, {len(drifted)} drifted blobs")
+
+    if apply:
+        for path in orphans:
+            try:
+                await asyncio.to_thread(os.remove, path)
+            except FileNotFoundError:
+                pass
+
+        async with session_factory() as session:
+            for start in range(0, len(missing_rows), BATCH_SIZE):
+                # Снимок мог устареть: наличие файлов перепроверяется под блокировкой строк
+                locked = (
+                    await session.execute(
+                        select(AudioFile.id, AudioFile.user_id, AudioFile.storage_key)
+                        .where(AudioFile.id.in_(missing_rows[start:start + BATCH_SIZE]))
+                        .order_by(AudioFile.id)
+                        .with_for_update()
+                    )
+                ).all()
+                still_missing = [
+                    row.id for row in locked if not await asyncio.to_thread(content_exists, audio_file_path(row))
+                ]
+                if not still_missing:
+                    await session.commit()
+                    continue
+                deleted = await delete_audio_file_records(session, AudioFile.id.in_(still_missing))
+                user_ids = {str(row.user_id) for row in deleted}
+                await bump_versions(session, user_ids)
+                for user_id in user_ids:
+                    await session.execute(invalidation_notify(FILES_CACHE_CHANNEL, user_id))
+                await session.commit()
+                await delete_unreferenced_blobs(session, blob_hashes(deleted))
+
+            for sha256, _ in drifted:
+                # Счётчик пересчитывается в самом UPDATE, чтобы учесть изменения после снимка
+                ref_count = (
+                    await session.execute(
+                        update(AudioBlob)
+                        .where(AudioBlob.sha256 == sha256)
+                        .values(
+                            ref_count=select(func.count())
+                            .where(AudioFile.blob_sha256 == sha256)
+                            .scalar_subquery()
+                        )
+                        .returning(AudioBlob.ref_count)
+                    )
+                ).scalar_one_or_none()
+                if ref_count == 0:
+                    await session.execute(delete(AudioBlob).where(AudioBlob.sha256 == sha256))
+                await session.commit()
+                if ref_count == 0:
+                    await delete_unreferenced_blobs(session, [sha256])
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-age", type=float, default=3600, help="Минимальный возраст потерянного файла, секунды")
+    parser.add_argument("--apply", action="store_true", help="Удалить потерянные файлы и записи, исправить счётчики")
+    args = parser.parse_args()
+    asyncio.run(main(args.min_age, args.apply))
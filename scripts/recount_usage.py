@@ -0,0 +1,146 @@
+"""
+Заполнение размеров аудиофайлов и пересчёт счётчиков занятого места пользователей (user_usage).
+
+Сначала проходит пачками по записям с size_bytes = NULL (загруженным до учёта места):
+размер берётся из audio_blobs для блобов и из хранилища для обычных файлов.
+Записи, файлов которых нет в хранилище, остаются без размера и печатаются
+(их удаляет scripts.reconcile_storage).
+
+Затем пересчитывает счётчики пачками пользователей по таблице audio_files. Строки счётчиков
+пачки блокируются до подсчёта, поэтому загрузки и удаления этих пользователей ждут
+окончания пересчёта пачки и не теряются. Скрипт можно запускать при работающем
+приложении и повторять, если счётчики разошлись с таблицей файлов.
+
+Запускается с теми же STORAGE_VOLUMES и из того же каталога, что и само приложение.
+
+Использование:
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.recount_usage --batch-size 1000
+"""
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.cache import invalidation_notify
+from backend.files import FILES_CACHE_CHANNEL
+from backend.storage import audio_file_key, get_storage
+from backend.versions import bump_versions
+from database.models import AudioBlob, AudioFile, User, UserUsage
+
+
+async def fill_sizes(session_factory, batch_size: int) -> int:
+    """
+    Заполняет size_bytes у записей без размера.
+
+    :return: Количество записей, у которых заполнен размер
+    """
+    storage = get_storage()
+    filled = 0
+    last_id = None
+    while True:
+        async with session_factory() as session:
+            async with session.begin():
+                statement = (
+                    select(
+                        AudioFile.id, AudioFile.user_id, AudioFile.storage_key, AudioFile.blob_sha256, AudioBlob.size
+                    )
+                    .outerjoin(AudioBlob, AudioBlob.sha256 == AudioFile.blob_sha256)
+                    .where(AudioFile.size_bytes.is_(None))
+                    .order_by(AudioFile.id)
+                    .limit(batch_size)
+                )
+                if last_id is not None:
+                    statement = statement.where(AudioFile.id > last_id)
+                rows = (await session.execute(statement)).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                sizes = []
+                for row in rows:
+                    size = row.size
+                    if not row.blob_sha256:
+                        stat_result = await storage.stat(audio_file_key(row))
+                        size = stat_result.st_size if stat_result is not None else None
+                    if size is None:
+                        print(f"row without file: {row.id}")
+                    else:
+                        sizes.append({"id": row.id, "size_bytes": size})
+                if sizes:
+                    await session.execute(update(AudioFile), sizes)
+                # Размеры попадают в списки файлов, поэтому версии списков меняются вместе с пачкой,
+                # а кэши списков сбрасываются после её фиксации
+                user_ids = {str(row.user_id) for row in rows if row.user_id is not None}
+                await bump_versions(session, user_ids)
+                for user_id in user_ids:
+                    await session.execute(invalidation_notify(FILES_CACHE_CHANNEL, user_id))
+
+        filled += len(sizes)
+        print(f"sizes filled {filled}")
+    return filled
+
+
+async def recount(session_factory, batch_size: int) -> int:
+    """
+    Пересчитывает счётчики user_usage всех пользователей.
+
+    :return: Количество пользователей, для которых пересчитаны счётчики
+    """
+    counted = 0
+    last_id = None
+    while True:
+        async with session_factory() as session:
+            async with session.begin():
+                statement = select(User.id).order_by(User.id).limit(batch_size)
+                if last_id is not None:
+                    statement = statement.where(User.id > last_id)
+                user_ids = (await session.execute(statement)).scalars().all()
+                if not user_ids:
+                    break
+                last_id = user_ids[-1]
+
+                await session.execute(
+                    insert(UserUsage).values([{"user_id": user_id} for user_id in user_ids]).on_conflict_do_nothing()
+                )
+                # Блокировка берётся отдельным запросом: подсчёт в UPDATE видит снимок базы на момент
+                # своего начала, а значит, и все загрузки, зафиксированные до получения блокировки
+                await session.execute(
+                    select(UserUsage.user_id).where(UserUsage.user_id.in_(user_ids))
+                    .order_by(UserUsage.user_id).with_for_update()
+                )
+                user_files = AudioFile.user_id == UserUsage.user_id
+                await session.execute(
+                    update(UserUsage)
+                    .where(UserUsage.user_id.in_(user_ids))
+                    .values(
+                        file_count=select(func.count()).where(user_files).scalar_subquery(),
+                        total_bytes=select(func.coalesce(func.sum(AudioFile.size_bytes), 0))
+                        .where(user_files).scalar_subquery()
+                    )
+                )
+
+        counted += len(user_ids)
+        print(f"users recounted {counted}")
+    return counted
+
+
+async def main(batch_size: int):
+    engine = create_async_engine(os.getenv("DATABASE_URL"))
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    try:
+        await fill_sizes(session_factory, batch_size)
+        await recount(session_factory, batch_size)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,208 @@
+"""
+Перенос давно не читавшихся аудиофайлов в холодный уровень хранения (backend.tiering).
+
+Выбирает пачками WAV-файлы, которые не читались дольше --days дней (по частичному индексу
+ix_audio_files_hot_accessed), и сжимает их без потерь в пуле процессов: отсчёты PCM - во FLAC,
+остальное - в zlib. Запись помечается cold, только если файл так и не прочитали, пока он сжимался;
+исходный файл удаляется после фиксации. Файлы, которые сжимаются хуже --max-ratio, остаются
+в горячем уровне, а время их чтения сдвигается, чтобы следующий запуск не сжимал их снова.
+Блобы контентно-адресуемого хранения общие для нескольких записей и не переносятся, как и файлы
+без размера (их размер сначала заполняет scripts.recount_usage).
+
+С --promote, наоборот, возвращает все холодные файлы в горячий уровень (например, перед откатом миграции).
+
+Скрипт можно запускать по расписанию при работающем приложении. Запускается с теми же
+STORAGE_VOLUMES и из того же каталога, что и само приложение.
+
+Использование:
+    DATABASE_URL=postgresql+asyncpg://... python -m scripts.tier_storage --days 30 --workers 4
+"""
+import argparse
+import asyncio
+import datetime
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.storage import audio_file_path
+from backend.tiering import cold_path, demote_file, restore_file
+from backend.workers import create_process_pool, run_in_process
+from database.models import AudioFile
+
+# Кодек mutagen для WAV: остальные форматы (MP3, OGG, FLAC) уже сжаты
+COLD_CODECS = ("wave",)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def demote(session_factory, pool, days: float, max_ratio: float, batch_size: int) -> int:
+    """
+    Переносит в холодный уровень файлы, которые не читались дольше days дней.
+
+    :return: Количество перенесённых файлов
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    moved = saved = 0
+    last = None
+    while True:
+        async with session_factory() as session:
+            statement = (
+                select(AudioFile.id, AudioFile.user_id, AudioFile.storage_key, AudioFile.last_accessed_at)
+                .where(
+                    AudioFile.cold.is_(False),
+                    AudioFile.last_accessed_at < cutoff,
+                    AudioFile.blob_sha256.is_(None),
+                    AudioFile.size_bytes.is_not(None),
+                    AudioFile.codec.in_(COLD_CODECS)
+                )
+                .order_by(AudioFile.last_accessed_at, AudioFile.id)
+                .limit(batch_size)
+            )
+            if last is not None:
+                statement = statement.where(tuple_(AudioFile.last_accessed_at, AudioFile.id) > last)
+            rows = (await session.execute(statement)).all()
+            await session.commit()
+        if not rows:
+            break
+        last = (rows[-1].last_accessed_at, rows[-1].id)
+
+        paths = {row.id: audio_file_path(row) for row in rows}
+        results = await asyncio.gather(
+            *(run_in_process(pool, demote_file, paths[row.id], max_ratio) for row in rows), return_exceptions=True
+        )
+        compressed = {}
+        incompressible = []
+        for row, result in zip(rows, results):
+            if isinstance(result, FileNotFoundError):
+                print(f"row without file: {row.id}")
+            elif isinstance(result, Exception):
+                print(f"failed to compress {row.id}: {result!r}")
+            elif result is None:
+                incompressible.append(row.id)
+            else:
+                compressed[row.id] = result
+
+        async with session_factory() as session:
+            async with session.begin():
+                demoted = set()
+                if compressed:
+                    # Файлы, прочитанные или удалённые во время сжатия, остаются как есть
+                    demoted = set(
+                        (
+                            await session.execute(
+                                update(AudioFile)
+                                .where(
+                                    AudioFile.id.in_(compressed),
+                                    AudioFile.cold.is_(False),
+                                    AudioFile.last_accessed_at < cutoff
+                                )
+                                .values(cold=True)
+                                .returning(AudioFile.id)
+                            )
+                        ).scalars()
+                    )
+                if incompressible:
+                    await session.execute(
+                        update(AudioFile).where(AudioFile.id.in_(incompressible)).values(last_accessed_at=func.now())
+                    )
+
+        # После фиксации читатели открывают сжатую копию, и исходный файл больше не нужен
+        for file_id, (size, cold_size) in compressed.items():
+            path = paths[file_id]
+            if file_id in demoted:
+                await asyncio.to_thread(remove_file, path)
+                saved += size - cold_size
+            else:
+                await asyncio.to_thread(remove_file, cold_path(path))
+        moved += len(demoted)
+        print(f"files moved {moved}, bytes saved {saved}")
+    return moved
+
+
+async def promote(session_factory, pool, batch_size: int) -> int:
+    """
+    Возвращает все холодные файлы в горячий уровень.
+
+    :return: Количество возвращённых файлов
+    """
+    promoted = 0
+    last_id = None
+    while True:
+        async with session_factory() as session:
+            statement = (
+                select(AudioFile.id, AudioFile.user_id, AudioFile.storage_key)
+                .where(AudioFile.cold.is_(True))
+                .order_by(AudioFile.id)
+                .limit(batch_size)
+            )
+            if last_id is not None:
+                statement = statement.where(AudioFile.id > last_id)
+            rows = (await session.execute(statement)).all()
+            await session.commit()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        paths = {row.id: audio_file_path(row) for row in rows}
+        results = await asyncio.gather(
+            *(run_in_process(pool, restore_file, cold_path(path), path) for path in paths.values()),
+            return_exceptions=True
+        )
+        restored = []
+        for row, result in zip(rows, results):
+            if isinstance(result, Exception):
+                print(f"failed to restore {row.id}: {result!r}")
+            else:
+                restored.append(row.id)
+
+        if restored:
+            async with session_factory() as session:
+                async with session.begin():
+                    await session.execute(
+                        update(AudioFile)
+                        .where(AudioFile.id.in_(restored))
+                        .values(cold=False, last_accessed_at=func.now())
+                    )
+        for file_id in restored:
+            await asyncio.to_thread(remove_file, cold_path(paths[file_id]))
+        promoted += len(restored)
+        print(f"files promoted {promoted}")
+    return promoted
+
+
+async def main(days: float, max_ratio: float, batch_size: int, workers: int, promote_all: bool):
+    engine = create_async_engine(os.getenv("DATABASE_URL"))
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    pool = create_process_pool(workers)
+    try:
+        if promote_all:
+            await promote(session_factory, pool, batch_size)
+        else:
+            await demote(session_factory, pool, days, max_ratio, batch_size)
+    finally:
+        pool.shutdown()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--days", type=float, default=float(os.getenv("COLD_AFTER_DAYS", 30)),
+        help="Сколько дней файл не читали, чтобы перенести его в холодный уровень"
+    )
+    parser.add_argument(
+        "--max-ratio", type=float, default=0.9, help="Наибольшая доля размера сжатого файла от исходного"
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--promote", action="store_true", help="Вернуть все холодные файлы в горячий уровень")
+    args = parser.parse_args()
+    asyncio.run(main(args.days, args.max_ratio, args.batch_size, args.workers, args.promote))
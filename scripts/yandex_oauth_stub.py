@@ -0,0 +1,81 @@
+"""
+Локальная заглушка Яндекс OAuth для нагрузочного тестирования входа без доступа к сети.
+
+Реализует три адреса, которые использует backend.auth:
+    GET  /authorize  - сразу перенаправляет на redirect_uri с кодом авторизации;
+    POST /token      - обменивает код на access_token;
+    GET  /info       - возвращает данные пользователя по access_token.
+
+Код авторизации определяет пользователя: один и тот же код всегда даёт одного
+и того же пользователя, поэтому повторные входы проверяют ветку upsert с конфликтом.
+Параметр --latency добавляет задержку к каждому ответу, имитируя сеть до Яндекса.
+
+Использование:
+    python -m scripts.yandex_oauth_stub --port 8081
+    YANDEX_AUTHORIZE_URL=http://127.0.0.1:8081/authorize \\
+    YANDEX_TOKEN_URL=http://127.0.0.1:8081/token \\
+    YANDEX_USER_INFO_URL=http://127.0.0.1:8081/info \\
+    uvicorn backend.main:app
+
+После этого вход выполняется запросом GET /auth/yandex/callback?code=<любая строка>.
+"""
+import argparse
+import asyncio
+import uuid
+
+from aiohttp import web
+
+TOKEN_PREFIX = "stub-token-"
+
+
+def create_app(latency: float = 0.0) -> web.Application:
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def authorize(request: web.Request) -> web.Response:
+        await delay()
+        redirect_uri = request.query["redirect_uri"]
+        code = request.query.get("login_hint") or uuid.uuid4().hex
+        raise web.HTTPFound(f"{redirect_uri}?code={code}")
+
+    async def token(request: web.Request) -> web.Response:
+        await delay()
+        data = await request.post()
+        code = data.get("code")
+        if data.get("grant_type") != "authorization_code" or not code:
+            return web.json_response({"error": "invalid_grant"}, status=400)
+        return web.json_response({
+            "access_token": f"{TOKEN_PREFIX}{code}",
+            "token_type": "bearer",
+            "expires_in": 3600,
+        })
+
+    async def info(request: web.Request) -> web.Response:
+        await delay()
+        authorization = request.headers.get("Authorization", "")
+        access_token = authorization.removeprefix("OAuth ")
+        if not access_token.startswith(TOKEN_PREFIX):
+            return web.json_response({"error": "invalid_token"}, status=401)
+        login = access_token.removeprefix(TOKEN_PREFIX)
+        return web.json_response({
+            "id": f"stub-{login}",
+            "login": login,
+            "default_email": f"{login}@stub.local",
+            "display_name": f"Stub {login}",
+        })
+
+    app = web.Application()
+    app.router.add_get("/authorize", authorize)
+    app.router.add_post("/token", token)
+    app.router.add_get("/info", info)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка каждого ответа в секундах")
+    args = parser.parse_args()
+    web.run_app(create_app(args.latency), host=args.host, port=args.port)
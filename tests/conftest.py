@@ -0,0 +1,98 @@
+"""
+Общие фикстуры тестов API: приложение поднимается через TestClient на SQLite (таблицы создаёт
+Database.init) с хранилищем TmpfsStorageBackend, поэтому PostgreSQL для тестов не нужен.
+
+Запуск из корня репозитория:
+    python -m pytest tests
+"""
+import datetime
+import io
+import os
+import uuid
+import wave
+
+import jwt
+import pytest
+
+JWT_SECRET = "test-secret-" + "x" * 32
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    database_path = tmp_path_factory.mktemp("db") / "test.db"
+    os.environ.update(
+        DATABASE_URL=f"sqlite+aiosqlite:///{database_path}",
+        JWT_SECRET=JWT_SECRET,
+        JWT_EXP_DELTA_SECONDS="3600",
+        STORAGE_BACKEND="tmpfs",
+        AUDIO_WORKERS="1",
+        DB_POOL_WARMUP="0",
+    )
+    from fastapi.testclient import TestClient
+
+    from backend.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def db(client):
+    """
+    Выполняет корутину-функцию fn(session) в отдельной транзакции и возвращает её результат.
+    """
+    from database import Database
+
+    def run(fn):
+        async def call():
+            async with await Database().get_session() as session:
+                async with session.begin():
+                    return await fn(session)
+
+        return client.portal.call(call)
+
+    return run
+
+
+@pytest.fixture
+def make_user(db):
+    """
+    Создаёт пользователя и возвращает его идентификатор и заголовки авторизации.
+    """
+    from database.models import User
+
+    def make(is_superuser: bool = False) -> tuple[uuid.UUID, dict]:
+        user_id = uuid.uuid4()
+
+        async def add(session):
+            session.add(User(
+                id=user_id, yandex_id=str(user_id), email=f"{user_id}@example.com", name="test",
+                is_superuser=is_superuser
+            ))
+
+        db(add)
+        payload = {
+            "sub": str(user_id),
+            "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+        }
+        return user_id, {"Authorization": "Bearer " + jwt.encode(payload, JWT_SECRET, algorithm="HS256")}
+
+    return make
+
+
+@pytest.fixture
+def wav():
+    """
+    Возвращает функцию, которая строит моно WAV с 16-битными отсчётами заданной длительности.
+    """
+    return wav_bytes
+
+
+def wav_bytes(seconds: float = 1.0, rate: int = 8000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x01\x00" * int(seconds * rate))
+    return buffer.getvalue()
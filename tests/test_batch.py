@@ -0,0 +1,23 @@
+import uuid
+
+
+def test_rename(client, make_user, wav):
+    _, headers = make_user()
+    ids = [
+        client.post("/api/file/upload", headers=headers, files={"file": (f"{i}.wav", wav(), "audio/wav")}).json()["id"]
+        for i in range(2)
+    ]
+    missing = str(uuid.uuid4())
+
+    response = client.patch("/api/file/batch", headers=headers, json={"files": [
+        {"id": ids[0], "filename": "first.wav"},
+        {"id": missing, "filename": "missing.wav"},
+        {"id": ids[1], "filename": "second.wav"},
+    ]})
+    assert response.status_code == 200
+    results = response.json()["files"]
+    assert [result["status_code"] for result in results] == [200, 404, 200]
+    assert [results[0]["file"]["filename"], results[2]["file"]["filename"]] == ["first.wav", "second.wav"]
+
+    response = client.post("/api/file/batch/get", headers=headers, json={"ids": ids})
+    assert [result["file"]["filename"] for result in response.json()["files"]] == ["first.wav", "second.wav"]
@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import select
+
+from backend.blobs import acquire_blobs, delete_unreferenced_blobs, release_blobs
+from backend.storage import StoredUpload, blob_key, storage_path
+from database.models import AudioBlob
+
+
+def upload_blob(client, monkeypatch, headers, data: bytes, count: int) -> str:
+    monkeypatch.setattr(client.app.state, "content_addressed_storage", True)
+    uploaded = [
+        client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", data, "audio/wav")}).json()
+        for _ in range(count)
+    ]
+    assert len({item["sha256"] for item in uploaded}) == 1
+    return uploaded[0]["sha256"]
+
+
+def ref_count(db, sha256: str):
+    async def get(session):
+        return (await session.execute(select(AudioBlob.ref_count).where(AudioBlob.sha256 == sha256))).scalar()
+
+    return db(get)
+
+
+def test_release_blobs(client, db, make_user, monkeypatch, wav):
+    _, headers = make_user()
+    sha256 = upload_blob(client, monkeypatch, headers, wav(seconds=0.5), 3)
+    path = storage_path(blob_key(sha256))
+    assert ref_count(db, sha256) == 3
+
+    assert db(lambda session: release_blobs(session, [sha256])) == []
+    assert ref_count(db, sha256) == 2
+    assert db(lambda session: delete_unreferenced_blobs(session, [sha256])) == []
+    assert os.path.exists(path)
+
+    # Строка удаляется вместе с последней ссылкой, а файл - только после фиксации
+    assert db(lambda session: release_blobs(session, [sha256, sha256])) == [sha256]
+    assert ref_count(db, sha256) is None
+    assert os.path.exists(path)
+    assert db(lambda session: delete_unreferenced_blobs(session, [sha256])) == [sha256]
+    assert ref_count(db, sha256) is None
+    assert not os.path.exists(path)
+
+
+def test_release_blobs_rollback_keeps_file(client, db, make_user, monkeypatch, wav):
+    _, headers = make_user()
+    sha256 = upload_blob(client, monkeypatch, headers, wav(seconds=0.25), 1)
+
+    async def release_and_fail(session):
+        await release_blobs(session, [sha256])
+        raise RuntimeError("commit failed")
+
+    try:
+        db(release_and_fail)
+    except RuntimeError:
+        pass
+    assert ref_count(db, sha256) == 1
+    assert os.path.exists(storage_path(blob_key(sha256)))
+
+
+def test_reacquired_blob_is_not_deleted(client, db, make_user, monkeypatch, wav):
+    _, headers = make_user()
+    data = wav(seconds=0.75)
+    sha256 = upload_blob(client, monkeypatch, headers, data, 1)
+    assert db(lambda session: release_blobs(session, [sha256])) == [sha256]
+
+    # До удаления файла блоб снова загрузили
+    stored = StoredUpload(key=blob_key(sha256), path=None, size=len(data), sha256=sha256)
+    db(lambda session: acquire_blobs(session, [stored]))
+    assert db(lambda session: delete_unreferenced_blobs(session, [sha256])) == []
+    assert ref_count(db, sha256) == 1
+    assert os.path.exists(storage_path(blob_key(sha256)))
+
+
+def test_failed_batch_upload_deletes_new_blobs(client, db, make_user, monkeypatch, wav):
+    _, headers = make_user()
+    stored, data = wav(seconds=0.5), wav(seconds=1.5)
+    sha256 = upload_blob(client, monkeypatch, headers, stored, 1)
+
+    async def fail(*args):
+        raise RuntimeError("database is unavailable")
+
+    monkeypatch.setattr("backend.files.add_usage", fail)
+    with pytest.raises(RuntimeError):
+        client.post("/api/file/upload/batch", headers=headers, files=[
+            ("files", ("a.wav", stored, "audio/wav")), ("files", ("b.wav", data, "audio/wav")),
+        ])
+
+    # Файл нового блоба удалён, а блоб, на который ссылается другой файл, остался
+    assert not os.path.exists(storage_path(blob_key(hashlib.sha256(data).hexdigest())))
+    assert ref_count(db, hashlib.sha256(data).hexdigest()) is None
+    assert ref_count(db, sha256) == 1
+    assert os.path.exists(storage_path(blob_key(sha256)))
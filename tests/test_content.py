@@ -0,0 +1,65 @@
+import datetime
+import os
+import uuid
+
+from sqlalchemy import select, update
+
+from backend.tiering import demote_file
+from database.models import AudioFile
+
+
+def set_file(db, file_id: str, **values):
+    async def set_values(session):
+        await session.execute(update(AudioFile).where(AudioFile.id == uuid.UUID(file_id)).values(**values))
+
+    db(set_values)
+
+
+def get_file(db, file_id: str):
+    async def get(session):
+        return (await session.execute(select(AudioFile).where(AudioFile.id == uuid.UUID(file_id)))).scalar_one()
+
+    return db(get)
+
+
+def test_read_tracks_access(client, db, make_user, wav):
+    _, headers = make_user()
+    data = wav()
+    file_id = client.post(
+        "/api/file/upload", headers=headers, files={"file": ("a.wav", data, "audio/wav")}
+    ).json()["id"]
+    accessed_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=2)
+    set_file(db, file_id, last_accessed_at=accessed_at)
+
+    response = client.get(f"/api/file/{file_id}/content", headers=headers)
+    assert response.status_code == 200
+    assert response.content == data
+
+    tracker = client.app.state.access_tracker
+    assert uuid.UUID(file_id) in tracker._pending
+    client.portal.call(tracker.flush)
+    assert len(tracker) == 0
+    last_accessed_at = get_file(db, file_id).last_accessed_at.replace(tzinfo=datetime.timezone.utc)
+    assert last_accessed_at > accessed_at + datetime.timedelta(days=1)
+
+    # Отметка свежее ACCESS_RESOLUTION: повторное чтение не пишется в базу
+    assert client.get(f"/api/file/{file_id}/content", headers=headers).status_code == 200
+    assert uuid.UUID(file_id) not in tracker._pending
+
+
+def test_read_cold_file(client, db, make_user, wav):
+    _, headers = make_user()
+    data = wav(seconds=2)
+    uploaded = client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", data, "audio/wav")}).json()
+    path = uploaded["filepath"]
+    assert demote_file(path, max_ratio=1.0) is not None
+    set_file(db, uploaded["id"], cold=True)
+    os.remove(path)
+
+    # Файл прочитан только что, поэтому после отдачи он возвращается в горячий уровень
+    response = client.get(f"/api/file/{uploaded['id']}/content", headers=headers)
+    assert response.status_code == 200
+    assert response.content == data
+    assert get_file(db, uploaded["id"]).cold is False
+    with open(path, "rb") as f:
+        assert f.read() == data
@@ -0,0 +1,33 @@
+from backend.versions import SharedVersions
+
+
+def test_etag_shared_between_processes(client, make_user, monkeypatch, wav):
+    user_id, headers = make_user()
+    client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", wav(), "audio/wav")})
+
+    for url in (f"/api/file/user/{user_id}", "/api/file/all"):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert client.get(url, headers={**headers, "If-None-Match": etag}).status_code == 304
+
+        # Другой процесс приложения с пустым кэшем версий выдаёт ту же версию
+        monkeypatch.setattr(client.app.state, "file_versions", SharedVersions())
+        response = client.get(url, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+
+def test_etag_changes_after_upload(client, make_user, wav):
+    user_id, headers = make_user()
+    url = f"/api/file/user/{user_id}"
+    etag = client.get(url, headers=headers).headers["etag"]
+    all_etag = client.get("/api/file/all", headers=headers).headers["etag"]
+
+    client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", wav(), "audio/wav")})
+
+    response = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert len(response.json()["files"]) == 1
+    assert client.get("/api/file/all", headers={**headers, "If-None-Match": all_etag}).status_code == 200
@@ -0,0 +1,100 @@
+import os
+
+from backend.storage import lock_partial, partial_path
+
+
+def create_session(client, headers, data: bytes) -> str:
+    response = client.post(
+        "/api/file/resumable", headers=headers,
+        json={"filename": "track.wav", "content_type": "audio/wav", "total_size": len(data)}
+    )
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def upload_chunks(client, headers, session_id: str, data: bytes, chunk_size: int = 4096):
+    for offset in range(0, len(data), chunk_size):
+        response = client.patch(
+            f"/api/file/resumable/{session_id}", headers={**headers, "Upload-Offset": str(offset)},
+            content=data[offset:offset + chunk_size]
+        )
+        assert response.status_code == 200
+        assert response.json()["offset"] == min(offset + chunk_size, len(data))
+
+
+def test_complete(client, make_user, wav):
+    _, headers = make_user()
+    data = wav()
+    session_id = create_session(client, headers, data)
+    upload_chunks(client, headers, session_id, data)
+
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["size_bytes"] == len(data)
+    with open(response.json()["filepath"], "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(partial_path(session_id))
+    assert client.get(f"/api/file/resumable/{session_id}", headers=headers).status_code == 404
+
+
+def test_complete_incomplete(client, make_user, wav):
+    _, headers = make_user()
+    data = wav()
+    session_id = create_session(client, headers, data)
+    upload_chunks(client, headers, session_id, data[:4096])
+
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 409
+
+
+def test_complete_while_appending(client, make_user, wav):
+    _, headers = make_user()
+    data = wav()
+    session_id = create_session(client, headers, data)
+    upload_chunks(client, headers, session_id, data)
+
+    # Блокировка частичного файла, как во время PATCH с очередным блоком
+    partial = lock_partial(partial_path(session_id))
+    try:
+        response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+        assert response.status_code == 409
+    finally:
+        partial.close()
+
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 200
+
+
+def test_complete_empty(client, make_user):
+    _, headers = make_user()
+    response = client.post(
+        "/api/file/resumable", headers=headers, json={"filename": "track.wav", "content_type": "audio/wav"}
+    )
+    session_id = response.json()["id"]
+
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 409
+    assert client.get(f"/api/file/resumable/{session_id}", headers=headers).status_code == 200
+
+
+def test_complete_quota_exceeded_keeps_partial(client, make_user, monkeypatch, wav):
+    async def no_check_quota(*args):
+        pass
+
+    # Место заняла параллельная загрузка уже после предварительной проверки квоты
+    monkeypatch.setattr("backend.resumable.check_quota", no_check_quota)
+    data = wav()
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(data) - 1)
+    _, headers = make_user()
+    session_id = create_session(client, headers, data)
+    upload_chunks(client, headers, session_id, data)
+
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 413
+    with open(partial_path(session_id), "rb") as f:
+        assert f.read() == data
+
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(data))
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["size_bytes"] == len(data)
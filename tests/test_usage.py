@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+from sqlalchemy import func, select
+
+from backend.storage import blob_key, storage_path
+from database.models import AudioBlob
+
+
+async def no_check_quota(*args):
+    """
+    Пропускает предварительную проверку квоты, как если бы место заняла параллельная загрузка.
+    """
+
+
+def usage(client, headers) -> tuple[int, int]:
+    response = client.get("/api/user/me/usage", headers=headers)
+    assert response.status_code == 200
+    return response.json()["file_count"], response.json()["total_bytes"]
+
+
+def blob_count(db) -> int:
+    async def count(session):
+        return (await session.execute(select(func.count()).select_from(AudioBlob))).scalar()
+
+    return db(count)
+
+
+def test_delete_releases_usage(client, make_user, wav):
+    _, headers = make_user(is_superuser=True)
+    first, second = wav(seconds=0.5), wav(seconds=1)
+    ids = [
+        client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", data, "audio/wav")}).json()["id"]
+        for data in (first, second)
+    ]
+    assert usage(client, headers) == (2, len(first) + len(second))
+
+    assert client.delete(f"/api/file/{ids[0]}", headers=headers).status_code == 200
+    assert usage(client, headers) == (1, len(second))
+
+    response = client.post("/api/file/batch/delete", headers=headers, json={"ids": [ids[1]]})
+    assert response.status_code == 200
+    assert usage(client, headers) == (0, 0)
+
+
+def test_quota_exceeded(client, make_user, monkeypatch, wav):
+    data = wav()
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(data) * 3 // 2)
+    _, headers = make_user()
+
+    response = client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", data, "audio/wav")})
+    assert response.status_code == 200
+    response = client.post("/api/file/upload", headers=headers, files={"file": ("b.wav", data, "audio/wav")})
+    assert response.status_code == 413
+    assert usage(client, headers) == (1, len(data))
+
+
+def test_quota_exceeded_batch(client, make_user, monkeypatch, wav):
+    data = wav()
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(data) * 3 // 2)
+    _, headers = make_user()
+
+    response = client.post("/api/file/upload/batch", headers=headers, files=[
+        ("files", ("a.wav", data, "audio/wav")), ("files", ("b.wav", data, "audio/wav")),
+    ])
+    assert response.status_code == 200
+    assert [result["status_code"] for result in response.json()["files"]] == [413, 413]
+    assert usage(client, headers) == (0, 0)
+
+
+def test_quota_exceeded_releases_blob(client, db, make_user, monkeypatch, wav):
+    monkeypatch.setattr(client.app.state, "content_addressed_storage", True)
+    monkeypatch.setattr("backend.files.check_quota", no_check_quota)
+    _, headers = make_user()
+    stored, data = wav(seconds=0.5), wav(seconds=2)
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(stored) + 100)
+    response = client.post("/api/file/upload", headers=headers, files={"file": ("a.wav", stored, "audio/wav")})
+    assert response.status_code == 200
+    stored_path = storage_path(blob_key(response.json()["sha256"]))
+    blobs = blob_count(db)
+
+    # Новый блоб не помещается в квоту: его строка и файл удаляются, а уже сохранённый блоб остаётся
+    response = client.post("/api/file/upload", headers=headers, files={"file": ("b.wav", data, "audio/wav")})
+    assert response.status_code == 413
+    response = client.post("/api/file/upload/batch", headers=headers, files=[
+        ("files", ("b.wav", data, "audio/wav")), ("files", ("a.wav", stored, "audio/wav")),
+    ])
+    assert [result["status_code"] for result in response.json()["files"]] == [413, 413]
+
+    assert blob_count(db) == blobs
+    assert os.path.exists(stored_path)
+    assert not os.path.exists(storage_path(blob_key(hashlib.sha256(data).hexdigest())))
+    assert usage(client, headers) == (1, len(stored))
+
+
+def test_quota_exceeded_resumable_releases_blob(client, db, make_user, monkeypatch, wav):
+    monkeypatch.setattr(client.app.state, "content_addressed_storage", True)
+    monkeypatch.setattr("backend.resumable.check_quota", no_check_quota)
+    data = wav(seconds=3)
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(data) - 1)
+    _, headers = make_user()
+    blobs = blob_count(db)
+
+    session_id = client.post(
+        "/api/file/resumable", headers=headers,
+        json={"filename": "track.wav", "content_type": "audio/wav", "total_size": len(data)}
+    ).json()["id"]
+    response = client.patch(
+        f"/api/file/resumable/{session_id}", headers={**headers, "Upload-Offset": "0"}, content=data
+    )
+    assert response.status_code == 200
+
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 413
+    assert blob_count(db) == blobs
+    assert not os.path.exists(storage_path(blob_key(hashlib.sha256(data).hexdigest())))
+    assert usage(client, headers) == (0, 0)
+
+    # Частичный файл остался на месте, и загрузку можно завершить после освобождения места
+    monkeypatch.setattr(client.app.state, "user_quota_bytes", len(data))
+    response = client.post(f"/api/file/resumable/{session_id}/complete", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["sha256"] == hashlib.sha256(data).hexdigest()
+    assert os.path.exists(storage_path(blob_key(hashlib.sha256(data).hexdigest())))
+    assert usage(client, headers) == (1, len(data))
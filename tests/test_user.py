@@ -0,0 +1,23 @@
+from sqlalchemy import delete
+
+from database.models import User
+
+
+def test_patch_me(client, make_user):
+    _, headers = make_user()
+    response = client.patch("/api/user/me", headers=headers, json={"name": "renamed"})
+    assert response.status_code == 200
+    assert response.json()["name"] == "renamed"
+    assert client.get("/api/user/me", headers=headers).json()["name"] == "renamed"
+
+
+def test_patch_me_deleted_user(client, db, make_user):
+    user_id, headers = make_user()
+    # Пользователь попадает в кэш get_user, а затем удаляется в обход кэша (например, из другого процесса)
+    assert client.get("/api/user/me", headers=headers).status_code == 200
+
+    async def remove(session):
+        await session.execute(delete(User).where(User.id == user_id))
+
+    db(remove)
+    assert client.patch("/api/user/me", headers=headers, json={"name": "renamed"}).status_code == 401
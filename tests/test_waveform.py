@@ -0,0 +1,51 @@
+import os
+import struct
+import uuid
+
+from sqlalchemy import update
+
+from backend.tiering import demote_file
+from backend.waveform import peaks_path
+from database.models import AudioFile
+
+
+def set_cold(db, file_id: str):
+    async def mark(session):
+        await session.execute(update(AudioFile).where(AudioFile.id == uuid.UUID(file_id)).values(cold=True))
+
+    db(mark)
+
+
+def test_cold_file_waveform(client, db, make_user, wav):
+    _, headers = make_user()
+    uploaded = client.post(
+        "/api/file/upload", headers=headers, files={"file": ("a.wav", wav(seconds=2), "audio/wav")}
+    ).json()
+    path = uploaded["filepath"]
+    expected = client.get(f"/api/file/{uploaded['id']}/waveform?points=64", headers=headers).json()
+
+    assert demote_file(path, max_ratio=1.0) is not None
+    set_cold(db, uploaded["id"])
+    os.remove(path)
+    os.remove(peaks_path(path))
+
+    # Пики строятся по распакованной копии, а файл остаётся в холодном уровне
+    response = client.get(f"/api/file/{uploaded['id']}/waveform?points=64", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert os.path.exists(peaks_path(path))
+    assert not os.path.exists(path)
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith(".part")]
+
+
+def test_malformed_wav_header(client, make_user):
+    _, headers = make_user()
+    # Блок fmt из двух байт: в нём нет ни количества каналов, ни разрядности
+    data = b"WAVE" + b"fmt " + struct.pack("<I", 2) + b"\x01\x00" + b"data" + struct.pack("<I", 4) + b"\x00" * 4
+    data = b"RIFF" + struct.pack("<I", len(data)) + data
+    file_id = client.post(
+        "/api/file/upload", headers=headers, files={"file": ("broken.wav", data, "audio/wav")}
+    ).json()["id"]
+
+    response = client.get(f"/api/file/{file_id}/waveform", headers=headers)
+    assert response.status_code == 422